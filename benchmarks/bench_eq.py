@@ -0,0 +1,45 @@
+"""
+Benchmark: studio bass/treble EQ — pydub filter overlays vs the biquad shelf bank.
+Run from the repo root: python benchmarks/bench_eq.py
+"""
+import os, sys, time
+import numpy as np
+from pydub import AudioSegment
+from pydub.effects import low_pass_filter, high_pass_filter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.audio_module import apply_shelf_eq
+
+DURATION_S = 60
+RATE = 48000
+BASS, TREBLE = 6, -4
+
+
+def pydub_eq(audio: AudioSegment, bass: int, treble: int) -> AudioSegment:
+    """The original apply_eq: overlay of low/high-pass filtered copies."""
+    if bass != 0:
+        low = low_pass_filter(audio, 250)
+        audio = audio.overlay(low.apply_gain(bass * 1.5))
+    if treble != 0:
+        high = high_pass_filter(audio, 4000)
+        audio = audio.overlay(high.apply_gain(treble * 1.5))
+    return audio
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal((DURATION_S * RATE, 2)) * 0.1).astype(np.float32)
+    segment = AudioSegment(data=(samples * 32767).astype(np.int16).tobytes(),
+                           sample_width=2, frame_rate=RATE, channels=2)
+
+    t_pydub = _timed(pydub_eq, segment, BASS, TREBLE)
+    t_shelf = min(_timed(apply_shelf_eq, samples, BASS, TREBLE) for _ in range(5))
+    print(f"{DURATION_S}s stereo @ {RATE} Hz, bass={BASS:+d} treble={TREBLE:+d}")
+    print(f"  pydub overlay : {t_pydub * 1000:9.1f} ms")
+    print(f"  biquad shelf  : {t_shelf * 1000:9.1f} ms  ({t_pydub / t_shelf:.0f}x faster)")
@@ -0,0 +1,59 @@
+"""
+Benchmark: final mix stage — original pydub path vs the NumPy mix engine.
+Run from the repo root: python benchmarks/bench_mixing.py
+"""
+import os, sys, time
+import numpy as np
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.audio_module import segment_to_array, mix_stems, array_to_segment
+
+DURATION_S = 60
+RATE = 48000
+ROUNDS = 5
+
+
+def _stem(seed: int, level: float) -> AudioSegment:
+    rng = np.random.default_rng(seed)
+    pcm = (rng.standard_normal((DURATION_S * RATE, 2)) * level * 32767).clip(-32768, 32767)
+    return AudioSegment(data=pcm.astype(np.int16).tobytes(), sample_width=2, frame_rate=RATE, channels=2)
+
+
+def pydub_mix(instrumental: AudioSegment, vocal: AudioSegment) -> AudioSegment:
+    def normalize(seg, target_dbfs=-20.0):
+        return seg.apply_gain(target_dbfs - seg.dBFS)
+
+    instrumental = normalize(instrumental) - 6
+    vocal = normalize(vocal) + 6
+    if len(vocal) > len(instrumental):
+        vocal = vocal[: len(instrumental)]
+    return instrumental.overlay(vocal, position=0)
+
+
+def numpy_mix(instrumental: AudioSegment, vocal: AudioSegment) -> AudioSegment:
+    mix = mix_stems(segment_to_array(instrumental), segment_to_array(vocal), 6, 6)
+    return array_to_segment(mix, RATE)
+
+
+def _best_of(fn, *args):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+if __name__ == "__main__":
+    inst, vocal = _stem(1, 0.3), _stem(2, 0.05)
+    t_pydub, ref = _best_of(pydub_mix, inst, vocal)
+    t_numpy, out = _best_of(numpy_mix, inst, vocal)
+    diff = np.abs(segment_to_array(ref) - segment_to_array(out)) * 32768
+    print(f"{DURATION_S}s stereo @ {RATE} Hz, best of {ROUNDS}")
+    print(f"  pydub : {t_pydub * 1000:8.1f} ms")
+    print(f"  numpy : {t_numpy * 1000:8.1f} ms  ({t_pydub / t_numpy:.1f}x faster)")
+    # pydub saturates after each gain step, the engine only once at the final sum,
+    # so a handful of peak samples may differ by more than rounding noise
+    print(f"  median abs difference: {np.median(diff):.0f} LSB, "
+          f"samples off by >16 LSB: {int((diff > 16).sum())} of {diff.size}")
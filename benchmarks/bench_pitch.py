@@ -0,0 +1,41 @@
+"""
+Benchmark: pitch shift — sample-rate respawn + audioop resample vs the phase vocoder.
+Run from the repo root: python benchmarks/bench_pitch.py
+"""
+import os, sys, time
+import numpy as np
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.audio_module import pitch_shift
+
+DURATION_S = 60
+RATE = 48000
+SEMITONES = 3
+
+
+def respawn_shift(audio: AudioSegment, semitones: int) -> AudioSegment:
+    """The original apply_pitch_shift: also changes tempo and duration."""
+    new_rate = int(audio.frame_rate * 2 ** (semitones / 12.0))
+    shifted = audio._spawn(audio.raw_data, overrides={"frame_rate": new_rate})
+    return shifted.set_frame_rate(audio.frame_rate)
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal((DURATION_S * RATE, 2)) * 0.1).astype(np.float32)
+    segment = AudioSegment(data=(samples * 32767).astype(np.int16).tobytes(),
+                           sample_width=2, frame_rate=RATE, channels=2)
+
+    t_old, old = _timed(respawn_shift, segment, SEMITONES)
+    t_new, new = _timed(pitch_shift, samples, SEMITONES)
+    print(f"{DURATION_S}s stereo @ {RATE} Hz, {SEMITONES:+d} semitones")
+    print(f"  respawn + resample : {t_old * 1000:8.1f} ms, output {len(old) / 1000:.2f}s")
+    print(f"  phase vocoder      : {t_new * 1000:8.1f} ms, output {len(new) / RATE:.2f}s "
+          f"({DURATION_S / t_new:.0f}x real time)")
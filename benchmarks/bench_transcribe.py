@@ -0,0 +1,94 @@
+"""
+Benchmark: transcription backends — word error rate and real-time factor.
+Run from the repo root: python benchmarks/bench_transcribe.py [FIXTURE_DIR] [--backends a,b] [--batch N]
+
+FIXTURE_DIR (default benchmarks/fixtures/transcribe) holds audio clips, each
+with a reference transcript next to it: memo1.webm + memo1.txt.
+fetch_transcribe_fixtures.py fills it with a fixed set of LibriSpeech
+test-clean utterances. RTF is processing time divided by audio duration;
+lower is faster. --batch N adds a row per backend that transcribes the
+clips N at a time through transcribe_batch(), to check it matches the
+one-at-a-time WER before TRANSCRIBE_MAX_BATCH is raised.
+"""
+import os, re, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pydub import AudioSegment
+from services.transcribe_module import BACKENDS, load_backend
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "transcribe")
+AUDIO_EXTS = (".wav", ".mp3", ".webm", ".m4a", ".ogg", ".flac")
+
+
+def _words(text: str) -> list:
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """(substitutions + deletions + insertions) / reference words, via edit distance."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return float(bool(hyp))
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def load_fixtures(directory: str) -> list:
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        reference = os.path.join(directory, stem + ".txt")
+        if ext.lower() in AUDIO_EXTS and os.path.exists(reference):
+            with open(reference) as f:
+                fixtures.append((os.path.join(directory, name), f.read()))
+    return fixtures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures", nargs="?", default=DEFAULT_FIXTURES)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--batch", type=int, default=1)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.fixtures):
+        sys.exit(f"No fixture directory at {args.fixtures} (clips + matching .txt references)")
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        sys.exit(f"No audio clips with .txt references in {args.fixtures}")
+    audio_seconds = sum(len(AudioSegment.from_file(path)) / 1000 for path, _ in fixtures)
+    print(f"{len(fixtures)} clips, {audio_seconds:.1f}s of audio")
+    print(f"  {'backend':<16}{'load':>8}{'WER':>8}{'RTF':>8}")
+
+    for name in args.backends.split(","):
+        start = time.perf_counter()
+        try:
+            backend = load_backend(name)
+        except Exception as e:
+            print(f"  {name:<16} skipped: {e}")
+            continue
+        load_seconds = time.perf_counter() - start
+        backend.transcribe(fixtures[0][0])  # warm-up, not timed
+
+        runs = [(name, 1)] + ([(f"{name} x{args.batch}", args.batch)] if args.batch > 1 else [])
+        for label, size in runs:
+            errors, words, busy = 0.0, 0, 0.0
+            for i in range(0, len(fixtures), size):
+                chunk = fixtures[i:i + size]
+                start = time.perf_counter()
+                if size == 1:
+                    hypotheses = [backend.transcribe(chunk[0][0])]
+                else:
+                    hypotheses = backend.transcribe_batch([path for path, _ in chunk])
+                busy += time.perf_counter() - start
+                for (path, reference), hypothesis in zip(chunk, hypotheses):
+                    if isinstance(hypothesis, Exception):
+                        raise hypothesis
+                    n = len(_words(reference))
+                    errors += word_error_rate(reference, hypothesis) * n
+                    words += n
+            print(f"  {label:<16}{load_seconds:7.1f}s{errors / max(words, 1):8.1%}{busy / audio_seconds:8.3f}")
@@ -0,0 +1,59 @@
+"""
+Fetch the transcription benchmark fixtures: the first utterance (-0000) of
+each of the first COUNT chapters of LibriSpeech test-clean (OpenSLR SLR12,
+CC BY 4.0), written as <id>.flac + <id>.txt for bench_transcribe.py.
+Run from the repo root: python benchmarks/fetch_transcribe_fixtures.py [--count 10] [--archive PATH]
+
+The archive (~350 MB) is streamed, not kept; --archive reads a local copy
+instead. manifest.json records each clip's duration and sha256 so results
+from different machines can be checked against the same audio.
+"""
+import os, sys, json, hashlib, tarfile, argparse, urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pydub import AudioSegment
+from bench_transcribe import DEFAULT_FIXTURES
+
+ARCHIVE_URL = "https://www.openslr.org/resources/12/test-clean.tar.gz"
+
+
+def select(archive, count: int) -> dict:
+    """{utterance id: (flac bytes, reference)} for the first utterance of the first count chapters."""
+    audio, references = {}, {}
+    with tarfile.open(fileobj=archive, mode="r|gz") as tar:
+        for member in tar:
+            name = os.path.basename(member.name)
+            if name.endswith("-0000.flac"):
+                audio[name[:-5]] = tar.extractfile(member).read()
+            elif name.endswith(".trans.txt"):
+                for line in tar.extractfile(member).read().decode().splitlines():
+                    utterance, _, text = line.partition(" ")
+                    references[utterance] = text.lower()
+    chosen = sorted(audio, key=lambda u: tuple(int(n) for n in u.split("-")))[:count]
+    return {u: (audio[u], references[u]) for u in chosen}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--archive", help="local test-clean.tar.gz instead of downloading it")
+    parser.add_argument("--out", default=DEFAULT_FIXTURES)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    source = open(args.archive, "rb") if args.archive else urllib.request.urlopen(ARCHIVE_URL)
+    with source:
+        clips = select(source, args.count)
+
+    manifest = []
+    for utterance, (flac, reference) in clips.items():
+        path = os.path.join(args.out, utterance + ".flac")
+        with open(path, "wb") as f:
+            f.write(flac)
+        with open(os.path.join(args.out, utterance + ".txt"), "w") as f:
+            f.write(reference + "\n")
+        manifest.append({"id": utterance, "seconds": round(len(AudioSegment.from_file(path)) / 1000, 2),
+                         "sha256": hashlib.sha256(flac).hexdigest()})
+    with open(os.path.join(args.out, "manifest.json"), "w") as f:
+        json.dump({"source": ARCHIVE_URL, "clips": manifest}, f, indent=2)
+    print(f"{len(manifest)} clips, {sum(c['seconds'] for c in manifest):.1f}s of audio in {args.out}")
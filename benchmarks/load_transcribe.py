@@ -0,0 +1,68 @@
+"""
+Load test: N memos arriving together, transcribed one at a time vs as one micro-batch.
+Run from the repo root: python benchmarks/load_transcribe.py [--memos 4] [--seconds 10] [--random-weights]
+
+Both runs go through WhisperBackend.transcribe_batch with the same decoding
+options, so the only difference is the batch size. --random-weights builds
+a base-sized model with random weights (same compute, no checkpoint
+download) for machines without the Whisper weights cached.
+"""
+import os, sys, time, argparse, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pydub import AudioSegment
+from services.transcribe_module import MODEL_NAME, WhisperBackend
+
+BASE_DIMS = dict(n_mels=80, n_audio_ctx=1500, n_audio_state=512, n_audio_head=8, n_audio_layer=6,
+                 n_vocab=51865, n_text_ctx=448, n_text_state=512, n_text_head=8, n_text_layer=6)
+
+
+def _backend(random_weights: bool) -> WhisperBackend:
+    if not random_weights:
+        return WhisperBackend(MODEL_NAME)
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+    torch.manual_seed(0)
+    backend = WhisperBackend.__new__(WhisperBackend)
+    backend.model = Whisper(ModelDimensions(**BASE_DIMS)).eval()
+    return backend
+
+
+def _memos(directory: str, count: int, seconds: float) -> list:
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        pcm = (rng.standard_normal(int(seconds * 16000)) * 3000).astype(np.int16)
+        path = os.path.join(directory, f"memo{i}.wav")
+        AudioSegment(pcm.tobytes(), sample_width=2, frame_rate=16000, channels=1).export(path, format="wav")
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memos", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--random-weights", action="store_true")
+    args = parser.parse_args()
+
+    backend = _backend(args.random_weights)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = _memos(tmp, args.memos, args.seconds)
+        backend.transcribe_batch(paths[:1])  # warm-up
+
+        start = time.perf_counter()
+        for path in paths:
+            backend.transcribe_batch([path])
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        backend.transcribe_batch(paths)
+        batched = time.perf_counter() - start
+
+    audio = args.memos * args.seconds
+    print(f"{args.memos} memos x {args.seconds:.0f}s arriving together")
+    print(f"  one at a time : {sequential:6.2f}s  ({audio / sequential:5.1f}x real time)")
+    print(f"  one batch     : {batched:6.2f}s  ({audio / batched:5.1f}x real time)")
+    print(f"  throughput gain {sequential / batched:.2f}x")
@@ -1,33 +1,110 @@
 from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-import uvicorn, traceback, json
+import uvicorn, traceback, json, asyncio, importlib, sys, time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from pipeline import run_pipeline
-from services.shopify_module import create_vinyl_product
-from services.elevenlabs_module import get_voices
+from services.encoder_module import is_encoding, follow, media_type_for
+from services.metrics_module import render as render_metrics
+from services.jobs_module import submit as submit_job, get_job
+from services.admission_module import QueueFull, get_admission
 import os, uuid
-from google import genai
-from google.genai import types
-from elevenlabs.client import ElevenLabs
-from elevenlabs import VoiceSettings
 
-from dotenv import load_dotenv
+# Provider SDKs, torch/Whisper and the pipeline are imported lazily (and warmed
+# by the lifespan hook) so the app starts serving in well under a second.
 load_dotenv(override=True)
 
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 ssl.create_default_context = ssl._create_unverified_context
 
-app = FastAPI()
+
+async def run_pipeline(*args, **kwargs) -> dict:
+    from pipeline import run_pipeline as _run_pipeline
+    return await _run_pipeline(*args, **kwargs)
+
+
+# Warm-up state per component: pending, ready, skipped or "failed: ...".
+# /ready turns 200 once every REQUIRED_WARM component is ready.
+REQUIRED_WARM = ("pipeline", "whisper")
+_warm = {"pipeline": "pending", "whisper": "pending", "lyria": "pending", "clients": "pending", "voices": "pending"}
+_warm_seconds = {}
+
+
+async def _warm_step(name: str, fn, *, skip_unless: str = None):
+    if skip_unless and not os.getenv(skip_unless):
+        _warm[name] = "skipped"
+        return
+    start = time.monotonic()
+    try:
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+        _warm[name] = "ready"
+    except Exception as e:
+        _warm[name] = f"failed: {e}"
+        print(f"      Warm-up of {name} failed: {e}")
+    _warm_seconds[name] = round(time.monotonic() - start, 2)
+
+
+def _warm_whisper():
+    from services import transcribe_module
+    # Start the transcription workers, which load Whisper themselves (or load it in-process)
+    if not transcribe_module.start_pool():
+        transcribe_module._get_model()
+
+
+def _warm_clients():
+    from services import elevenlabs_module, gemini_module
+    if os.getenv("ELEVENLABS_API_KEY"):
+        elevenlabs_module._get_client()
+    if os.getenv("GEMINI_API_KEY"):
+        gemini_module._get_client()
+
+
+async def _warm_up():
+    """Import the pipeline, then load Whisper, connect Lyria and prefetch voices in parallel."""
+    await _warm_step("pipeline", lambda: asyncio.to_thread(importlib.import_module, "pipeline"))
+    from services.lyria_module import get_pool
+    await asyncio.gather(
+        _warm_step("whisper", lambda: asyncio.to_thread(_warm_whisper)),
+        # Pre-connect Lyria sessions on the app's loop so the first song skips the handshake
+        _warm_step("lyria", lambda: get_pool().warm(), skip_unless="GEMINI_API_KEY"),
+        _warm_step("clients", lambda: asyncio.to_thread(_warm_clients)),
+        _warm_step("voices", lambda: asyncio.to_thread(_get_voices), skip_unless="ELEVENLABS_API_KEY"),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_task = asyncio.create_task(_warm_up())
+    yield
+    warm_task.cancel()
+    if "services.lyria_module" in sys.modules:
+        await sys.modules["services.lyria_module"].get_pool().close()
+    if "services.transcribe_module" in sys.modules:
+        sys.modules["services.transcribe_module"].stop_pool()
+    if "services.backboard_module" in sys.modules:
+        await sys.modules["services.backboard_module"].close()
+    if "services.http_module" in sys.modules:
+        await sys.modules["services.http_module"].close()
+
+
+def _get_voices() -> list:
+    from services.elevenlabs_module import get_voices
+    return get_voices()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-@app.post("/generate")
-async def generate(audio: UploadFile = File(...), genre: str = Form(default="pop"),
-                   studio: str = Form(default="{}")):
+SSE_KEEPALIVE_SECONDS = 15
+
+
+async def _save_upload(audio: UploadFile, studio: str):
     os.makedirs("temp", exist_ok=True)
     input_path = f"temp/input_{uuid.uuid4().hex}.webm"
     with open(input_path, "wb") as f:
@@ -36,48 +113,187 @@ async def generate(audio: UploadFile = File(...), genre: str = Form(default="pop
         studio_params = json.loads(studio) if studio else {}
     except (json.JSONDecodeError, TypeError):
         studio_params = {}
+    return input_path, studio_params
+
+
+def _audio_url(output_path: str) -> str:
+    return f"/audio/{os.path.basename(output_path)}"
+
+
+def _result_body(result: dict, debug: bool = False) -> dict:
+    body = {
+        "audio_url": _audio_url(result["output_path"]),
+        "song_title": result["song_title"],
+        "lyrics": result["lyrics"],
+        "mood": result["mood"],
+        "bpm": result["bpm"],
+        "genre": result["genre"],
+        "key": result["key"],
+        "sections": result.get("sections", []),
+    }
+    if debug:
+        body["timings"] = result.get("timings", {})
+    return body
+
+
+def _busy(error: QueueFull) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"error": str(error), "retry_after": error.retry_after},
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+@app.post("/generate")
+async def generate(audio: UploadFile = File(...), genre: str = Form(default="pop"),
+                   studio: str = Form(default="{}"), debug: bool = Form(default=False),
+                   fresh: bool = Form(default=False), direct_audio: bool = Form(default=False)):
+    """Blocking variant: holds the request open until the song is ready. Prefer POST /jobs."""
+    try:
+        ticket = get_admission().admit()
+    except QueueFull as e:
+        return _busy(e)
     try:
-        result = await run_pipeline(input_path, genre, studio_params)
-        filename = os.path.basename(result["output_path"])
-        return JSONResponse({
-            "audio_url": f"/audio/{filename}",
-            "song_title": result["song_title"],
-            "lyrics": result["lyrics"],
-            "mood": result["mood"],
-            "bpm": result["bpm"],
-            "genre": result["genre"],
-            "key": result["key"],
-        })
+        input_path, studio_params = await _save_upload(audio, studio)
+        async with ticket:
+            result = await run_pipeline(input_path, genre, studio_params, fresh=fresh, direct_audio=direct_audio)
+        return JSONResponse(_result_body(result, debug))
     except Exception as e:
+        ticket.abandon()
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.post("/jobs")
+async def create_job(audio: UploadFile = File(...), genre: str = Form(default="pop"),
+                     studio: str = Form(default="{}"), debug: bool = Form(default=False),
+                     fresh: bool = Form(default=False), direct_audio: bool = Form(default=False)):
+    """Start the pipeline in the background and return a job id immediately."""
+    try:
+        ticket = get_admission().admit()
+    except QueueFull as e:
+        return _busy(e)
+    try:
+        input_path, studio_params = await _save_upload(audio, studio)
+    except Exception:
+        ticket.abandon()
+        raise
+
+    async def run(job):
+        def progress(event, data):
+            if event == "encoding":
+                # The track is playable (streamed) from here on
+                data = {"audio_url": _audio_url(data["output_path"])}
+            job.publish(event, data)
+
+        try:
+            async with ticket:
+                result = await run_pipeline(input_path, genre, studio_params, progress=progress, fresh=fresh,
+                                            direct_audio=direct_audio)
+        except Exception:
+            traceback.print_exc()
+            raise
+        return _result_body(result, debug)
+
+    job = submit_job(run)
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    })
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Current status of a job, including its result once done."""
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return JSONResponse(job.to_dict())
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events stream of a job's progress: stage_started,
+    stage_finished, stage_failed, encoding, then done or failed. Replays
+    past events, resuming after Last-Event-ID on reconnect.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    try:
+        after = int(request.headers.get("last-event-id", -1))
+    except ValueError:
+        after = -1
+
+    async def event_stream():
+        async for item in job.stream(after, keepalive=SSE_KEEPALIVE_SECONDS):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event_id, event, data = item
+            yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/api/voices")
 async def list_voices():
     """Return available ElevenLabs voices."""
     try:
-        voices = get_voices()
+        voices = await asyncio.to_thread(_get_voices)
         return JSONResponse(voices)
     except Exception as e:
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint — stage/provider latency histograms and counters."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the pipeline is imported and Whisper is loaded."""
+    is_ready = all(_warm[name] == "ready" for name in REQUIRED_WARM)
+    return JSONResponse(status_code=200 if is_ready else 503,
+                        content={"ready": is_ready, "components": _warm, "seconds": _warm_seconds})
+
+
+@app.get("/api/lyria/stats")
+async def lyria_stats():
+    """Lyria generation counters plus session-pool size and wait times."""
+    from services.lyria_module import get_stats
+    return JSONResponse(get_stats())
+
+
+@app.get("/api/admission/stats")
+async def admission_stats():
+    """Pipeline queue depth and per-stage slot usage, for sizing instances."""
+    return JSONResponse(get_admission().stats())
+
+
 @app.get("/audio/{filename}")
 async def serve_audio(filename: str):
     path = f"temp/{filename}"
+    media_type = media_type_for(path)
+    if is_encoding(path):
+        # Still being encoded — stream what exists so far with chunked transfer
+        return StreamingResponse(follow(path), media_type=media_type)
     if not os.path.exists(path):
         return JSONResponse(status_code=404, content={"error": "File not found"})
-    return FileResponse(path, media_type="audio/mpeg", filename="MemoMuse_Track.mp3")
+    ext = os.path.splitext(filename)[1]
+    return FileResponse(path, media_type=media_type, filename=f"MemoMuse_Track{ext}")
 
 
 @app.post("/api/publish")
 async def publish_vinyl(request: Request):
     """Create a vinyl record product on Shopify for the generated song."""
     try:
+        from services.shopify_module import create_vinyl_product
         body = await request.json()
-        result = create_vinyl_product(
+        result = await create_vinyl_product(
             song_title=body.get("song_title", "Untitled Track"),
             lyrics=body.get("lyrics", ""),
             genre=body.get("genre", ""),
@@ -94,6 +310,28 @@ async def publish_vinyl(request: Request):
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+MAX_BULK_PUBLISH = 250
+
+
+@app.post("/api/publish/bulk")
+async def publish_vinyl_bulk(request: Request):
+    """Create vinyl products for a catalogue of songs, reporting each one's status (created, exists, failed)."""
+    try:
+        from services.shopify_module import publish_catalog
+        body = await request.json()
+        tracks = body.get("tracks") if isinstance(body, dict) else None
+        if not isinstance(tracks, list) or not tracks or not all(isinstance(t, dict) for t in tracks):
+            return JSONResponse(status_code=400, content={"error": "tracks must be a non-empty list of songs"})
+        if len(tracks) > MAX_BULK_PUBLISH:
+            return JSONResponse(status_code=400, content={"error": f"At most {MAX_BULK_PUBLISH} tracks per request"})
+        results = await publish_catalog(tracks)
+        counts = {status: sum(1 for r in results if r["status"] == status) for status in ("created", "exists", "failed")}
+        return JSONResponse({"results": results, **counts})
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
 @app.get("/api/config")
 async def get_config():
     return JSONResponse({
@@ -117,30 +355,8 @@ async def voicemail_analyze(file: UploadFile = File(...)):
     ]
     mime_type = raw_mime if raw_mime in supported_mimes else "audio/mpeg"
 
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-    system_prompt = (
-        "You are an assistant that analyzes customer support voicemails for a Shopify-like online store. "
-        "Listen to the audio carefully and output strict JSON with exactly these fields: "
-        "transcript, intent, sentiment, urgency, summary, suggestedReply. "
-        "intent must be one of: ORDER_STATUS, RETURN, GENERAL_QUESTION, COMPLAINT, OTHER. "
-        "sentiment must be one of: POSITIVE, NEUTRAL, NEGATIVE. "
-        "urgency must be one of: LOW, MEDIUM, HIGH. "
-        "Return ONLY valid JSON — no markdown code blocks, no explanation, no extra text."
-    )
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[
-            system_prompt,
-            types.Part.from_bytes(data=audio_bytes, mime_type=mime_type),
-        ],
-    )
-    text = response.text.strip()
-    if text.startswith("```"):
-        text = text.split("```")[1]
-        if text.startswith("json"):
-            text = text[4:]
-        text = text.strip()
-    return JSONResponse(json.loads(text))
+    from services.gemini_module import analyze_voicemail
+    return JSONResponse(await analyze_voicemail(audio_bytes, mime_type))
 
 
 @app.post("/api/voicemail/tts")
@@ -149,20 +365,8 @@ async def voicemail_tts(request: Request):
     text = body.get("text", "").strip()
     if not text:
         return JSONResponse(status_code=400, content={"error": "No text provided"})
-    voice_id = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
-    client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-    audio_chunks = client.text_to_speech.convert(
-        voice_id=voice_id,
-        text=text,
-        model_id="eleven_multilingual_v2",
-        voice_settings=VoiceSettings(
-            stability=0.5,
-            similarity_boost=0.75,
-            style=0.0,
-            use_speaker_boost=True,
-        ),
-    )
-    audio_bytes = b"".join(audio_chunks)
+    from services.elevenlabs_module import speak
+    audio_bytes = await speak(text)
     return Response(audio_bytes, media_type="audio/mpeg")
 
 
@@ -1,148 +1,197 @@
 import os, asyncio, uuid
-from pydub import AudioSegment
-from pydub.effects import low_pass_filter, high_pass_filter
-from services.gemini_module import get_gemini_analysis
+from services.gemini_module import get_gemini_analysis, get_gemini_audio_analysis
 from services.elevenlabs_module import convert_speech_to_speech, synthesize_vocals
-from services.lyria_module import generate_instrumental
-from services.transcribe_module import transcribe_audio
+from services.lyria_module import generate_instrumental_async
+from services.transcribe_module import transcribe_audio, trim_speech
 from services.backboard_module import store_session
 from services.featherless_module import refine_lyrics
+from services.encoder_module import encode_blocks, encode_stream, get_profile
+from scheduler import Stage, StageGraph
+from services.metrics_module import PIPELINES_IN_FLIGHT, observe_stage_event, request_trace
+from services.admission_module import stage_slot
+from services.audio_module import SAMPLE_RATE, load_stem, mix_stems, mix_blocks, apply_shelf_eq, pitch_shift
 
 VOCAL_BOOST_DB = 6
 INSTRUMENTAL_CUT_DB = 6
 
 
-def apply_eq(audio: AudioSegment, bass: int = 0, treble: int = 0) -> AudioSegment:
-    """Apply bass/treble EQ. Values range from -10 to +10."""
-    if bass != 0:
-        low = low_pass_filter(audio, 250)
-        audio = audio.overlay(low.apply_gain(bass * 1.5))
-    if treble != 0:
-        high = high_pass_filter(audio, 4000)
-        audio = audio.overlay(high.apply_gain(treble * 1.5))
-    return audio
+def _speech_path(run_id: str) -> str:
+    return f"temp/speech_{run_id}.wav"
 
 
-def apply_pitch_shift(audio: AudioSegment, semitones: int = 0) -> AudioSegment:
-    """Shift pitch by semitones (-12 to +12) via sample rate manipulation."""
-    if semitones == 0:
-        return audio
-    factor = 2 ** (semitones / 12.0)
-    new_rate = int(audio.frame_rate * factor)
-    shifted = audio._spawn(audio.raw_data, overrides={"frame_rate": new_rate})
-    return shifted.set_frame_rate(audio.frame_rate)
+async def _trim(ctx):
+    speech = await asyncio.to_thread(trim_speech, ctx["input_path"], _speech_path(ctx["run_id"]))
+    if speech.offsets is not None:
+        print(f"      VAD kept {speech.speech_seconds:.1f}s of {speech.duration:.1f}s")
+    return speech
 
 
-async def run_pipeline(input_path: str, genre: str, studio: dict = None) -> dict:
-    os.makedirs("temp", exist_ok=True)
-    run_id = uuid.uuid4().hex[:8]
-
-    # Step 1: Transcribe
-    raw_transcript = await asyncio.to_thread(transcribe_audio, input_path)
+async def _transcribe(ctx) -> dict:
+    """Cut silence with the VAD pre-pass, then transcribe only the speech."""
+    speech = await _trim(ctx)
+    async with stage_slot("whisper"):
+        raw_transcript = await asyncio.to_thread(transcribe_audio, speech.path, speech.fingerprint)
     print(f"[1/6] Transcription: {raw_transcript[:100]}...")
+    return {"raw_transcript": raw_transcript, "speech": speech}
+
+
+def _parse_bpm(bpm) -> int:
+    if isinstance(bpm, str):
+        return int("".join(c for c in bpm if c.isdigit()) or "120")
+    return bpm
+
+
+# Analysis fields published as soon as Gemini streams them, so the instrumental
+# (style_prompt + bpm) starts while the lyrics are still being written
+_EARLY_FIELDS = {"style_prompt": lambda v: v, "bpm": _parse_bpm, "mood": lambda v: v,
+                 "contains_lyrics": lambda v: v}
 
-    # Step 2: Gemini analysis — full lyrics + style prompt + humming detection
-    gemini_result = await asyncio.to_thread(get_gemini_analysis, raw_transcript, genre)
+
+def _field_emitter(ctx):
+    """on_field callback for the Gemini worker thread: publish the early fields on the loop."""
+    loop = asyncio.get_running_loop()
+
+    def on_field(key, value):
+        if key in _EARLY_FIELDS:
+            loop.call_soon_threadsafe(ctx.emit, key, _EARLY_FIELDS[key](value))
+    return on_field
+
+
+def _analysis_outputs(gemini_result: dict) -> dict:
     cleaned_lyrics = gemini_result["cleaned_lyrics"]
-    style_prompt = gemini_result["style_prompt"]
     mood = gemini_result.get("mood", "neutral")
-    bpm = gemini_result.get("bpm", 120)
-    if isinstance(bpm, str):
-        bpm = int("".join(c for c in bpm if c.isdigit()) or "120")
+    bpm = _parse_bpm(gemini_result.get("bpm", 120))
     contains_lyrics = gemini_result.get("contains_lyrics", True)
     print(f"[2/6] Gemini: mood={mood}, bpm={bpm}, contains_lyrics={contains_lyrics}")
     print(f"      Lyrics preview: {cleaned_lyrics[:120]}...")
+    return {
+        "analysis": gemini_result,
+        "cleaned_lyrics": cleaned_lyrics,
+        "style_prompt": gemini_result["style_prompt"],
+        "mood": mood,
+        "bpm": bpm,
+        "contains_lyrics": contains_lyrics,
+    }
+
+
+async def _analyze(ctx) -> dict:
+    """Gemini analysis — full lyrics + style prompt + humming detection."""
+    gemini_result = await asyncio.to_thread(get_gemini_analysis, ctx["raw_transcript"], ctx["genre"],
+                                            ctx["fresh"], _field_emitter(ctx))
+    return _analysis_outputs(gemini_result)
+
+
+async def _listen(ctx) -> dict:
+    """Direct-audio mode: the trimmed memo goes straight to Gemini, which transcribes and analyses it at once."""
+    speech = await _trim(ctx)
+    gemini_result = await asyncio.to_thread(get_gemini_audio_analysis, speech.path, ctx["genre"],
+                                            speech.fingerprint, ctx["fresh"], _field_emitter(ctx))
+    raw_transcript = gemini_result.get("transcript", "")
+    print(f"[1/6] Transcription (Gemini): {raw_transcript[:100]}...")
+    return {"raw_transcript": raw_transcript, "speech": speech, **_analysis_outputs(gemini_result)}
+
 
-    # Step 3: Backboard.io session memory (optional)
+async def _store_session(ctx) -> dict:
+    """Backboard.io session memory (optional) — queued for the background writer, never awaited."""
     try:
-        await store_session(raw_transcript, cleaned_lyrics, style_prompt, genre, mood)
-        print("[3/6] Backboard session stored")
+        if store_session(ctx["raw_transcript"], ctx["cleaned_lyrics"], ctx["style_prompt"], ctx["genre"], ctx["mood"]):
+            print("[3/6] Backboard session queued")
     except Exception as e:
         print(f"[3/6] Backboard skipped: {e}")
+    return {}
 
-    # Step 4: Featherless lyric refinement (optional)
+
+async def _refine(ctx) -> dict:
+    """Featherless lyric refinement (optional, under a latency budget) — falls back to the Gemini lyrics."""
+    lyrics = ctx["cleaned_lyrics"]
     try:
-        refined = await asyncio.to_thread(refine_lyrics, cleaned_lyrics, genre, mood)
+        refined = await refine_lyrics(lyrics, ctx["genre"], ctx["mood"])
         if refined:
-            cleaned_lyrics = refined
-        print("[4/6] Featherless refined lyrics")
+            lyrics = refined
+            print("[4/6] Featherless refined lyrics")
+        else:
+            print("[4/6] Featherless unavailable, keeping Gemini lyrics")
     except Exception as e:
         print(f"[4/6] Featherless skipped: {e}")
+    return {"lyrics": lyrics}
 
-    # Parse studio controls
-    if not studio:
-        studio = {}
-    voice_id = studio.get("voice_id") or None
-    voice_stability = studio.get("stability", 0.3)
-    voice_similarity = studio.get("similarity", 0.75)
-    voice_style = studio.get("style", 0.45)
-    bass_eq = studio.get("bass", 0)
-    treble_eq = studio.get("treble", 0)
-    pitch_shift = studio.get("pitch", 0)
-    vocal_balance = studio.get("vocal_balance", 0)
 
-    # Step 5: Parallel generation — instrumental + vocals
-    inst_path = f"temp/instrumental_{run_id}.wav"
-    vocal_path = f"temp/vocals_{run_id}.mp3"
-    instrumental_task = asyncio.create_task(
-        asyncio.to_thread(generate_instrumental, style_prompt, bpm, inst_path)
-    )
-    if contains_lyrics:
-        vocal_task = asyncio.create_task(
-            asyncio.to_thread(synthesize_vocals, cleaned_lyrics, vocal_path,
-                              voice_id, voice_stability, voice_similarity, voice_style)
-        )
-        print(f"      → Using TTS{' with voice ' + voice_id[:8] if voice_id else ''}")
-    else:
-        vocal_task = asyncio.create_task(
-            asyncio.to_thread(convert_speech_to_speech, input_path, vocal_path, voice_id)
-        )
-        print("      -> Using STS to preserve hummed melody")
-    inst_path = await instrumental_task
+async def _instrumental(ctx) -> dict:
+    inst_path = f"temp/instrumental_{ctx['run_id']}.wav"
+    async with stage_slot("lyria"):
+        inst_path = await generate_instrumental_async(ctx["style_prompt"], ctx["bpm"], inst_path)
+    print("[5/6] Instrumental generated")
+    return {"inst_path": inst_path}
+
+
+async def _vocals(ctx) -> dict:
+    """TTS for real lyrics, STS for humming. Only the TTS path waits for refined lyrics."""
+    studio = ctx["studio"]
+    voice_id = studio.get("voice_id") or None
+    vocal_path = f"temp/vocals_{ctx['run_id']}.mp3"
+    sections = []  # TTS section boundaries in the stem, which starts at 0 in the mix
     try:
-        vocal_path = await vocal_task
+        if ctx["contains_lyrics"]:
+            lyrics = await ctx.get("lyrics")
+            print(f"      → Using TTS{' with voice ' + voice_id[:8] if voice_id else ''}")
+            async with stage_slot("vocals"):
+                vocal_path = await asyncio.to_thread(
+                    synthesize_vocals, lyrics, vocal_path, voice_id,
+                    studio.get("stability", 0.3), studio.get("similarity", 0.75), studio.get("style", 0.45),
+                    sections=sections,
+                )
+        else:
+            print("      -> Using STS to preserve hummed melody")
+            async with stage_slot("vocals"):
+                # The original recording, not the VAD-trimmed 16 kHz copy: the
+                # melody's timing and full bandwidth are what STS preserves
+                vocal_path = await asyncio.to_thread(convert_speech_to_speech, ctx["input_path"], vocal_path, voice_id)
+        print("[5/6] Vocals generated")
     except Exception as e:
-        vocal_path = None
+        vocal_path, sections = None, []
         print(f"[5/6] Vocal generation failed ({e}), falling back to instrumental only")
+    return {"vocal_path": vocal_path, "vocal_sections": sections}
 
-    if vocal_path:
-        print("[5/6] Audio generated")
-    else:
-        print("[5/6] Instrumental generated (vocals skipped)")
-
-    # Step 6: Mix — layer vocals over instrumental, or export instrumental only
-    instrumental = AudioSegment.from_file(inst_path)
 
-    if vocal_path:
-        vocal = AudioSegment.from_file(vocal_path)
-
-        def normalize(seg, target_dbfs=-20.0):
-            change = target_dbfs - seg.dBFS
-            return seg.apply_gain(change)
-
-        adjusted_vocal_boost = VOCAL_BOOST_DB + vocal_balance
-        adjusted_inst_cut = INSTRUMENTAL_CUT_DB - vocal_balance
+def _render(inst_path: str, vocal_path: str, studio: dict, output_path: str, on_start=None):
+    """Mix the stems, apply studio post-processing and stream-encode to output_path."""
+    bass_eq = studio.get("bass", 0)
+    treble_eq = studio.get("treble", 0)
+    semitones = studio.get("pitch", 0)
+    vocal_balance = studio.get("vocal_balance", 0)
 
-        instrumental = normalize(instrumental) - adjusted_inst_cut
-        vocal = normalize(vocal) + adjusted_vocal_boost
+    # Layer vocals over instrumental, or export instrumental only.
+    # Stems are decoded once into NumPy buffers and mixed in place.
+    instrumental = load_stem(inst_path)
+    vocal = load_stem(vocal_path) if vocal_path else None
+    gains = dict(vocal_boost_db=VOCAL_BOOST_DB + vocal_balance, inst_cut_db=INSTRUMENTAL_CUT_DB - vocal_balance)
+    if bass_eq or treble_eq:
+        print(f"      Applying EQ: bass={bass_eq:+d}, treble={treble_eq:+d}")
+    profile = studio.get("output_format")
 
-        if len(vocal) > len(instrumental):
-            vocal = vocal[: len(instrumental)]
-        combined = instrumental.overlay(vocal, position=0)
+    if not semitones:
+        # Mix, EQ and encode one block at a time: the file is servable from
+        # /audio after the first block, while the rest is still being mixed
+        encode_blocks(mix_blocks(instrumental, vocal, bass=bass_eq, treble=treble_eq, **gains),
+                      output_path, profile, SAMPLE_RATE, instrumental.shape[1], on_start=on_start)
     else:
-        combined = instrumental
+        # The phase vocoder needs the whole mix, so encoding starts once it is done
+        mix = apply_shelf_eq(mix_stems(instrumental, vocal, **gains), bass_eq, treble_eq)
+        mix = pitch_shift(mix, semitones)
+        print(f"      Applied pitch shift: {semitones:+d} semitones")
+        encode_stream(mix, output_path, profile, on_start=on_start)
+    print(f"[6/6] Final mix exported ({len(instrumental) / SAMPLE_RATE:.1f}s)")
 
-    # Apply studio post-processing
-    if bass_eq or treble_eq:
-        combined = apply_eq(combined, bass_eq, treble_eq)
-        print(f"      Applied EQ: bass={bass_eq:+d}, treble={treble_eq:+d}")
-    if pitch_shift:
-        combined = apply_pitch_shift(combined, pitch_shift)
-        print(f"      Applied pitch shift: {pitch_shift:+d} semitones")
 
-    output_path = f"temp/final_{run_id}.mp3"
-    combined.export(output_path, format="mp3")
-    print(f"[6/6] Final mix exported ({len(combined) / 1000:.1f}s)")
+async def _mix(ctx) -> dict:
+    """Mix, post-process and stream-encode the final track."""
+    studio = ctx["studio"]
+    inst_path, vocal_path = ctx["inst_path"], ctx["vocal_path"]
+    progress = ctx["progress"]
+    output_path = f"temp/final_{ctx['run_id']}.{get_profile(studio.get('output_format'))['ext']}"
+    on_start = (lambda path: progress("encoding", {"output_path": path})) if progress else None
+    async with stage_slot("mix"):
+        await asyncio.to_thread(_render, inst_path, vocal_path, studio, output_path, on_start)
 
     # Cleanup intermediate files
     for p in [inst_path, vocal_path]:
@@ -152,13 +201,88 @@ async def run_pipeline(input_path: str, genre: str, studio: dict = None) -> dict
             os.remove(p)
         except OSError:
             pass
+    return {"output_path": output_path}
+
+
+ANALYSIS_OUTPUTS = ("analysis", "cleaned_lyrics", "style_prompt", "mood", "bpm", "contains_lyrics")
+
+# Lyria only needs style_prompt + bpm, so it starts right after analysis and runs
+# alongside lyric refinement; Backboard is fire-and-forget.
+_PRODUCTION_STAGES = [
+    Stage("store_session", _store_session, background=True,
+          inputs=("raw_transcript", "cleaned_lyrics", "style_prompt", "genre", "mood")),
+    Stage("refine", _refine, inputs=("cleaned_lyrics", "genre", "mood"), outputs=("lyrics",)),
+    Stage("instrumental", _instrumental, inputs=("style_prompt", "bpm", "run_id"), outputs=("inst_path",)),
+    Stage("vocals", _vocals, inputs=("contains_lyrics", "input_path", "run_id", "studio"),
+          lazy_inputs=("lyrics",), outputs=("vocal_path", "vocal_sections")),
+    Stage("mix", _mix, inputs=("inst_path", "vocal_path", "studio", "run_id", "progress"),
+          outputs=("output_path",)),
+]
+
+PIPELINE = StageGraph([
+    Stage("transcribe", _transcribe, inputs=("input_path", "run_id"), outputs=("raw_transcript", "speech")),
+    Stage("analyze", _analyze, inputs=("raw_transcript", "genre", "fresh"), outputs=ANALYSIS_OUTPUTS),
+    *_PRODUCTION_STAGES,
+])
+
+# Same production stages, fed by one Gemini call on the audio instead of Whisper + a text call
+DIRECT_AUDIO_PIPELINE = StageGraph([
+    Stage("listen", _listen, inputs=("input_path", "run_id", "genre", "fresh"),
+          outputs=("raw_transcript", "speech", *ANALYSIS_OUTPUTS)),
+    *_PRODUCTION_STAGES,
+])
+
+
+async def run_pipeline(input_path: str, genre: str, studio: dict = None, progress=None,
+                       fresh: bool = False, direct_audio: bool = False) -> dict:
+    """
+    Run the memo-to-song pipeline as a stage graph. progress, if given, is
+    called as progress(event, data) for stage_started / stage_finished /
+    stage_failed, and with ("encoding", {"output_path": ...}) once the final
+    file starts growing and can be streamed from /audio. fresh bypasses the
+    cached Gemini analysis for a new take on the same memo. direct_audio
+    sends the memo to Gemini instead of transcribing it with Whisper first.
+    """
+    os.makedirs("temp", exist_ok=True)
+
+    def on_event(event, data):
+        observe_stage_event(event, data)
+        if progress:
+            progress(event, data)
+
+    run_id = uuid.uuid4().hex[:8]
+    PIPELINES_IN_FLIGHT.inc()
+    try:
+        with request_trace() as provider_calls:
+            graph = DIRECT_AUDIO_PIPELINE if direct_audio else PIPELINE
+            report = await graph.run({
+                "input_path": input_path,
+                "genre": genre,
+                "studio": studio or {},
+                "run_id": run_id,
+                "progress": progress,
+                "fresh": fresh,
+            }, on_event=on_event)
+    finally:
+        PIPELINES_IN_FLIGHT.dec()
+        # The VAD-trimmed memo is only read by transcription/analysis; drop it however the run ended
+        try:
+            os.remove(_speech_path(run_id))
+        except OSError:
+            pass
+    print(f"      Critical path: {' → '.join(report.critical_path)}")
 
+    values = report.values
+    analysis = values["analysis"]
     return {
-        "output_path": output_path,
-        "song_title": gemini_result.get("song_title", "Untitled Track"),
-        "lyrics": cleaned_lyrics,
-        "mood": mood,
-        "bpm": bpm,
-        "genre": gemini_result.get("detected_genre", genre),
-        "key": gemini_result.get("key", ""),
+        "output_path": values["output_path"],
+        "song_title": analysis.get("song_title", "Untitled Track"),
+        "lyrics": values["lyrics"],
+        "mood": values["mood"],
+        "bpm": values["bpm"],
+        "genre": analysis.get("detected_genre", genre),
+        "key": analysis.get("key", ""),
+        "sections": values.get("vocal_sections", []),
+        "timings": {**report.summary(), "analysis_mode": "direct_audio" if direct_audio else "whisper",
+                    "providers": provider_calls},
     }
@@ -0,0 +1,219 @@
+"""
+Dependency-graph stage scheduler. A pipeline is a list of Stages with declared
+inputs and outputs; each stage starts as soon as its inputs resolve, and
+background stages run fire-and-forget off the critical path.
+"""
+import asyncio, time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+_background_tasks = set()
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[["StageContext"], Awaitable[dict]]
+    inputs: tuple = ()
+    outputs: tuple = ()
+    lazy_inputs: tuple = ()  # awaited only if the stage asks for them via ctx.get()
+    background: bool = False
+
+
+@dataclass
+class StageTiming:
+    name: str
+    start: float = None
+    end: float = None
+    blocked_by: str = None  # producer of the input that resolved last
+    blocked_on: str = None
+    error: str = None
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+@dataclass
+class RunReport:
+    values: dict
+    timings: dict = field(default_factory=dict)
+    critical_path: list = field(default_factory=list)
+
+    def summary(self) -> dict:
+        return {
+            "stages": {name: round(t.duration * 1000, 1) for name, t in self.timings.items() if t.end},
+            "critical_path": self.critical_path,
+        }
+
+
+class StageContext:
+    def __init__(self, graph: "_GraphRun", stage: Stage, inputs: dict):
+        self._run = graph
+        self._stage = stage
+        self.inputs = inputs
+
+    def __getitem__(self, key):
+        return self.inputs[key]
+
+    async def get(self, key):
+        """Await a lazy input declared on the stage."""
+        if key not in self._stage.lazy_inputs and key not in self._stage.inputs:
+            raise KeyError(f"{self._stage.name} did not declare input {key!r}")
+        value = await self._run.futures[key]
+        self._run.note_dependency(self._stage.name, key)
+        return value
+
+    def emit(self, key, value):
+        """Publish one of this stage's outputs before the stage finishes."""
+        if key not in self._stage.outputs:
+            raise KeyError(f"{self._stage.name} does not produce {key!r}")
+        self._run.resolve(key, value)
+
+
+class StageGraph:
+    def __init__(self, stages: list):
+        self.stages = stages
+        self.producers = {}
+        for stage in stages:
+            for key in stage.outputs:
+                if key in self.producers:
+                    raise ValueError(f"{key!r} is produced by both {self.producers[key]} and {stage.name}")
+                self.producers[key] = stage.name
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        deps = {s.name: {self.producers[k] for k in (*s.inputs, *s.lazy_inputs) if k in self.producers}
+                for s in self.stages}
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through {name}")
+            visiting.add(name)
+            for dep in deps[name]:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in deps:
+            visit(name)
+
+    async def run(self, initial: dict, on_event: Callable = None) -> RunReport:
+        """Run every stage; raises the first error from a foreground stage."""
+        missing = {k for s in self.stages for k in (*s.inputs, *s.lazy_inputs)} - set(self.producers) - set(initial)
+        if missing:
+            raise ValueError(f"No stage produces {sorted(missing)}")
+        return await _GraphRun(self, initial, on_event).run()
+
+
+class _GraphRun:
+    def __init__(self, graph: StageGraph, initial: dict, on_event: Callable = None):
+        self.graph = graph
+        self.on_event = on_event
+        loop = asyncio.get_running_loop()
+        self.futures = {key: loop.create_future() for key in graph.producers}
+        self.resolved_at = {}
+        for key, value in initial.items():
+            fut = loop.create_future()
+            fut.set_result(value)
+            self.futures[key] = fut
+        self.timings = {s.name: StageTiming(s.name) for s in graph.stages}
+        self.t0 = time.monotonic()
+
+    def _now(self) -> float:
+        return time.monotonic() - self.t0
+
+    def _event(self, event: str, **data):
+        if self.on_event:
+            try:
+                self.on_event(event, data)
+            except Exception as e:
+                print(f"      Stage event handler failed: {e}")
+
+    def resolve(self, key, value):
+        fut = self.futures[key]
+        if not fut.done():
+            fut.set_result(value)
+            self.resolved_at[key] = self._now()
+
+    def note_dependency(self, stage_name: str, key: str):
+        timing = self.timings[stage_name]
+        if key not in self.resolved_at:
+            return
+        current = self.resolved_at.get(timing.blocked_on, -1.0)
+        if self.resolved_at[key] > current:
+            timing.blocked_on = key
+            timing.blocked_by = self.graph.producers.get(key)
+
+    async def _run_stage(self, stage: Stage):
+        timing = self.timings[stage.name]
+        try:
+            values = await asyncio.gather(*(self.futures[k] for k in stage.inputs))
+        except Exception as e:
+            self._fail(stage, e)
+            raise
+        timing.start = self._now()
+        for key in stage.inputs:
+            self.note_dependency(stage.name, key)
+        self._event("stage_started", stage=stage.name)
+        try:
+            result = await stage.fn(StageContext(self, stage, dict(zip(stage.inputs, values)))) or {}
+            for key in stage.outputs:
+                if key in result:
+                    self.resolve(key, result[key])
+                elif not self.futures[key].done():
+                    raise RuntimeError(f"Stage {stage.name} did not produce {key!r}")
+        except Exception as e:
+            timing.end = self._now()
+            self._fail(stage, e)
+            raise
+        timing.end = self._now()
+        self._event("stage_finished", stage=stage.name, seconds=timing.duration)
+
+    def _fail(self, stage: Stage, error: Exception):
+        timing = self.timings[stage.name]
+        timing.error = str(error)
+        for key in stage.outputs:
+            if not self.futures[key].done():
+                self.futures[key].set_exception(error)
+                self.futures[key].exception()  # mark retrieved; dependents re-raise it
+        seconds = timing.duration if timing.start is not None else None
+        self._event("stage_failed", stage=stage.name, error=str(error), seconds=seconds)
+
+    def critical_path(self) -> list:
+        done = [t for name, t in self.timings.items()
+                if t.end is not None and not self._stage(name).background]
+        if not done:
+            return []
+        path, timing = [], max(done, key=lambda t: t.end)
+        while timing is not None:
+            path.append(timing.name)
+            timing = self.timings.get(timing.blocked_by) if timing.blocked_by else None
+        return path[::-1]
+
+    def _stage(self, name: str) -> Stage:
+        return next(s for s in self.graph.stages if s.name == name)
+
+    async def run(self) -> RunReport:
+        foreground = []
+        for stage in self.graph.stages:
+            task = asyncio.create_task(self._run_stage(stage))
+            if stage.background:
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            else:
+                foreground.append(task)
+        try:
+            await asyncio.gather(*foreground)
+        except Exception:
+            for task in foreground:
+                task.cancel()
+            raise
+        values = {k: f.result() for k, f in self.futures.items() if f.done() and not f.exception()}
+        return RunReport(values, self.timings, self.critical_path())
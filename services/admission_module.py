@@ -0,0 +1,175 @@
+"""
+Admission control: a bounded global queue in front of the pipeline, and
+per-stage concurrency slots so a burst of uploads can't launch unbounded
+Whisper, Lyria, ElevenLabs or mixing work at once. Limits come from the
+environment; queue depth and wait times are exported as metrics.
+"""
+import os, math, time, asyncio, contextlib
+from collections import deque
+from services.metrics_module import Counter, Gauge, Histogram
+
+MAX_RUNNING = int(os.getenv("MAX_CONCURRENT_PIPELINES", "4"))
+MAX_QUEUED = int(os.getenv("MAX_QUEUED_PIPELINES", "8"))
+DEFAULT_RETRY_AFTER = 30
+
+STAGE_LIMITS = {
+    # Transcriptions admitted to the Whisper pool, whose shortest-first queue orders them
+    "whisper": int(os.getenv("WHISPER_CONCURRENCY", "8")),
+    "lyria": int(os.getenv("LYRIA_CONCURRENCY", os.getenv("LYRIA_POOL_SIZE", "2"))),
+    "vocals": int(os.getenv("VOCALS_CONCURRENCY", "4")),
+    "mix": int(os.getenv("MIX_CONCURRENCY", str(os.cpu_count() or 2))),
+}
+
+
+class QueueFull(Exception):
+    """The pipeline queue is at capacity; retry_after is a hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Slots:
+    """
+    FIFO counting semaphore. Unlike asyncio.Semaphore it isn't bound to the
+    first event loop that waits on it and exposes its waiter count.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for fut in self._waiters if not fut.done())
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # the slot was handed over just as we were cancelled
+            else:
+                self._waiters.remove(fut)
+            raise
+
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)  # hand the slot straight to the next waiter
+                return
+        self.active -= 1
+
+
+_stage_slots = {name: _Slots(limit) for name, limit in STAGE_LIMITS.items()}
+
+STAGE_SLOT_WAIT = Histogram("memomuse_stage_slot_wait_seconds", "Time stages waited for a concurrency slot.",
+                            ("stage",))
+STAGE_SLOTS = Gauge("memomuse_stage_slots", "Stage concurrency slots by state.", ("stage", "state"),
+                    fn=lambda: {(name, state): getattr(slots, state) for name, slots in _stage_slots.items()
+                                for state in ("limit", "active", "waiting")})
+
+
+@contextlib.asynccontextmanager
+async def stage_slot(name: str):
+    """Hold one of the named stage's concurrency slots for the duration of the block."""
+    slots = _stage_slots[name]
+    start = time.monotonic()
+    await slots.acquire()
+    STAGE_SLOT_WAIT.observe(time.monotonic() - start, stage=name)
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+class Ticket:
+    """A reserved place in the pipeline queue; entering it waits for a running slot."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._pending = True
+        self._start = None
+
+    def abandon(self):
+        """Give the reservation back without running (e.g. the request failed early)."""
+        if self._pending:
+            self._pending = False
+            self._controller.pending -= 1
+
+    async def __aenter__(self):
+        queued_at = time.monotonic()
+        try:
+            await self._controller.slots.acquire()
+        finally:
+            self.abandon()
+        self._start = time.monotonic()
+        QUEUE_WAIT.observe(self._start - queued_at)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._controller.slots.release()
+        self._controller.durations.append(time.monotonic() - self._start)
+        return False
+
+
+class AdmissionController:
+    """
+    At most max_running pipelines run at once and max_queued more may wait;
+    beyond that admit() raises QueueFull with a Retry-After estimate based
+    on recent pipeline durations.
+    """
+
+    def __init__(self, max_running: int = MAX_RUNNING, max_queued: int = MAX_QUEUED):
+        self.slots = _Slots(max_running)
+        self.max_queued = max_queued
+        self.pending = 0  # admitted but not yet running
+        self.durations = deque(maxlen=20)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending + self.slots.active - self.slots.limit)
+
+    def retry_after(self) -> int:
+        if not self.durations:
+            return DEFAULT_RETRY_AFTER
+        average = sum(self.durations) / len(self.durations)
+        return max(1, math.ceil(average * (self.queued + 1) / self.slots.limit))
+
+    def admit(self) -> Ticket:
+        if self.slots.active + self.pending >= self.slots.limit + self.max_queued:
+            REJECTED.inc()
+            raise QueueFull(self.retry_after())
+        self.pending += 1
+        return Ticket(self)
+
+    def stats(self) -> dict:
+        return {
+            "max_running": self.slots.limit,
+            "max_queued": self.max_queued,
+            "running": self.slots.active,
+            "queued": self.queued,
+            "retry_after": self.retry_after(),
+            "stages": {name: {"limit": s.limit, "active": s.active, "waiting": s.waiting}
+                       for name, s in _stage_slots.items()},
+        }
+
+
+_admission = AdmissionController()
+
+
+def get_admission() -> AdmissionController:
+    return _admission
+
+
+QUEUE_WAIT = Histogram("memomuse_queue_wait_seconds", "Time admitted pipelines waited to start.")
+REJECTED = Counter("memomuse_queue_rejected_total", "Pipelines rejected with 429 because the queue was full.")
+QUEUE_DEPTH = Gauge("memomuse_queue_depth", "Pipelines admitted and waiting for a slot.",
+                    fn=lambda: _admission.queued)
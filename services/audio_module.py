@@ -0,0 +1,307 @@
+"""
+NumPy audio engine for the final mix — stems are decoded once into float32
+(frames, channels) arrays scaled to [-1, 1) and every mix step runs in place.
+"""
+from fractions import Fraction
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pydub import AudioSegment
+from scipy import fft
+from scipy.signal import sosfilt, resample_poly
+from services.cache_module import content_key
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BASS_SHELF_HZ = 250
+TREBLE_SHELF_HZ = 4000
+EQ_DB_PER_STEP = 1.5  # studio bass/treble controls run -10..+10 -> +/-15 dB
+PV_FFT_SIZE = 2048
+PV_HOP = PV_FFT_SIZE // 4
+TRIM_RATE = 16000  # speech-side audio (VAD, trimmed memos, PCM fingerprints): Whisper's native rate
+VAD_FRAME_MS = 30
+VAD_MARGIN_DB = 12  # speech must be this far above the estimated noise floor
+VAD_FLOOR_DB = -60
+_INT16_SCALE = 32768.0  # pydub's max_possible_amplitude for 16-bit audio
+
+
+def load_stem(path: str, frame_rate: int = SAMPLE_RATE, channels: int = CHANNELS) -> np.ndarray:
+    """Decode an audio file into a float32 (frames, channels) array at the mix format."""
+    seg = AudioSegment.from_file(path)
+    return segment_to_array(seg, frame_rate, channels)
+
+
+def segment_to_array(seg: AudioSegment, frame_rate: int = None, channels: int = None) -> np.ndarray:
+    """Convert an AudioSegment to float32 samples, resampling/remixing only when needed."""
+    if frame_rate and seg.frame_rate != frame_rate:
+        seg = seg.set_frame_rate(frame_rate)
+    if channels and seg.channels != channels:
+        seg = seg.set_channels(channels)
+    if seg.sample_width != 2:
+        seg = seg.set_sample_width(2)
+    samples = np.frombuffer(seg.raw_data, dtype=np.int16).astype(np.float32)
+    samples *= 1.0 / _INT16_SCALE
+    return samples.reshape(-1, seg.channels)
+
+
+def array_to_segment(samples: np.ndarray, frame_rate: int = SAMPLE_RATE) -> AudioSegment:
+    """Convert float32 samples back to a 16-bit AudioSegment, saturating like audioop."""
+    pcm = np.clip(samples * _INT16_SCALE, -32768, 32767).astype(np.int16)
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=frame_rate,
+                        channels=samples.shape[1] if samples.ndim > 1 else 1)
+
+
+def rms_dbfs(samples: np.ndarray) -> float:
+    """Loudness in dBFS, matching pydub's AudioSegment.dBFS. Silence returns -inf."""
+    if samples.size == 0:
+        return float("-inf")
+    rms = float(np.linalg.norm(samples.reshape(-1))) / np.sqrt(samples.size)
+    if rms == 0:
+        return float("-inf")
+    return 20 * np.log10(rms)
+
+
+def _normalize_gain(samples: np.ndarray, target_dbfs: float) -> float:
+    level = rms_dbfs(samples)
+    if level == float("-inf"):
+        return 0.0
+    return target_dbfs - level
+
+
+def apply_gain(samples: np.ndarray, gain_db: float) -> np.ndarray:
+    """Scale samples by gain_db in place."""
+    if gain_db:
+        samples *= np.float32(10 ** (gain_db / 20.0))
+    return samples
+
+
+def mix_stems(instrumental: np.ndarray, vocal: np.ndarray = None, vocal_boost_db: float = 6.0,
+              inst_cut_db: float = 6.0, target_dbfs: float = -20.0) -> np.ndarray:
+    """
+    Normalize both stems to target_dbfs, apply the vocal boost / instrumental cut
+    and sum the vocal onto the instrumental. Works in place on both arrays and
+    returns the instrumental buffer, trimmed to the instrumental's length.
+    """
+    if vocal is None:
+        return instrumental
+
+    apply_gain(instrumental, _normalize_gain(instrumental, target_dbfs) - inst_cut_db)
+    vocal_gain = _normalize_gain(vocal, target_dbfs) + vocal_boost_db
+    n = min(len(vocal), len(instrumental))
+    vocal = apply_gain(vocal[:n], vocal_gain)
+
+    np.add(instrumental[:n], vocal, out=instrumental[:n])
+    np.clip(instrumental, -1.0, 32767 / _INT16_SCALE, out=instrumental)
+    return instrumental
+
+
+def shelf_sos(kind: str, freq: float, gain_db: float, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """RBJ cookbook low/high shelf (slope 1) as a single second-order section."""
+    a = 10 ** (gain_db / 40.0)
+    w0 = 2 * np.pi * freq / rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / 2 * np.sqrt(2)
+    sqrt_a = 2 * np.sqrt(a) * alpha
+    sign = 1 if kind == "low" else -1
+
+    b0 = a * ((a + 1) - sign * (a - 1) * cos_w0 + sqrt_a)
+    b1 = sign * 2 * a * ((a - 1) - sign * (a + 1) * cos_w0)
+    b2 = a * ((a + 1) - sign * (a - 1) * cos_w0 - sqrt_a)
+    a0 = (a + 1) + sign * (a - 1) * cos_w0 + sqrt_a
+    a1 = -sign * 2 * ((a - 1) + sign * (a + 1) * cos_w0)
+    a2 = (a + 1) + sign * (a - 1) * cos_w0 - sqrt_a
+    return np.array([b0, b1, b2, a0, a1, a2]) / a0
+
+
+def _eq_sos(bass: int, treble: int, rate: int):
+    sections = []
+    if bass:
+        sections.append(shelf_sos("low", BASS_SHELF_HZ, bass * EQ_DB_PER_STEP, rate))
+    if treble:
+        sections.append(shelf_sos("high", TREBLE_SHELF_HZ, treble * EQ_DB_PER_STEP, rate))
+    return np.vstack(sections) if sections else None
+
+
+def apply_shelf_eq(samples: np.ndarray, bass: int = 0, treble: int = 0,
+                   rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Bass/treble shelving EQ. Values range from -10 to +10 (1.5 dB per step)."""
+    sos = _eq_sos(bass, treble, rate)
+    if sos is None:
+        return samples
+    out = sosfilt(sos, samples, axis=0).astype(np.float32, copy=False)
+    np.clip(out, -1.0, 32767 / _INT16_SCALE, out=out)
+    return out
+
+
+def mix_blocks(instrumental: np.ndarray, vocal: np.ndarray = None, vocal_boost_db: float = 6.0,
+               inst_cut_db: float = 6.0, target_dbfs: float = -20.0, bass: int = 0, treble: int = 0,
+               rate: int = SAMPLE_RATE, block_frames: int = SAMPLE_RATE):
+    """
+    mix_stems() followed by apply_shelf_eq(), yielded block_frames at a time so
+    the first blocks can be encoded while the rest is still being mixed. Stem
+    gains come from whole-stem loudness measured up front; the EQ carries its
+    filter state from block to block, so the output matches the one-shot path.
+    """
+    if vocal is not None:
+        inst_gain = _normalize_gain(instrumental, target_dbfs) - inst_cut_db
+        vocal_gain = _normalize_gain(vocal, target_dbfs) + vocal_boost_db
+        n = min(len(vocal), len(instrumental))
+    sos = _eq_sos(bass, treble, rate)
+    zi = None if sos is None else np.zeros((len(sos), 2) + instrumental.shape[1:])
+    for start in range(0, len(instrumental), block_frames):
+        block = instrumental[start:start + block_frames]
+        if vocal is not None:
+            apply_gain(block, inst_gain)
+            if start < n:
+                voice = apply_gain(vocal[start:min(start + block_frames, n)], vocal_gain)
+                np.add(block[:len(voice)], voice, out=block[:len(voice)])
+            np.clip(block, -1.0, 32767 / _INT16_SCALE, out=block)
+        if sos is not None:
+            block, zi = sosfilt(sos, block, axis=0, zi=zi)
+            block = block.astype(np.float32, copy=False)
+            np.clip(block, -1.0, 32767 / _INT16_SCALE, out=block)
+        yield block
+
+
+def _stft(x: np.ndarray, window: np.ndarray, hop: int) -> np.ndarray:
+    pad = len(window) // 2
+    frames = sliding_window_view(np.pad(x, pad), len(window))[::hop]
+    return fft.rfft(frames * window, axis=-1, workers=-1)
+
+
+def _istft(spec: np.ndarray, window: np.ndarray, hop: int) -> np.ndarray:
+    n_fft = len(window)
+    frames = fft.irfft(spec, n=n_fft, axis=-1, workers=-1) * window
+    n_frames = len(frames)
+    out = np.zeros(n_fft + hop * (n_frames - 1), dtype=np.float32)
+    norm = np.zeros_like(out)
+    # Overlap-add one hop-sized column at a time: n_fft // hop vectorized adds
+    for k in range(n_fft // hop):
+        block = slice(k * hop, k * hop + n_frames * hop)
+        out[block] += frames[:, k * hop:(k + 1) * hop].reshape(-1)
+        norm[block] += np.tile(window[k * hop:(k + 1) * hop] ** 2, n_frames)
+    out /= np.maximum(norm, 1e-6)
+    pad = n_fft // 2
+    return out[pad:len(out) - pad]
+
+
+def _time_stretch(x: np.ndarray, stretch: float, window: np.ndarray, hop: int) -> np.ndarray:
+    """Phase-vocoder time stretch of a mono signal; stretch > 1 makes it longer."""
+    spec = _stft(x, window, hop)
+    mag_spec, phase_spec = np.abs(spec), np.angle(spec)
+    steps = np.arange(0, len(spec) - 1, 1.0 / stretch)
+    idx = steps.astype(np.int64)
+    frac = (steps - idx).astype(np.float32)[:, None]
+
+    mag = mag_spec[idx]
+    mag += frac * (mag_spec[idx + 1] - mag)
+    expected = np.linspace(0, np.pi * hop, spec.shape[1], dtype=np.float32)
+    dphase = phase_spec[idx + 1] - phase_spec[idx] - expected
+    dphase += np.pi
+    np.mod(dphase, 2 * np.pi, out=dphase)
+    dphase += expected - np.pi
+    # Accumulate in float64 and wrap, so float32 precision and cos/sin
+    # argument reduction don't degrade as the running phase grows
+    phase = np.empty(dphase.shape, dtype=np.float64)
+    phase[0] = phase_spec[0]
+    np.cumsum(dphase[:-1], axis=0, out=phase[1:])
+    phase[1:] += phase[0]
+    phase = np.mod(phase, 2 * np.pi).astype(np.float32)
+
+    out = np.empty(mag.shape, dtype=np.complex64)
+    np.multiply(mag, np.cos(phase), out=out.real)
+    np.multiply(mag, np.sin(phase), out=out.imag)
+    return _istft(out, window, hop)
+
+
+def pitch_shift(samples: np.ndarray, semitones: float = 0, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Shift pitch by semitones without changing duration: phase-vocoder time
+    stretch by the pitch ratio, then polyphase-resample back to the input length.
+    """
+    if not semitones or len(samples) < PV_FFT_SIZE:
+        return samples
+    ratio = Fraction(2 ** (semitones / 12.0)).limit_denominator(100)
+    window = np.hanning(PV_FFT_SIZE + 1)[:-1].astype(np.float32)
+    n = len(samples)
+    out = np.empty_like(samples)
+    for ch in range(samples.shape[1]):
+        stretched = _time_stretch(samples[:, ch], float(ratio), window, PV_HOP)
+        shifted = resample_poly(stretched, ratio.denominator, ratio.numerator)
+        m = min(n, len(shifted))
+        out[:m, ch] = shifted[:m]
+        out[m:, ch] = 0
+    np.clip(out, -1.0, 32767 / _INT16_SCALE, out=out)
+    return out
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """(start, end) index pairs of the True runs in a boolean array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+
+def speech_regions(samples: np.ndarray, rate: int = SAMPLE_RATE, min_silence_ms: int = 400,
+                   pad_ms: int = 150, min_speech_ms: int = 120) -> np.ndarray:
+    """
+    Energy VAD: (start, end) sample indices of the voiced regions. Frames are
+    voiced when their level clears an adaptive threshold above the noise
+    floor; pauses shorter than min_silence_ms are bridged and each region
+    is padded by pad_ms so word onsets and tails survive.
+    """
+    mono = samples.mean(axis=1) if samples.ndim > 1 else samples
+    frame = max(1, rate * VAD_FRAME_MS // 1000)
+    n = len(mono) // frame
+    if n == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    frames = mono[:n * frame].reshape(n, frame)
+    level = 10 * np.log10(np.einsum("ij,ij->i", frames, frames) / frame + 1e-12)
+    noise, peak = np.percentile(level, 10), level.max()
+    threshold = max(min(noise + VAD_MARGIN_DB, peak - VAD_MARGIN_DB), VAD_FLOOR_DB)
+    voiced = level > threshold
+
+    # Bridge short pauses, then drop blips too short to be speech
+    gaps = _runs(~voiced)
+    short = (gaps[:, 1] - gaps[:, 0]) * VAD_FRAME_MS < min_silence_ms
+    inner = (gaps[:, 0] > 0) & (gaps[:, 1] < n)
+    for start, end in gaps[short & inner]:
+        voiced[start:end] = True
+    regions = _runs(voiced)
+    regions = regions[(regions[:, 1] - regions[:, 0]) * VAD_FRAME_MS >= min_speech_ms]
+    if not len(regions):
+        return np.empty((0, 2), dtype=np.int64)
+
+    pad = rate * pad_ms // 1000
+    regions = regions * frame
+    regions[:, 0] = np.maximum(regions[:, 0] - pad, 0)
+    regions[:, 1] = np.minimum(regions[:, 1] + pad, len(mono))
+    # Padding can make neighbours overlap; merge them
+    merged = [regions[0]]
+    for start, end in regions[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append(np.array([start, end]))
+    return np.asarray(merged, dtype=np.int64)
+
+
+def join_regions(samples: np.ndarray, regions: np.ndarray, rate: int = SAMPLE_RATE,
+                 gap_ms: int = 250) -> tuple:
+    """
+    Concatenate the given regions with gap_ms of silence between them.
+    Returns (trimmed, offsets) where each offsets row is
+    (trimmed_start, original_start, length) in samples.
+    """
+    gap = rate * gap_ms // 1000
+    lengths = regions[:, 1] - regions[:, 0]
+    starts = np.concatenate(([0], np.cumsum(lengths + gap)[:-1]))
+    trimmed = np.zeros((int(lengths.sum() + gap * max(len(regions) - 1, 0)),) + samples.shape[1:],
+                       dtype=samples.dtype)
+    for (start, end), at in zip(regions, starts):
+        trimmed[at:at + end - start] = samples[start:end]
+    return trimmed, np.stack([starts, regions[:, 0], lengths], axis=1)
+
+
+def pcm_fingerprint(samples: np.ndarray) -> str:
+    """Hash of the samples as 16-bit PCM, so the same audio in any container gets the same key."""
+    pcm = np.clip(samples * _INT16_SCALE, -32768, 32767).astype(np.int16)
+    return content_key(pcm.tobytes())
@@ -1,35 +1,154 @@
-import os, aiohttp
-
-_assistant_id = None
-_thread_id = None
-
-
-async def store_session(transcript: str, lyrics: str, prompt: str, genre: str, mood: str):
-    """Store session in Backboard.io for persistent memory across generations."""
-    global _assistant_id, _thread_id
-    api_key = os.getenv("BACKBOARD_API_KEY")
-    if not api_key:
-        return
-    base_url = "https://app.backboard.io/api"
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-
-    async with aiohttp.ClientSession() as session:
-        if not _assistant_id:
-            async with session.post(f"{base_url}/assistants", headers=headers, json={
-                "name": "MemoMuse Music Producer",
-                "system_prompt": "You are a music production assistant. Remember user preferences and musical style choices.",
-                "llm_provider": "google", "llm_model_name": "gemini-2.5-flash"
-            }) as resp:
-                _assistant_id = (await resp.json()).get("assistant_id")
-
-        if not _thread_id:
-            async with session.post(f"{base_url}/threads", headers=headers,
-                json={"assistant_id": _assistant_id}) as resp:
-                _thread_id = (await resp.json()).get("thread_id")
-
-        context = (f"Voice memo. Genre: {genre}, Mood: {mood}. "
-                   f"Transcript: {transcript[:200]}. Lyrics: {lyrics[:200]}. Prompt: {prompt[:200]}.")
-
-        async with session.post(f"{base_url}/threads/{_thread_id}/messages", headers=headers,
-            json={"content": context, "memory": "Auto"}) as resp:
-            return await resp.json()
+"""
+Backboard.io session memory, written behind the pipeline. store_session()
+only queues a record; one writer task drains the bounded queue, creating the
+assistant and thread once and posting each batch of queued records as a
+single message. Failed batches are retried with exponential backoff, and a
+full queue drops its oldest record, so a slow Backboard never delays a song.
+
+memomuse_backboard_records_total counts every submitted record exactly once,
+by what became of it: written, coalesced (an identical record in the same
+batch was written in its place), failed (given up on after retries) or
+dropped (pushed out of a full queue).
+"""
+import os, asyncio
+from services.metrics_module import track, Counter, Gauge
+from services.http_module import get_session
+
+BASE_URL = "https://app.backboard.io/api"
+QUEUE_SIZE = int(os.getenv("BACKBOARD_QUEUE_SIZE", "100"))
+BATCH_SIZE = int(os.getenv("BACKBOARD_BATCH_SIZE", "10"))
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0  # doubled after every failed attempt
+
+
+class BackboardError(Exception):
+    pass
+
+
+def _headers() -> dict:
+    return {"Authorization": f"Bearer {os.getenv('BACKBOARD_API_KEY')}", "Content-Type": "application/json"}
+
+
+async def _post(path: str, payload: dict) -> dict:
+    async with get_session("backboard").post(f"{BASE_URL}/{path}", headers=_headers(), json=payload) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+class SessionWriter:
+    """Background writer for session records, bound to the loop it was created on."""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self.assistant_id = None
+        self.thread_id = None
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(queue_size)
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def submit(self, record: str):
+        """Queue a record without waiting, dropping the oldest one if the queue is full."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self._queue.full():
+            self._queue.get_nowait()
+            self._queue.task_done()
+            RECORDS.inc(result="dropped")
+        self._queue.put_nowait(record)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: list):
+        records = list(dict.fromkeys(batch))  # identical records coalesce into one
+        if len(records) < len(batch):
+            RECORDS.inc(len(batch) - len(records), result="coalesced")
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                await self._send(records)
+                RECORDS.inc(len(records), result="written")
+                return
+            except Exception as e:
+                if attempt == MAX_RETRIES:
+                    RECORDS.inc(len(records), result="failed")
+                    print(f"      Backboard write failed after {attempt + 1} attempts: {e}")
+                    return
+                RETRIES.inc()
+                await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+    async def _ensure_thread(self):
+        """Create the assistant and thread once; raises BackboardError (so the batch is retried) if either has no id."""
+        async with self._lock:
+            if not self.assistant_id:
+                self.assistant_id = (await _post("assistants", {
+                    "name": "MemoMuse Music Producer",
+                    "system_prompt": "You are a music production assistant. Remember user preferences and musical style choices.",
+                    "llm_provider": "google", "llm_model_name": "gemini-2.5-flash"
+                })).get("assistant_id")
+                if not self.assistant_id:
+                    raise BackboardError("Backboard created an assistant without an assistant_id")
+            if not self.thread_id:
+                self.thread_id = (await _post("threads", {"assistant_id": self.assistant_id})).get("thread_id")
+                if not self.thread_id:
+                    raise BackboardError("Backboard created a thread without a thread_id")
+
+    @track("backboard", "store_session")
+    async def _send(self, records: list) -> dict:
+        await self._ensure_thread()
+        return await _post(f"threads/{self.thread_id}/messages", {"content": "\n".join(records), "memory": "Auto"})
+
+    async def flush(self):
+        """Wait until every queued record has been written or given up on."""
+        await self._queue.join()
+
+    async def close(self, timeout: float = 5.0):
+        """Give queued records up to timeout seconds to drain, then stop the writer."""
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self._task is not None:
+            self._task.cancel()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+
+_writer = None
+
+RECORDS = Counter("memomuse_backboard_records_total",
+                  "Submitted session records by outcome (written, coalesced, failed, dropped).", ("result",))
+RETRIES = Counter("memomuse_backboard_retries_total", "Backboard batch writes retried after a failure.")
+QUEUE_DEPTH = Gauge("memomuse_backboard_queue_depth", "Session records waiting to be written to Backboard.",
+                    fn=lambda: _writer.pending() if _writer else 0)
+
+
+def get_writer() -> SessionWriter:
+    """The session writer for the running loop."""
+    global _writer
+    if _writer is None or _writer.loop is not asyncio.get_running_loop():
+        _writer = SessionWriter()
+    return _writer
+
+
+def store_session(transcript: str, lyrics: str, prompt: str, genre: str, mood: str) -> bool:
+    """Queue the session for Backboard.io memory. Returns False when Backboard isn't configured."""
+    if not os.getenv("BACKBOARD_API_KEY"):
+        return False
+    get_writer().submit(f"Voice memo. Genre: {genre}, Mood: {mood}. "
+                        f"Transcript: {transcript[:200]}. Lyrics: {lyrics[:200]}. Prompt: {prompt[:200]}.")
+    return True
+
+
+async def close():
+    if _writer is not None and _writer.loop is asyncio.get_running_loop():
+        await _writer.close()
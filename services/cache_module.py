@@ -0,0 +1,230 @@
+"""
+Content-addressed result caches: an in-memory LRU in front of a size-bounded
+persistent tier (a directory of JSON or binary files, or a SQLite file with
+per-entry expiry), so results survive restarts. Callers build keys
+from content hashes with content_key(); lookups per tier and the size of
+each cache are exported as metrics.
+"""
+import os, json, time, sqlite3, hashlib, threading, tempfile
+from collections import OrderedDict
+from services.metrics_module import Counter, Gauge
+
+_caches = []
+
+
+def content_key(*parts) -> str:
+    """Hex SHA-256 over the given parts (bytes, or anything str()-able), in order."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class TieredCache:
+    """
+    get/put JSON-serialisable values by key. The memory tier holds the
+    max_items most recently used entries; the disk tier (skipped when
+    directory is None) evicts least recently used files once it grows past
+    max_bytes. Safe to share between threads.
+    """
+    ttl = None  # seconds an entry stays valid; None keeps it until evicted
+    suffix = ".json"
+
+    def __init__(self, name: str, directory: str = None, max_items: int = 256, max_bytes: int = 64 << 20):
+        self.name = name
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # key -> (value, expires)
+        self._files = None  # key -> size on disk, loaded on first use
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def _remember(self, key: str, value, expires: float = None):
+        self._memory[key] = (value, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """The cached value, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                value, expires = self._memory[key]
+                if expires is None or expires > time.time():
+                    self._memory.move_to_end(key)
+                    LOOKUPS.inc(cache=self.name, result="memory_hit")
+                    return value
+                del self._memory[key]
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, *entry)
+                LOOKUPS.inc(cache=self.name, result="disk_hit")
+                return entry[0]
+            LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+
+    def put(self, key: str, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, value, expires)
+            if self.max_bytes > 0:
+                self._store(key, value, expires)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"memory_items": len(self._memory), **self._disk_stats()}
+
+    # Disk tier: a directory of <key>.json files, least recently used (by mtime) evicted first
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _index(self) -> dict:
+        if self._files is None:
+            self._files = {}
+            if self.directory and os.path.isdir(self.directory):
+                entries = [e for e in os.scandir(self.directory) if e.name.endswith(self.suffix)]
+                for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                    self._files[entry.name[:-len(self.suffix)]] = entry.stat().st_size
+        return self._files
+
+    def _load(self, key: str):
+        """(value, expires) from the disk tier, or None."""
+        files = self._index()
+        if key not in files:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                value = self._decode(f.read())
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            files.pop(key, None)
+            return None
+        files[key] = files.pop(key)  # most recently used last
+        return value, None
+
+    def _store(self, key: str, value, expires: float):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        data = self._encode(value)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))  # atomic, so readers never see a partial entry
+        files = self._index()
+        files.pop(key, None)
+        files[key] = len(data)
+        total = sum(files.values())
+        while total > self.max_bytes and files:
+            oldest = next(iter(files))
+            total -= files.pop(oldest)
+            try:
+                os.remove(self._path(oldest))
+            except FileNotFoundError:
+                pass
+            EVICTIONS.inc(cache=self.name)
+
+    def _encode(self, value) -> bytes:
+        return json.dumps(value).encode()
+
+    def _decode(self, data: bytes):
+        return json.loads(data)
+
+    def _clear(self):
+        for key in list(self._index()):
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        self._files = {}
+
+    def _disk_stats(self) -> dict:
+        files = self._index()
+        return {"disk_items": len(files), "disk_bytes": sum(files.values())}
+
+
+class BlobCache(TieredCache):
+    """
+    TieredCache for raw bytes such as rendered audio: entries live only in
+    the size-bounded directory (no memory tier), one <key>.bin file each.
+    """
+    suffix = ".bin"
+
+    def __init__(self, name: str, directory: str, max_bytes: int = 256 << 20):
+        super().__init__(name, directory, max_items=0, max_bytes=max_bytes)
+
+    def _encode(self, value: bytes) -> bytes:
+        return value
+
+    def _decode(self, data: bytes) -> bytes:
+        return data
+
+
+class SqliteCache(TieredCache):
+    """
+    TieredCache whose persistent tier is a single SQLite file, with entries
+    expiring ttl seconds after they were stored (None: never). Past max_bytes
+    the least recently used rows are deleted.
+    """
+
+    def __init__(self, name: str, path: str, max_items: int = 256, max_bytes: int = 64 << 20, ttl: float = None):
+        super().__init__(name, None, max_items, max_bytes)
+        self.path = path
+        self.ttl = ttl
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Every use holds self._lock, so one connection can serve all threads
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                             "(key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)")
+        return self._db
+
+    def _load(self, key: str):
+        row = self._conn().execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        self._db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(value), expires
+
+    def _store(self, key: str, value, expires: float):
+        db, now = self._conn(), time.time()
+        db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, json.dumps(value), expires, now))
+        db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = 0
+        for old, size in db.execute("SELECT key, length(value) FROM entries ORDER BY used DESC").fetchall():
+            total += size
+            if total > self.max_bytes:
+                db.execute("DELETE FROM entries WHERE key = ?", (old,))
+                EVICTIONS.inc(cache=self.name)
+
+    def _clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+    def _disk_stats(self) -> dict:
+        if self._db is None and not os.path.exists(self.path):
+            return {"disk_items": 0, "disk_bytes": 0}
+        items, size = self._conn().execute("SELECT count(*), coalesce(sum(length(value)), 0) FROM entries").fetchone()
+        return {"disk_items": items, "disk_bytes": size}
+
+
+LOOKUPS = Counter("memomuse_cache_lookups_total", "Cache lookups by result (memory_hit, disk_hit, miss).",
+                  ("cache", "result"))
+EVICTIONS = Counter("memomuse_cache_evictions_total", "Entries evicted from a cache's disk tier.", ("cache",))
+CACHE_SIZE = Gauge("memomuse_cache_entries", "Entries held per cache tier.", ("cache", "tier"),
+                   fn=lambda: {(c.name, tier): c.stats()[tier + "_items"] for c in _caches for tier in ("memory", "disk")})
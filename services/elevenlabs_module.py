@@ -1,8 +1,24 @@
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import ElevenLabs, AsyncElevenLabs
 from elevenlabs import VoiceSettings
-import os
+import os, io, re, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from services.metrics_module import timed
+from services.cache_module import BlobCache, content_key
+from services.audio_module import TRIM_RATE, load_stem, pcm_fingerprint
+
+TTS_MODEL = "eleven_multilingual_v2"
+STS_MODEL = "eleven_multilingual_sts_v2"
+TTS_SECTION_CONCURRENCY = int(os.getenv("TTS_SECTION_CONCURRENCY", "3"))
+TTS_BITRATE = "128k"  # ElevenLabs' default mp3_44100_128, for the re-encoded multi-section stem
+# Rendered stems by (text or input PCM, voice, model, settings): re-runs that only change
+# EQ or genre reuse them instead of spending latency and character quota
+STEMS = BlobCache("stems", os.getenv("STEM_CACHE_DIR", "cache/stems"),
+                  max_bytes=int(os.getenv("STEM_CACHE_MB", "256")) << 20)
+_SECTION_HEADER = re.compile(r"^[ \t]*\[([^\]\n]+)\][ \t]*$", re.M)
 
 _client = None
+_async_client = None
 _voices_cache = None
 
 
@@ -13,13 +29,21 @@ def _get_client():
     return _client
 
 
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+    return _async_client
+
+
 def get_voices() -> list[dict]:
     """Fetch available voices from ElevenLabs library."""
     global _voices_cache
     if _voices_cache is not None:
         return _voices_cache
 
-    response = _get_client().voices.get_all()
+    with timed("elevenlabs", "voices"):
+        response = _get_client().voices.get_all()
     voices = []
     for v in response.voices:
         labels = v.labels or {}
@@ -36,15 +60,32 @@ def get_voices() -> list[dict]:
     return voices
 
 
-def synthesize_vocals(lyrics: str, output_path: str = "temp/vocals.mp3", voice_id: str = None,
-                      stability: float = 0.3, similarity: float = 0.75, style: float = 0.45) -> str:
-    """Generate vocal track from lyrics using TTS."""
-    if not voice_id:
-        voice_id = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
-    audio = _get_client().text_to_speech.convert(
+async def speak(text: str, voice_id: str = None) -> bytes:
+    """Plain narration of text (the voicemail reply), streamed on the loop through the shared async client."""
+    voice_id = voice_id or os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+    with timed("elevenlabs", "voicemail_tts"):
+        chunks = [chunk async for chunk in _get_async_client().text_to_speech.convert(
+            voice_id=voice_id, text=text, model_id=TTS_MODEL,
+            voice_settings=VoiceSettings(stability=0.5, similarity_boost=0.75, style=0.0, use_speaker_boost=True),
+        )]
+    return b"".join(chunks)
+
+
+def split_sections(lyrics: str) -> list:
+    """(label, text) for each [Label] section of the lyrics; text before the first label gets label ""."""
+    parts = _SECTION_HEADER.split(lyrics)
+    sections = [("", parts[0].strip())] if parts[0].strip() else []
+    for label, text in zip(parts[1::2], parts[2::2]):
+        if text.strip():
+            sections.append((label.strip(), text.strip()))
+    return sections
+
+
+def _convert(voice_id: str, text: str, stability: float, similarity: float, style: float):
+    return _get_client().text_to_speech.convert(
         voice_id=voice_id,
-        text=lyrics,
-        model_id="eleven_multilingual_v2",
+        text=text,
+        model_id=TTS_MODEL,
         voice_settings=VoiceSettings(
             stability=stability,
             similarity_boost=similarity,
@@ -52,26 +93,116 @@ def synthesize_vocals(lyrics: str, output_path: str = "temp/vocals.mp3", voice_i
             use_speaker_boost=True,
         ),
     )
-    with open(output_path, "wb") as f:
-        for chunk in audio:
-            f.write(chunk)
+
+
+def _tts_key(voice_id: str, text: str, stability: float, similarity: float, style: float) -> str:
+    return content_key("tts", TTS_MODEL, voice_id, stability, similarity, style, text)
+
+
+def _synthesize_section(voice_id: str, text: str, *settings) -> AudioSegment:
+    """One section, decoded."""
+    key = _tts_key(voice_id, text, *settings)
+    data = STEMS.get(key)
+    if data is None:
+        with timed("elevenlabs", "tts_section"):
+            data = b"".join(_convert(voice_id, text, *settings))
+        STEMS.put(key, data)
+    return AudioSegment.from_file(io.BytesIO(data), format="mp3")
+
+
+def synthesize_vocals(lyrics: str, output_path: str = "temp/vocals.mp3", voice_id: str = None,
+                      stability: float = 0.3, similarity: float = 0.75, style: float = 0.45,
+                      sections: list = None) -> str:
+    """
+    Generate vocal track from lyrics using TTS. Lyrics with several [Label]
+    sections are synthesized section by section, up to TTS_SECTION_CONCURRENCY
+    at once and each distinct section (e.g. a repeated chorus) only once,
+    then decoded, joined in order and encoded once. sections, if given, receives a
+    {"label", "start", "end"} dict (seconds into the stem) per section.
+    Rendered audio is served from the stem cache when available.
+    """
+    if not voice_id:
+        voice_id = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+    parts = split_sections(lyrics)
+    if len(parts) < 2:
+        key = _tts_key(voice_id, lyrics, stability, similarity, style)
+        data = STEMS.get(key)
+        if data is not None:
+            with open(output_path, "wb") as f:
+                f.write(data)
+        else:
+            chunks = []
+            with timed("elevenlabs", "tts"):
+                audio = _convert(voice_id, lyrics, stability, similarity, style)
+                with open(output_path, "wb") as f:
+                    for chunk in audio:
+                        f.write(chunk)
+                        chunks.append(chunk)
+            STEMS.put(key, b"".join(chunks))
+        if sections is not None:
+            # One section spanning the whole stem, which has to be decoded to learn its length
+            sections.append({"label": parts[0][0] if parts else "", "start": 0.0,
+                             "end": round(AudioSegment.from_file(output_path).duration_seconds, 3)})
+        return output_path
+
+    unique = {}
+    for _, text in parts:
+        unique.setdefault(" ".join(text.split()), text)
+    with ThreadPoolExecutor(min(TTS_SECTION_CONCURRENCY, len(unique))) as pool:
+        # A context per task, so each section call lands in the request's provider trace
+        futures = {key: pool.submit(contextvars.copy_context().run, _synthesize_section,
+                                    voice_id, text, stability, similarity, style)
+                   for key, text in unique.items()}
+        rendered = {key: future.result() for key, future in futures.items()}
+
+    # Joined as samples, not MP3 bytes: each section's file carries its own
+    # Xing/LAME header and encoder padding, which would land mid-stem
+    stem, start = AudioSegment.empty(), 0.0
+    for label, text in parts:
+        segment = rendered[" ".join(text.split())]
+        stem += segment
+        if sections is not None:
+            sections.append({"label": label, "start": round(start, 3),
+                             "end": round(start + segment.duration_seconds, 3)})
+        start += segment.duration_seconds
+    stem.export(output_path, format="mp3", bitrate=TTS_BITRATE)
     return output_path
 
 
-def convert_speech_to_speech(audio_path: str, output_path: str = "temp/vocals.mp3", voice_id: str = None) -> str:
-    """Clean up raw voice recording via speech-to-speech, falling back to TTS on quota errors."""
+def convert_speech_to_speech(audio_path: str, output_path: str = "temp/vocals.mp3", voice_id: str = None,
+                             fingerprint: str = None) -> str:
+    """
+    Clean up raw voice recording via speech-to-speech, falling back to TTS on
+    quota errors. Cached under the input's PCM fingerprint (TRIM_RATE mono,
+    like the transcript cache), computed here unless the caller has it.
+    """
     if not voice_id:
         voice_id = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")
+    if fingerprint is None:
+        try:
+            fingerprint = pcm_fingerprint(load_stem(audio_path, TRIM_RATE, 1))
+        except Exception:
+            pass  # undecodable here; ElevenLabs gets the file as-is and nothing is cached
+    key = fingerprint and content_key("sts", STS_MODEL, voice_id, fingerprint)
+    data = STEMS.get(key) if key else None
+    if data is not None:
+        with open(output_path, "wb") as f:
+            f.write(data)
+        return output_path
     try:
-        with open(audio_path, "rb") as audio_file:
+        chunks = []
+        with timed("elevenlabs", "sts"), open(audio_path, "rb") as audio_file:
             audio = _get_client().speech_to_speech.convert(
                 voice_id=voice_id,
                 audio=audio_file,
-                model_id="eleven_multilingual_sts_v2",
+                model_id=STS_MODEL,
             )
             with open(output_path, "wb") as f:
                 for chunk in audio:
                     f.write(chunk)
+                    chunks.append(chunk)
+        if key:
+            STEMS.put(key, b"".join(chunks))
         return output_path
     except Exception as e:
         if "quota_exceeded" in str(e):
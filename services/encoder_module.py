@@ -0,0 +1,131 @@
+"""
+Streaming encoder — PCM blocks are piped into an ffmpeg process as they are
+produced, so the output file grows while the mix is still being computed and
+/audio can serve it before encoding finishes.
+"""
+import os, asyncio, subprocess
+import numpy as np
+from pydub import AudioSegment
+
+PROFILES = {
+    "mp3_128": {"ext": "mp3", "media_type": "audio/mpeg", "args": ["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"]},
+    "mp3_192": {"ext": "mp3", "media_type": "audio/mpeg", "args": ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"]},
+    "mp3_320": {"ext": "mp3", "media_type": "audio/mpeg", "args": ["-c:a", "libmp3lame", "-b:a", "320k", "-f", "mp3"]},
+    "opus_64": {"ext": "ogg", "media_type": "audio/ogg", "args": ["-c:a", "libopus", "-b:a", "64k", "-f", "ogg"]},
+    "opus_96": {"ext": "ogg", "media_type": "audio/ogg", "args": ["-c:a", "libopus", "-b:a", "96k", "-f", "ogg"]},
+}
+DEFAULT_PROFILE = "mp3_128"
+BLOCK_FRAMES = 48000  # one second at the mix rate
+
+_active = set()
+
+
+def get_profile(name: str = None) -> dict:
+    """Look up an output profile, falling back to the default for unknown names."""
+    return PROFILES.get(name or DEFAULT_PROFILE, PROFILES[DEFAULT_PROFILE])
+
+
+def media_type_for(path: str) -> str:
+    ext = os.path.splitext(path)[1].lstrip(".")
+    for profile in PROFILES.values():
+        if profile["ext"] == ext:
+            return profile["media_type"]
+    return "application/octet-stream"
+
+
+def is_encoding(path: str) -> bool:
+    """True while an encoder is still writing to path."""
+    return os.path.abspath(path) in _active
+
+
+class StreamingEncoder:
+    """An ffmpeg process fed float32 (frames, channels) blocks through stdin."""
+
+    def __init__(self, output_path: str, profile: str = None, frame_rate: int = 48000, channels: int = 2):
+        self.output_path = output_path
+        self.frames_written = 0
+        cmd = [
+            AudioSegment.converter, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "s16le", "-ar", str(frame_rate), "-ac", str(channels), "-i", "pipe:0",
+            *get_profile(profile)["args"], output_path,
+        ]
+        self._key = os.path.abspath(output_path)
+        _active.add(self._key)
+        try:
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        except Exception:
+            _active.discard(self._key)
+            raise
+
+    def write(self, samples: np.ndarray):
+        pcm = np.clip(samples * 32768.0, -32768, 32767).astype("<i2")
+        try:
+            self._proc.stdin.write(pcm.tobytes())
+        except BrokenPipeError:
+            self.close()
+        self.frames_written += len(samples)
+
+    def close(self):
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        stderr = self._proc.stderr.read().decode(errors="replace") if self._proc.stderr else ""
+        code = self._proc.wait()
+        _active.discard(self._key)
+        if code != 0:
+            raise RuntimeError(f"Encoder exited with status {code}: {stderr.strip()[:200]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except RuntimeError:
+            if exc_type is None:
+                raise
+        return False
+
+
+def encode_blocks(blocks, output_path: str, profile: str = None, frame_rate: int = 48000,
+                  channels: int = 2, on_start=None) -> str:
+    """
+    Encode (frames, channels) blocks as an iterable produces them, so encoding
+    overlaps with whatever computes the blocks. on_start(output_path) fires
+    after the first block has been written.
+    """
+    with StreamingEncoder(output_path, profile, frame_rate, channels) as encoder:
+        for i, block in enumerate(blocks):
+            encoder.write(block)
+            if i == 0 and on_start:
+                on_start(output_path)
+    return output_path
+
+
+def encode_stream(samples: np.ndarray, output_path: str, profile: str = None,
+                  frame_rate: int = 48000, on_start=None) -> str:
+    """Encode a finished mix buffer block by block. on_start(output_path) fires after the first block."""
+    blocks = (samples[start:start + BLOCK_FRAMES] for start in range(0, len(samples), BLOCK_FRAMES))
+    return encode_blocks(blocks, output_path, profile, frame_rate, samples.shape[1], on_start)
+
+
+async def follow(path: str, chunk_size: int = 64 * 1024, poll_interval: float = 0.05):
+    """Yield a file's bytes as they are written, finishing once its encoder closes."""
+    while not os.path.exists(path):
+        if not is_encoding(path):
+            return
+        await asyncio.sleep(poll_interval)
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if data:
+                yield data
+            elif is_encoding(path):
+                await asyncio.sleep(poll_interval)
+            else:
+                rest = f.read()
+                if not rest:
+                    return
+                yield rest
@@ -1,22 +1,76 @@
-import requests, os
+import os, json, asyncio
+from services.metrics_module import track, record_error, Counter
+from services.http_module import get_session
 
+URL = "https://api.featherless.ai/v1/chat/completions"
+# Tried in order: the next one is hedged in after REFINE_HEDGE_DELAY_SECONDS without an answer,
+# or at once when the previous one fails; the first good answer wins
+MODELS = [m.strip() for m in os.getenv("FEATHERLESS_MODELS", "Qwen/Qwen2.5-7B-Instruct").split(",") if m.strip()]
+BUDGET_SECONDS = float(os.getenv("REFINE_BUDGET_SECONDS", "8"))
+HEDGE_DELAY_SECONDS = float(os.getenv("REFINE_HEDGE_DELAY_SECONDS", "2"))
 
-def refine_lyrics(lyrics: str, genre: str, mood: str) -> str:
-    """Refine lyrics via Featherless AI (OpenAI-compatible, 4300+ open-source models)."""
+
+async def _complete(model: str, messages: list, api_key: str) -> str:
+    """One streamed chat completion: the full answer, or None on an error status or an empty answer."""
+    async with get_session("featherless").post(URL,
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={"model": model, "messages": messages, "max_tokens": 200, "temperature": 0.7, "stream": True},
+    ) as response:
+        if response.status != 200:
+            record_error("featherless", "refine_lyrics")
+            return None
+        parts = []
+        async for line in response.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            parts.append(json.loads(data)["choices"][0].get("delta", {}).get("content") or "")
+    return "".join(parts).strip() or None
+
+
+@track("featherless", "refine_lyrics")
+async def refine_lyrics(lyrics: str, genre: str, mood: str, budget: float = None) -> str:
+    """
+    Refine lyrics via Featherless AI (OpenAI-compatible, 4300+ open-source models),
+    hedged across MODELS. Returns None, so the caller keeps its own lyrics, if no
+    model answers within budget seconds (REFINE_BUDGET_SECONDS by default) or all fail.
+    """
     api_key = os.getenv("FEATHERLESS_API_KEY")
     if not api_key:
         return None
-    response = requests.post("https://api.featherless.ai/v1/chat/completions",
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        json={
-            "model": "Qwen/Qwen2.5-7B-Instruct",
-            "messages": [
-                {"role": "system", "content": "You are a professional songwriter. Refine lyrics to be singable and genre-appropriate. 4-8 lines max. Return ONLY refined lyrics."},
-                {"role": "user", "content": f"Genre: {genre}\nMood: {mood}\n\nOriginal:\n{lyrics}\n\nRefined:"}
-            ],
-            "max_tokens": 200, "temperature": 0.7
-        }, timeout=15)
-
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
+    messages = [
+        {"role": "system", "content": "You are a professional songwriter. Refine lyrics to be singable and genre-appropriate. 4-8 lines max. Return ONLY refined lyrics."},
+        {"role": "user", "content": f"Genre: {genre}\nMood: {mood}\n\nOriginal:\n{lyrics}\n\nRefined:"}
+    ]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (BUDGET_SECONDS if budget is None else budget)
+    waiting, pending = list(MODELS), set()
+    try:
+        while waiting or pending:
+            if waiting:
+                pending.add(asyncio.create_task(_complete(waiting.pop(0), messages, api_key)))
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=min(timeout, HEDGE_DELAY_SECONDS) if waiting else timeout,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    # A call that raised (connection reset, malformed stream) failed like an error status
+                    record_error("featherless", "refine_lyrics")
+                    print(f"      Featherless call failed: {task.exception()!r}")
+                elif task.result():
+                    REFINEMENTS.inc(result="refined")
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    REFINEMENTS.inc(result="budget_skipped" if pending else "failed")
     return None
+
+
+REFINEMENTS = Counter("memomuse_featherless_refinements_total",
+                      "Lyric refinements by outcome (refined, budget_skipped, failed).", ("result",))
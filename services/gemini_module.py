@@ -1,5 +1,14 @@
-import os, json
+import os, json, time
 from google import genai
+from services.metrics_module import timed, Histogram
+from services.cache_module import SqliteCache, content_key
+
+MODEL = "gemini-2.5-flash"
+PROMPT_VERSION = 2  # bump whenever the analysis prompt changes, so cached analyses are not reused
+ANALYSES = SqliteCache("gemini_analysis", os.getenv("GEMINI_CACHE_PATH", "cache/gemini.sqlite"),
+                       max_items=int(os.getenv("GEMINI_CACHE_ITEMS", "256")),
+                       max_bytes=int(os.getenv("GEMINI_CACHE_MB", "16")) << 20,
+                       ttl=int(os.getenv("GEMINI_CACHE_TTL_HOURS", "168")) * 3600)
 
 _client = None
 
@@ -11,11 +20,199 @@ def _get_client():
     return _client
 
 
-def get_gemini_analysis(raw_transcript: str, genre: str) -> dict:
-    prompt = f"""You are a professional music producer and songwriter.
+def _string_end(buf: str, i: int) -> int:
+    """Index just past the JSON string starting at buf[i], or -1 if it hasn't been closed yet."""
+    j = i + 1
+    while j < len(buf):
+        if buf[j] == "\\":
+            j += 2
+        elif buf[j] == '"':
+            return j + 1
+        else:
+            j += 1
+    return -1
+
+
+def _value_end(buf: str, i: int) -> int:
+    """Index just past the JSON value starting at buf[i], or -1 if more text is needed to tell."""
+    if buf[i] == '"':
+        return _string_end(buf, i)
+    if buf[i] in "{[":
+        depth, j = 0, i
+        while j < len(buf):
+            if buf[j] == '"':
+                j = _string_end(buf, j)
+                if j < 0:
+                    return -1
+                continue
+            if buf[j] in "{[":
+                depth += 1
+            elif buf[j] in "}]":
+                depth -= 1
+                if depth == 0:
+                    return j + 1
+            j += 1
+        return -1
+    j = i
+    while j < len(buf) and buf[j] not in ",}] \t\r\n":
+        j += 1
+    return j if j < len(buf) else -1  # a number could still be growing
+
+
+class FieldParser:
+    """
+    Incremental parser for a JSON object arriving in chunks. feed() returns
+    the (key, value) pairs of the top-level fields completed by the new
+    text; anything before the opening brace (a markdown fence) is skipped.
+    done is set once the closing brace arrives, with every field in fields.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.done = False
+        self._buf = ""
+        self._i = 0
+        self._state = "start"  # start -> key -> colon -> value -> key ... -> done
+        self._key = None
+
+    def feed(self, text: str) -> list:
+        self._buf += text
+        buf, completed = self._buf, []
+        while not self.done:
+            i = self._i
+            while i < len(buf) and buf[i] in " \t\r\n":
+                i += 1
+            if i >= len(buf):
+                break
+            if self._state == "start":
+                start = buf.find("{", i)
+                if start < 0:
+                    self._i = len(buf)
+                    break
+                self._i, self._state = start + 1, "key"
+            elif self._state == "key":
+                if buf[i] == ",":
+                    self._i = i + 1
+                elif buf[i] == "}":
+                    self._i, self.done = i + 1, True
+                else:
+                    end = _string_end(buf, i)
+                    if end < 0:
+                        break
+                    self._key, self._i, self._state = json.loads(buf[i:end]), end, "colon"
+            elif self._state == "colon":
+                if buf[i] != ":":
+                    raise ValueError(f"Expected ':' after {self._key!r}")
+                self._i, self._state = i + 1, "value"
+            else:
+                end = _value_end(buf, i)
+                if end < 0:
+                    break
+                value = json.loads(buf[i:end])
+                self.fields[self._key] = value
+                completed.append((self._key, value))
+                self._i, self._state = end, "key"
+        return completed
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+        text = text.strip()
+    return text
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def get_gemini_analysis(raw_transcript: str, genre: str, fresh: bool = False, on_field=None) -> dict:
+    """
+    Song analysis for a transcript and genre, served from the analysis cache
+    when the same (normalized) pair was analysed with this model and prompt.
+    fresh=True skips the lookup and replaces the cached analysis. The
+    response is streamed; on_field(key, value), if given, is called from this
+    thread as each top-level field completes, before the full dict returns.
+    """
+    key = content_key(MODEL, PROMPT_VERSION, _normalize(genre), _normalize(raw_transcript))
+    if not fresh:
+        cached = ANALYSES.get(key)
+        if cached is not None:
+            return cached
+    result = _analyze(_analysis_prompt(genre, raw_transcript), on_field)
+    ANALYSES.put(key, result)
+    return result
+
+
+def get_gemini_audio_analysis(audio_path: str, genre: str, fingerprint: str = None, fresh: bool = False,
+                              on_field=None) -> dict:
+    """
+    Single round trip: send the memo audio itself with the song-analysis
+    prompt and get the analysis plus a "transcript" field back, with no local
+    Whisper pass. Cached under the audio's PCM fingerprint when one is given.
+    """
+    from google.genai import types
+    key = fingerprint and content_key(MODEL, PROMPT_VERSION, "audio", _normalize(genre), fingerprint)
+    if key and not fresh:
+        cached = ANALYSES.get(key)
+        if cached is not None:
+            return cached
+    with open(audio_path, "rb") as f:
+        audio = types.Part.from_bytes(data=f.read(), mime_type=_mime_type(audio_path))
+    result = _analyze([_analysis_prompt(genre), audio], on_field, operation="song_analysis_audio")
+    result.setdefault("transcript", "")
+    if key:
+        ANALYSES.put(key, result)
+    return result
+
 
-A musician recorded a rough voice memo. Transcription:
-"{raw_transcript}"
+async def analyze_voicemail(audio_bytes: bytes, mime_type: str) -> dict:
+    """
+    Transcript, intent, sentiment, urgency, summary and suggested reply for a
+    support voicemail, via the shared client's async API so the loop never waits on it.
+    """
+    from google.genai import types
+    with timed("gemini", "voicemail_analyze"):
+        response = await _get_client().aio.models.generate_content(
+            model=MODEL, contents=[VOICEMAIL_PROMPT, types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)])
+    return json.loads(_strip_fences(response.text))
+
+
+VOICEMAIL_PROMPT = (
+    "You are an assistant that analyzes customer support voicemails for a Shopify-like online store. "
+    "Listen to the audio carefully and output strict JSON with exactly these fields: "
+    "transcript, intent, sentiment, urgency, summary, suggestedReply. "
+    "intent must be one of: ORDER_STATUS, RETURN, GENERAL_QUESTION, COMPLAINT, OTHER. "
+    "sentiment must be one of: POSITIVE, NEUTRAL, NEGATIVE. "
+    "urgency must be one of: LOW, MEDIUM, HIGH. "
+    "Return ONLY valid JSON — no markdown code blocks, no explanation, no extra text."
+)
+
+
+def _mime_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return {"wav": "audio/wav", "mp3": "audio/mpeg", "m4a": "audio/mp4", "mp4": "audio/mp4",
+            "ogg": "audio/ogg", "webm": "audio/webm", "flac": "audio/flac"}.get(ext, "audio/mpeg")
+
+
+def _analysis_prompt(genre: str, raw_transcript: str = None) -> str:
+    """
+    The song-analysis prompt, for a transcript or (raw_transcript None) for
+    attached audio. Production fields come before the lyrics so they stream first.
+    """
+    if raw_transcript is None:
+        memo = ("A musician recorded a rough voice memo; the recording is attached. Listen to it and put "
+                "a verbatim transcription of what they sing or say (empty if there are no words) in \"transcript\".")
+        transcript_field = ',\n  "transcript": "What the musician actually sang or said, verbatim."'
+    else:
+        memo = f'A musician recorded a rough voice memo. Transcription:\n"{raw_transcript}"'
+        transcript_field = ""
+    return f"""You are a professional music producer and songwriter.
+
+{memo}
 
 Target genre: {genre}
 
@@ -33,27 +230,42 @@ If contains_lyrics is false:
 
 Always create a detailed music production prompt for instrumental generation.
 
-Respond with ONLY valid JSON (no markdown):
+Respond with ONLY valid JSON (no markdown), with the fields in exactly this order:
 
 {{
   "contains_lyrics": true,
-  "song_title": "A catchy, creative song title (2-5 words). Make it memorable and fitting for the genre.",
-  "cleaned_lyrics": "Full structured lyrics with [Verse 1], [Chorus], [Verse 2], [Chorus] labels. 16-24 lines total.",
   "style_prompt": "Detailed music production prompt: genre, exact BPM, mood, key, instruments (list specific ones), energy arc, production style. Be very specific.",
-  "detected_genre": "refined genre",
-  "mood": "one or two words",
   "bpm": 120,
-  "key": "C minor"
+  "mood": "one or two words",
+  "key": "C minor",
+  "detected_genre": "refined genre",
+  "song_title": "A catchy, creative song title (2-5 words). Make it memorable and fitting for the genre.",
+  "cleaned_lyrics": "Full structured lyrics with [Verse 1], [Chorus], [Verse 2], [Chorus] labels. 16-24 lines total."{transcript_field}
 }}"""
 
-    response = _get_client().models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-    )
-    text = response.text.strip()
-    if text.startswith("```"):
-        text = text.split("```")[1]
-        if text.startswith("json"):
-            text = text[4:]
-        text = text.strip()
-    return json.loads(text)
+
+def _analyze(contents, on_field=None, operation: str = "song_analysis") -> dict:
+    """One streamed Gemini call, parsed field by field as it arrives."""
+    start = time.monotonic()
+    parser, chunks = FieldParser(), []
+    with timed("gemini", operation):
+        for chunk in _get_client().models.generate_content_stream(model=MODEL, contents=contents):
+            chunks.append(chunk.text or "")
+            if parser is None:
+                continue
+            try:
+                completed = parser.feed(chunks[-1])
+            except ValueError:
+                parser = None  # not the JSON we asked for; parsed as a whole below
+                continue
+            for key, value in completed:
+                FIELD_SECONDS.observe(time.monotonic() - start, field=key)
+                if on_field:
+                    on_field(key, value)
+        if parser is not None and parser.done:
+            return parser.fields
+        return json.loads(_strip_fences("".join(chunks)))
+
+
+FIELD_SECONDS = Histogram("memomuse_gemini_field_seconds",
+                          "Time from the analysis request until each streamed field was complete.", ("field",))
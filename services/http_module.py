@@ -0,0 +1,36 @@
+"""
+Long-lived, connection-pooled async HTTP sessions for the REST providers
+(Featherless, Shopify, Backboard). Each provider gets one aiohttp session,
+created on first use on the running loop and shared by every call, so
+requests reuse keep-alive connections, never block the event loop, and a
+slow provider can only exhaust its own pool. close() runs at app shutdown.
+"""
+import os, asyncio, aiohttp
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))  # open connections per provider
+KEEPALIVE_SECONDS = 30
+DEFAULT_TIMEOUT = 30
+
+_sessions = {}  # provider -> (loop, session)
+
+
+def get_session(provider: str) -> aiohttp.ClientSession:
+    """The shared session for provider, (re)created if missing, closed or bound to another loop."""
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(provider)
+    if entry is None or entry[0] is not loop or entry[1].closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, ttl_dns_cache=300, keepalive_timeout=KEEPALIVE_SECONDS)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT))
+        entry = _sessions[provider] = (loop, session)
+    return entry[1]
+
+
+async def close():
+    """Close every session opened on this loop."""
+    loop = asyncio.get_running_loop()
+    for provider, (owner, session) in list(_sessions.items()):
+        if owner is loop:
+            await session.close()
+        del _sessions[provider]
+
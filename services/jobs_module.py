@@ -0,0 +1,103 @@
+"""
+In-memory job registry for long-running pipeline runs. A job records every
+progress event it emits so that SSE clients can connect late (or reconnect
+with Last-Event-ID) and replay from where they left off; finished jobs keep
+their result until they expire.
+"""
+import os, time, uuid, asyncio
+
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+TERMINAL_EVENTS = ("done", "failed")
+
+_jobs = {}
+_tasks = set()
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.events = []  # (event, data) in emission order; the index is the SSE id
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data: dict = None):
+        """Record an event. Safe to call from worker threads as well as the loop."""
+        self._loop.call_soon_threadsafe(self._append, event, data or {})
+
+    def _append(self, event: str, data: dict):
+        if self.status in TERMINAL_EVENTS:
+            return
+        if event == "stage_started" and self.status == "queued":
+            self.status = "running"
+        elif event == "done":
+            self.status, self.result, self.finished = "done", data, time.time()
+        elif event == "failed":
+            self.status, self.error, self.finished = "failed", data.get("error"), time.time()
+        self.events.append((event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self, after: int = -1, keepalive: float = None):
+        """
+        Yield (id, event, data) for events after the given id, ending at
+        done/failed. With keepalive set, yields None after that many idle
+        seconds so the caller can ping the connection.
+        """
+        index = after + 1
+        while True:
+            while index < len(self.events):
+                event, data = self.events[index]
+                yield index, event, data
+                index += 1
+                if event in TERMINAL_EVENTS:
+                    return
+            try:
+                await asyncio.wait_for(self._changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def to_dict(self) -> dict:
+        body = {"job_id": self.id, "status": self.status, "created": self.created}
+        if self.result is not None:
+            body["result"] = self.result
+        if self.error is not None:
+            body["error"] = self.error
+        return body
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id in [j.id for j in _jobs.values() if j.finished and j.finished < cutoff]:
+        del _jobs[job_id]
+
+
+def submit(run) -> Job:
+    """
+    Start run(job) as a task on the running loop and return its Job at once.
+    run must return the result dict; an exception marks the job failed.
+    """
+    _prune()
+    job = Job()
+    _jobs[job.id] = job
+
+    async def _run():
+        try:
+            result = await run(job)
+        except Exception as e:
+            job.publish("failed", {"error": str(e)})
+            raise
+        job.publish("done", result)
+
+    task = asyncio.create_task(_run())
+    _tasks.add(task)
+    task.add_done_callback(lambda t: _tasks.discard(t) or t.cancelled() or t.exception())
+    return job
+
+
+def get_job(job_id: str) -> Job:
+    return _jobs.get(job_id)
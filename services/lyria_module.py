@@ -1,50 +1,411 @@
-import os, wave, asyncio
+import os, wave, time, asyncio, threading, contextlib
 from google import genai
 from google.genai import types
+from services.metrics_module import track, Gauge
 
+SAMPLE_RATE = 48000
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+TARGET_SECONDS = 60
+LYRIA_MODEL = "models/lyria-realtime-exp"
+POOL_SIZE = int(os.getenv("LYRIA_POOL_SIZE", "2"))
+# Idle sessions older than these are closed rather than handed out: the server may have dropped them
+SESSION_MAX_IDLE_SECONDS = float(os.getenv("LYRIA_SESSION_MAX_IDLE_SECONDS", "120"))
+SESSION_MAX_AGE_SECONDS = float(os.getenv("LYRIA_SESSION_MAX_AGE_SECONDS", "900"))
+# After stop(), audio still in flight is discarded until the stream has been quiet this long
+DRAIN_QUIET_SECONDS = 0.5
+DRAIN_MAX_SECONDS = 5.0
 
-def generate_instrumental(style_prompt: str, bpm: int = 120, output_path: str = "temp/instrumental.wav") -> str:
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options={"api_version": "v1alpha"})
-    audio_chunks = []
+_stats = {"generations": 0, "chunks": 0, "bytes": 0}
+_stats_lock = threading.Lock()
+
+
+def get_stats() -> dict:
+    """Counters for instrumental generation (replaces the old per-chunk prints)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    if _pool is not None:
+        stats["pool"] = _pool.stats()
+    return stats
+
+
+def _make_client():
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options={"api_version": "v1alpha"})
+
+
+class InstrumentalSpool:
+    """
+    Appends Lyria PCM chunks to a WAV file as they arrive and fans each chunk
+    out to subscribers, so consumers can start before generation finishes.
+    The WAV header is patched on every append, so the file is always readable.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.frames = 0
+        self.closed = False
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._file = open(output_path, "wb")
+        self._wav = wave.open(self._file, "wb")
+        self._wav.setnchannels(CHANNELS)
+        self._wav.setsampwidth(SAMPLE_WIDTH)
+        self._wav.setframerate(SAMPLE_RATE)
+
+    def subscribe(self, callback):
+        """
+        Register callback(data) for every chunk appended from now on; it gets
+        None once the spool closes. Returns a function that unsubscribes.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    async def stream(self):
+        """Async iterator over chunks appended after the call, usable from any event loop."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        unsubscribe = self.subscribe(lambda data: loop.call_soon_threadsafe(queue.put_nowait, data))
+        try:
+            while (data := await queue.get()) is not None:
+                yield data
+        finally:
+            unsubscribe()
+
+    def append(self, data: bytes):
+        with self._lock:
+            self._wav.writeframes(data)
+            self._file.flush()
+            self.frames += len(data) // (CHANNELS * SAMPLE_WIDTH)
+            subscribers = list(self._subscribers)
+        with _stats_lock:
+            _stats["chunks"] += 1
+            _stats["bytes"] += len(data)
+        for callback in subscribers:
+            callback(data)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._wav.close()
+            self._file.close()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(None)
+
+
+async def _stream_session(session, style_prompt: str, bpm: int, spool: InstrumentalSpool):
+    await session.set_weighted_prompts([types.WeightedPrompt(text=style_prompt, weight=1.0)])
+    await session.set_music_generation_config(
+        types.LiveMusicGenerationConfig(bpm=bpm, temperature=1.0, guidance=3.5)
+    )
+    await session.play()
+
+    target_frames = SAMPLE_RATE * TARGET_SECONDS
+    async for message in session.receive():
+        if message.server_content and message.server_content.audio_chunks:
+            for chunk in message.server_content.audio_chunks:
+                spool.append(chunk.data)
+        if spool.frames >= target_frames:
+            break
+
+
+def _finish(spool: InstrumentalSpool) -> str:
+    if not spool.frames:
+        try:
+            os.remove(spool.output_path)
+        except OSError:
+            pass
+        raise RuntimeError("Lyria returned no audio. Check your GEMINI_API_KEY and that Lyria Realtime is enabled.")
+    return spool.output_path
+
+
+class _PooledSession:
+    def __init__(self, stack: contextlib.AsyncExitStack, session):
+        self.stack = stack
+        self.session = session
+        self.uses = 0
+        self.created = self.idle_since = time.monotonic()
+
+    def stale(self, now: float) -> bool:
+        return (now - self.idle_since > SESSION_MAX_IDLE_SECONDS
+                or now - self.created > SESSION_MAX_AGE_SECONDS)
+
+
+async def _drain(session) -> bool:
+    """
+    Discard whatever the session still sends after stop(). True once nothing
+    has arrived for DRAIN_QUIET_SECONDS (or the stream ended), False if audio
+    kept coming for DRAIN_MAX_SECONDS.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_MAX_SECONDS
+    stream = session.receive().__aiter__()
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining < DRAIN_QUIET_SECONDS:
+                return False
+            try:
+                await asyncio.wait_for(stream.__anext__(), DRAIN_QUIET_SECONDS)
+            except StopAsyncIteration:
+                return True
+            except asyncio.TimeoutError:
+                return True
+    finally:
+        with contextlib.suppress(Exception):
+            await stream.aclose()
+
+
+class LyriaSessionPool:
+    """
+    Bounded pool of connected Lyria music sessions on the app's event loop.
+    Sessions are opened ahead of time by warm() and handed out by acquire().
+    release() returns a session in the background: it is stopped, drained of
+    audio still in flight and reset before anyone else can get it. A session
+    that errors or won't go quiet is closed and replaced, and idle sessions
+    past their idle or age limit are closed instead of being handed out.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, client=None):
+        self.size = size
+        self._client = client
+        self._idle = []
+        self._open = 0
+        self._waiters = 0
+        self._cond = None
+        self._tasks = set()
+        self._stats = {"acquired": 0, "recycled": 0, "expired": 0, "connect_errors": 0,
+                       "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _connect(self) -> _PooledSession:
+        if self._client is None:
+            self._client = _make_client()
+        stack = contextlib.AsyncExitStack()
+        try:
+            session = await stack.enter_async_context(self._client.aio.live.music.connect(model=LYRIA_MODEL))
+        except Exception:
+            self._stats["connect_errors"] += 1
+            await stack.aclose()
+            raise
+        return _PooledSession(stack, session)
+
+    async def _add_session(self):
+        """Open one more session (slot already reserved in _open) and park it as idle."""
+        try:
+            pooled = await self._connect()
+        except Exception:
+            async with self._condition():
+                self._open -= 1
+                self._condition().notify()
+            raise
+        async with self._condition():
+            self._idle.append(pooled)
+            self._condition().notify()
+
+    async def warm(self):
+        """Fill the pool up to its size with connected sessions."""
+        async with self._condition():
+            missing = self.size - self._open
+            self._open += missing
+        results = await asyncio.gather(*(self._add_session() for _ in range(missing)), return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+    async def acquire(self) -> _PooledSession:
+        start = time.monotonic()
+        cond = self._condition()
+        async with cond:
+            self._waiters += 1
+            expired = []
+            try:
+                while True:
+                    expired += self._expire_idle()
+                    if self._idle or self._open < self.size:
+                        break
+                    await cond.wait()
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._open += 1
+                    pooled = None
+            finally:
+                self._waiters -= 1
+        for stale in expired:
+            self._spawn(stale.stack.aclose())
+        if pooled is None:
+            try:
+                pooled = await self._connect()
+            except BaseException:
+                # Failed or cancelled handshake: give the reserved slot back
+                self._open -= 1
+                self._spawn(self._notify())
+                raise
+        waited = time.monotonic() - start
+        self._stats["acquired"] += 1
+        self._stats["wait_seconds_total"] += waited
+        self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        return pooled
+
+    def _expire_idle(self) -> list:
+        """Take idle sessions past their idle or age limit out of the pool (caller holds the condition)."""
+        now = time.monotonic()
+        expired = [p for p in self._idle if p.stale(now)]
+        if expired:
+            self._idle = [p for p in self._idle if not p.stale(now)]
+            self._open -= len(expired)
+            self._stats["expired"] += len(expired)
+        return expired
+
+    async def release(self, pooled: _PooledSession, healthy: bool = True):
+        """Hand a session back; it rejoins the idle set once stopped and drained, off the caller's path."""
+        self._spawn(self._return(pooled, healthy))
+
+    async def _return(self, pooled: _PooledSession, healthy: bool):
+        if healthy:
+            try:
+                await pooled.session.stop()
+                healthy = await _drain(pooled.session)
+                if healthy:
+                    await pooled.session.reset_context()
+            except Exception:
+                healthy = False
+        if healthy:
+            pooled.uses += 1
+            pooled.idle_since = time.monotonic()
+            async with self._condition():
+                self._idle.append(pooled)
+                self._condition().notify()
+            return
+
+        self._stats["recycled"] += 1
+        with contextlib.suppress(Exception):
+            await pooled.stack.aclose()
+        # Keep the slot reserved and reconnect in the background
+        await self._add_session()
+
+    async def _notify(self):
+        async with self._condition():
+            self._condition().notify()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._tasks.discard(t) or t.cancelled() or t.exception())
+
+    async def close(self):
+        # Let sessions still being drained land in the idle set so they get closed too
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        async with self._condition():
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for pooled in idle:
+            with contextlib.suppress(Exception):
+                await pooled.stack.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "open": self._open,
+            "idle": len(self._idle),
+            "in_use": self._open - len(self._idle),
+            "waiting": self._waiters,
+            **self._stats,
+        }
+
+
+_pool = None
+
+POOL_SESSIONS = Gauge("memomuse_lyria_pool_sessions", "Lyria sessions by state.", ("state",),
+                      fn=lambda: {s: _pool.stats()[s] for s in ("open", "idle", "in_use", "waiting")} if _pool else {})
+POOL_WAIT = Gauge("memomuse_lyria_pool_wait_seconds", "Lyria pool acquire wait time.", ("stat",),
+                  fn=lambda: {"total": _pool.stats()["wait_seconds_total"],
+                              "max": _pool.stats()["wait_seconds_max"]} if _pool else {})
+CHUNKS = Gauge("memomuse_lyria_received", "Lyria chunks and bytes received.", ("unit",),
+               fn=lambda: {"chunks": _stats["chunks"], "bytes": _stats["bytes"]})
+
+
+def get_pool() -> LyriaSessionPool:
+    global _pool
+    if _pool is None:
+        _pool = LyriaSessionPool()
+    return _pool
+
+
+@track("lyria", "generate")
+async def generate_instrumental_async(style_prompt: str, bpm: int = 120,
+                                      output_path: str = "temp/instrumental.wav",
+                                      spool: InstrumentalSpool = None,
+                                      pool: LyriaSessionPool = None) -> str:
+    """
+    Generate the instrumental on the running event loop using a pooled session.
+    A pooled session that fails before producing audio is recycled and the
+    prompt is retried once on a fresh connection.
+    """
+    pool = pool or get_pool()
+    if spool is None:
+        spool = InstrumentalSpool(output_path)
+    with _stats_lock:
+        _stats["generations"] += 1
+
+    try:
+        for attempt in range(2):
+            pooled = await pool.acquire()
+            try:
+                await _stream_session(pooled.session, style_prompt, bpm, spool)
+            except Exception as e:
+                await pool.release(pooled, healthy=False)
+                if spool.frames or attempt:
+                    if isinstance(e, TimeoutError):
+                        raise RuntimeError("Lyria connection timed out. Check your GEMINI_API_KEY and network.") from e
+                    raise
+                continue
+            except BaseException:
+                # Cancelled mid-stream (e.g. another stage failed): don't leave the slot checked out
+                await pool.release(pooled, healthy=False)
+                raise
+            await pool.release(pooled)
+            break
+    finally:
+        spool.close()
+    return _finish(spool)
+
+
+@track("lyria", "generate")
+def generate_instrumental(style_prompt: str, bpm: int = 120, output_path: str = "temp/instrumental.wav",
+                          spool: InstrumentalSpool = None) -> str:
+    """
+    Blocking one-shot variant for scripts: opens its own connection and event
+    loop. Pass a spool you have already subscribed to in order to consume the
+    instrumental progressively.
+    """
+    client = _make_client()
+    if spool is None:
+        spool = InstrumentalSpool(output_path)
+    with _stats_lock:
+        _stats["generations"] += 1
 
     async def _generate():
-        async with client.aio.live.music.connect(model="models/lyria-realtime-exp") as session:
-            await session.set_weighted_prompts([types.WeightedPrompt(text=style_prompt, weight=1.0)])
-            await session.set_music_generation_config(
-                types.LiveMusicGenerationConfig(bpm=bpm, temperature=1.0, guidance=3.5)
-            )
-            await session.play()
-
-            total_samples = 0
-            target_samples = 48000 * 60  # 60 seconds at 48kHz
-            print(f"Target samples: {target_samples}")
-            async for message in session.receive():
-                if message.server_content and message.server_content.audio_chunks:
-                    for chunk in message.server_content.audio_chunks:
-                        audio_chunks.append(chunk.data)
-                        total_samples += len(chunk.data) // 4
-                    print(f"Received chunk. Total samples: {total_samples}/{target_samples}")
-                if total_samples >= target_samples:
-                    print("Reached target samples!")
-                    break
-            print("Exited async for loop")
+        async with client.aio.live.music.connect(model=LYRIA_MODEL) as session:
+            await _stream_session(session, style_prompt, bpm, spool)
 
     loop = asyncio.new_event_loop()
     try:
         loop.run_until_complete(_generate())
     except TimeoutError as e:
-        loop.close()
         raise RuntimeError("Lyria connection timed out. Check your GEMINI_API_KEY and network.") from e
     finally:
         loop.close()
-
-    if not audio_chunks:
-        raise RuntimeError("Lyria returned no audio. Check your GEMINI_API_KEY and that Lyria Realtime is enabled.")
-
-    with wave.open(output_path, "w") as wav:
-        wav.setnchannels(2)
-        wav.setsampwidth(2)
-        wav.setframerate(48000)
-        for chunk_data in audio_chunks:
-            wav.writeframes(chunk_data)
-    return output_path
+        spool.close()
+    return _finish(spool)
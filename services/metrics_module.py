@@ -0,0 +1,222 @@
+"""
+In-process metrics with Prometheus text exposition, plus a tracing helper that
+times provider calls and pipeline stages. Per-request breakdowns are collected
+through a context variable, so calls made via asyncio.to_thread are included.
+"""
+import time, inspect, threading, functools, contextlib, contextvars
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_lock = threading.Lock()
+_trace = contextvars.ContextVar("memomuse_trace", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _label_dict(self, key: tuple) -> dict:
+        return dict(zip(self.labels, key))
+
+    def samples(self):
+        """Yield (name, labels, value) tuples for exposition."""
+        with _lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._label_dict(key), value
+
+    def get(self, **labels) -> float:
+        with _lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A settable gauge, or a callback gauge when fn returns the current value."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+        super().__init__(name, help, labels)
+        self._fn = fn
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self._fn is None:
+            yield from super().samples()
+            return
+        try:
+            value = self._fn()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for key, v in value.items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, self._label_dict(tuple(str(k) for k in key)), v
+        else:
+            yield self.name, {}, value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def get(self, **labels) -> dict:
+        with _lock:
+            state = self._values.get(self._key(labels))
+            return {"sum": state["sum"], "count": state["count"]} if state else {"sum": 0.0, "count": 0}
+
+    def samples(self):
+        with _lock:
+            items = [(k, {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]})
+                     for k, v in self._values.items()]
+        for key, state in items:
+            labels = self._label_dict(key)
+            for bound, count in zip(self.buckets, state["buckets"]):
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, count
+            yield f"{self.name}_sum", labels, state["sum"]
+            yield f"{self.name}_count", labels, state["count"]
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("memomuse_stage_seconds", "Pipeline stage latency.", ("stage",))
+STAGE_ERRORS = Counter("memomuse_stage_errors_total", "Pipeline stages that raised.", ("stage",))
+PROVIDER_SECONDS = Histogram("memomuse_provider_seconds", "Provider call latency.", ("provider", "operation"))
+PROVIDER_ERRORS = Counter("memomuse_provider_errors_total", "Provider calls that failed.", ("provider", "operation"))
+PIPELINES_IN_FLIGHT = Gauge("memomuse_pipelines_in_flight", "Pipelines currently running.")
+
+
+@contextlib.contextmanager
+def request_trace():
+    """Collect every provider call made in this context (and its threads) into a list."""
+    calls = []
+    token = _trace.set(calls)
+    try:
+        yield calls
+    finally:
+        _trace.reset(token)
+
+
+def record_error(provider: str, operation: str):
+    """Count a provider failure that was reported without raising (e.g. a non-2xx response)."""
+    PROVIDER_ERRORS.inc(provider=provider, operation=operation)
+
+
+@contextlib.contextmanager
+def timed(provider: str, operation: str):
+    """Time a provider call, counting it as an error if it raises."""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        record_error(provider, operation)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        PROVIDER_SECONDS.observe(seconds, provider=provider, operation=operation)
+        calls = _trace.get()
+        if calls is not None:
+            calls.append({"provider": provider, "operation": operation,
+                          "ms": round(seconds * 1000, 1), **({"error": error} if error else {})})
+
+
+def track(provider: str, operation: str):
+    """Decorator form of timed() for sync and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(provider, operation):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(provider, operation):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_stage_event(event: str, data: dict):
+    """StageGraph on_event hook that feeds the stage histograms."""
+    if event == "stage_finished":
+        STAGE_SECONDS.observe(data["seconds"], stage=data["stage"])
+    elif event == "stage_failed":
+        STAGE_ERRORS.inc(stage=data["stage"])
+        if data.get("seconds") is not None:
+            STAGE_SECONDS.observe(data["seconds"], stage=data["stage"])
@@ -1,17 +1,151 @@
-import os
-import requests
+"""
+Vinyl products on Shopify via the Admin REST API. Every call passes a
+client-side leaky bucket kept in step with Shopify's X-Shopify-Shop-Api-Call-Limit
+header, and 429s hold the bucket back for Retry-After before retrying. Products get a handle and
+SKU derived from the track's content, so publishing the same track again
+(a retried request or bulk run) finds the existing product instead of
+creating a duplicate. The lookup and create for one handle run under a lock,
+so concurrent publishes of the same track in this process can't both create it.
+"""
+import os, re, time, asyncio, weakref
+import aiohttp
+from services.metrics_module import timed, record_error, Counter
+from services.http_module import get_session
+from services.cache_module import content_key
 
+API_VERSION = "2024-01"
+TIMEOUT = aiohttp.ClientTimeout(total=15)
+BUCKET_SIZE = 40  # Shopify's standard REST bucket; corrected from the call-limit header
+LEAK_RATE = float(os.getenv("SHOPIFY_LEAK_RATE", "2"))  # calls per second the bucket drains
+PUBLISH_CONCURRENCY = int(os.getenv("SHOPIFY_PUBLISH_CONCURRENCY", "4"))
+MAX_RETRIES = 3
 
-def create_vinyl_product(song_title: str, lyrics: str, genre: str, mood: str, bpm: int, key: str, audio_url: str = "") -> dict:
-    """Create a vinyl record product on Shopify via Admin API."""
-    admin_token = os.getenv("SHOPIFY_ADMIN_TOKEN")
-    domain = os.getenv("NEXT_PUBLIC_SHOPIFY_STORE_DOMAIN")
 
+class ShopifyError(Exception):
+    pass
+
+
+class LeakyBucket:
+    """
+    Client-side copy of Shopify's leaky bucket: each call adds one, the level
+    drains at leak_rate per second, and acquire() waits while the bucket is
+    full. update() resyncs level and size from a "used/size" call-limit header.
+    """
+
+    def __init__(self, size: int = BUCKET_SIZE, leak_rate: float = LEAK_RATE):
+        self.size = size
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _drain(self):
+        now = time.monotonic()
+        self.level = max(0.0, self.level - (now - self._updated) * self.leak_rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._drain()
+            while self.level + 1 > self.size:
+                await asyncio.sleep((self.level + 1 - self.size) / self.leak_rate)
+                self._drain()
+            self.level += 1
+
+    def update(self, header: str):
+        try:
+            used, size = (int(n) for n in header.split("/"))
+        except (AttributeError, ValueError):
+            return
+        self._drain()
+        self.level, self.size = float(used), size
+
+    def throttle(self, seconds: float):
+        """After a 429: hold every caller back for the given Retry-After seconds."""
+        self._drain()
+        self.level = self.size - 1 + seconds * self.leak_rate
+
+
+_bucket = LeakyBucket()
+_handle_locks = weakref.WeakValueDictionary()  # handle -> asyncio.Lock, kept while a publish holds it
+
+
+def _handle_lock(handle: str) -> asyncio.Lock:
+    lock = _handle_locks.get(handle)
+    if lock is None:
+        lock = _handle_locks[handle] = asyncio.Lock()
+    return lock
+
+
+def _config():
+    return os.getenv("SHOPIFY_ADMIN_TOKEN"), os.getenv("NEXT_PUBLIC_SHOPIFY_STORE_DOMAIN")
+
+
+async def _request(method: str, path: str, operation: str, **kwargs) -> dict:
+    """One Admin API call through the rate limiter, retrying 429s; raises ShopifyError on other failures."""
+    admin_token, domain = _config()
+    headers = {"X-Shopify-Access-Token": admin_token, "Content-Type": "application/json"}
+    url = f"https://{domain}/admin/api/{API_VERSION}/{path}"
+    for attempt in range(MAX_RETRIES + 1):
+        await _bucket.acquire()
+        with timed("shopify", operation):
+            async with get_session("shopify").request(method, url, headers=headers, timeout=TIMEOUT,
+                                                      **kwargs) as response:
+                _bucket.update(response.headers.get("X-Shopify-Shop-Api-Call-Limit"))
+                if response.status in (200, 201):
+                    return await response.json()
+                text = await response.text()
+        if response.status == 429 and attempt < MAX_RETRIES:
+            THROTTLED.inc()
+            _bucket.throttle(float(response.headers.get("Retry-After", 2)))
+            continue
+        record_error("shopify", operation)
+        raise ShopifyError(f"Shopify API error {response.status}: {text[:200]}")
+
+
+def product_sku(song_title: str, lyrics: str, genre: str, mood: str, bpm: int, key: str) -> str:
+    """SKU derived from the track's content: the same track gets the same SKU in every process."""
+    return "MM-VINYL-" + content_key("vinyl", song_title, lyrics, genre, mood, bpm, key)[:10].upper()
+
+
+def _handle(song_title: str, sku: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", song_title.lower()).strip("-") or "track"
+    return f"{slug[:60]}-{sku.rsplit('-', 1)[-1].lower()}"
+
+
+def _result(product: dict, domain: str, sku: str, status: str) -> dict:
+    handle = product.get("handle", "")
+    return {"product_id": product.get("id"), "product_url": f"https://{domain}/products/{handle}",
+            "handle": handle, "sku": sku, "status": status}
+
+
+async def create_vinyl_product(song_title: str, lyrics: str, genre: str, mood: str, bpm: int, key: str, audio_url: str = "") -> dict:
+    """Create a vinyl record product on Shopify via Admin API, or return the one already created for this track."""
+    admin_token, domain = _config()
     if not admin_token or not domain:
         return {"error": "Shopify Admin API not configured"}
+    try:
+        return await _publish(song_title, lyrics, genre, mood, bpm, key, domain)
+    except (ShopifyError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return {"error": str(e) or type(e).__name__}
+
 
-    url = f"https://{domain}/admin/api/2024-01/products.json"
+async def _publish(song_title: str, lyrics: str, genre: str, mood: str, bpm: int, key: str, domain: str) -> dict:
+    sku = product_sku(song_title, lyrics, genre, mood, bpm, key)
+    handle = _handle(song_title, sku)
+    # Check-then-create is only idempotent if nobody else creates the handle in between
+    async with _handle_lock(handle):
+        existing = (await _request("GET", "products.json", "find_product",
+                                   params={"handle": handle, "fields": "id,handle"})).get("products", [])
+        if existing:
+            return _result(existing[0], domain, sku, "exists")
+        product = (await _request("POST", "products.json", "create_product",
+                                  json=_product_data(song_title, lyrics, genre, mood, bpm, key, sku, handle)))
+    return _result(product.get("product", {}), domain, sku, "created")
 
+
+def _product_data(song_title: str, lyrics: str, genre: str, mood: str, bpm: int, key: str, sku: str,
+                  handle: str) -> dict:
     description = f"""<p><strong>{song_title}</strong> — a one-of-a-kind vinyl record generated by MemoMuse AI.</p>
 <p><strong>Genre:</strong> {genre}<br>
 <strong>Mood:</strong> {mood}<br>
@@ -21,9 +155,10 @@ def create_vinyl_product(song_title: str, lyrics: str, genre: str, mood: str, bp
 <pre>{lyrics}</pre>
 <p><em>Each vinyl is custom pressed with your AI-generated track. Ships in 2-3 weeks.</em></p>"""
 
-    product_data = {
+    return {
         "product": {
             "title": f"{song_title} — MemoMuse Vinyl",
+            "handle": handle,
             "body_html": description,
             "vendor": "MemoMuse",
             "product_type": "Vinyl Record",
@@ -33,7 +168,7 @@ def create_vinyl_product(song_title: str, lyrics: str, genre: str, mood: str, bp
             "variants": [
                 {
                     "price": "24.99",
-                    "sku": f"MM-VINYL-{hash(song_title) % 99999:05d}",
+                    "sku": sku,
                     "inventory_quantity": 100,
                     "requires_shipping": True,
                 }
@@ -41,21 +176,60 @@ def create_vinyl_product(song_title: str, lyrics: str, genre: str, mood: str, bp
         }
     }
 
-    headers = {
-        "X-Shopify-Access-Token": admin_token,
-        "Content-Type": "application/json",
-    }
 
-    response = requests.post(url, json=product_data, headers=headers, timeout=15)
+async def publish_catalog(tracks: list, concurrency: int = PUBLISH_CONCURRENCY) -> list:
+    """
+    Publish many tracks as vinyl products, up to concurrency at a time under
+    the shared rate limiter. Returns one result per track, in order, each with
+    a status of created, exists or failed; safe to re-run with the same tracks.
+    A track repeated in the list is published once and shares the first one's result.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def failed(e: Exception) -> dict:
+        PUBLISHED.inc(status="failed")
+        return {"error": f"{type(e).__name__}: {e}", "status": "failed"}
+
+    async def publish(fields: dict, audio_url: str) -> dict:
+        try:
+            async with semaphore:
+                result = await create_vinyl_product(**fields, audio_url=audio_url)
+        except Exception as e:
+            # One malformed item fails alone instead of sinking the whole batch
+            return failed(e)
+        if "error" in result:
+            result = {**result, "status": "failed"}
+        PUBLISHED.inc(status=result["status"])
+        return result
+
+    first, owners = {}, []  # sku -> index of its first track; each track's first index
+    fields, invalid = [], {}  # each track's product fields; index -> result for tracks that don't coerce
+    for i, item in enumerate(tracks):
+        try:
+            fields.append(_track_fields(item))
+            owners.append(first.setdefault(product_sku(**fields[i]), i))
+        except Exception as e:
+            fields.append(None)
+            owners.append(i)
+            invalid[i] = failed(e)
+    unique = list(first.values())
+    published = dict(zip(unique, await asyncio.gather(
+        *(publish(fields[i], str(tracks[i].get("audio_url") or "")) for i in unique))))
+    published.update(invalid)
+    return [{"index": i, **published[owner]} for i, owner in enumerate(owners)]
+
+
+def _track_fields(item: dict) -> dict:
+    """Product fields from a catalog item: missing or null values take defaults, text is coerced to str
+    and bpm to int (a TypeError or ValueError here marks just this item as failed)."""
+    def text(name: str, default: str = "") -> str:
+        value = item.get(name)
+        return default if value is None else str(value)
+    bpm = item.get("bpm")
+    return {"song_title": text("song_title", "Untitled Track"), "lyrics": text("lyrics"), "genre": text("genre"),
+            "mood": text("mood"), "bpm": 120 if bpm is None else int(bpm), "key": text("key")}
 
-    if response.status_code in (200, 201):
-        product = response.json().get("product", {})
-        product_id = product.get("id")
-        handle = product.get("handle", "")
-        return {
-            "product_id": product_id,
-            "product_url": f"https://{domain}/products/{handle}",
-            "handle": handle,
-        }
 
-    return {"error": f"Shopify API error {response.status_code}: {response.text[:200]}"}
+PUBLISHED = Counter("memomuse_shopify_products_total", "Vinyl products published by status (created, exists, failed).",
+                    ("status",))
+THROTTLED = Counter("memomuse_shopify_throttled_total", "Shopify Admin API calls rejected with 429 and retried.")
@@ -1,14 +1,401 @@
-import ssl
-import whisper
+import os, ssl, time, heapq, itertools, threading, multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from services.metrics_module import track, Gauge
+from services.cache_module import TieredCache, content_key
+from services.audio_module import (
+    TRIM_RATE, load_stem, array_to_segment, speech_regions, join_regions, pcm_fingerprint,
+)
 
 ssl._create_default_https_context = ssl._create_unverified_context
-_model = None
+MODEL_NAME = "base"
+BACKEND = os.getenv("TRANSCRIBE_BACKEND", "whisper")
+_workers_env = os.getenv("WHISPER_WORKERS", "2")
+WORKERS = (os.cpu_count() or 1) if _workers_env == "auto" else int(_workers_env)
+# Off by default until bench_transcribe.py --batch shows no WER difference on the fixtures
+MAX_BATCH = int(os.getenv("TRANSCRIBE_MAX_BATCH", "1"))
+BATCH_WINDOW = int(os.getenv("TRANSCRIBE_BATCH_WINDOW_MS", "50")) / 1000
+# whisper's transcribe() defaults, which the batched path has to decode with too
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+TRANSCRIPTS = TieredCache("transcript", os.getenv("TRANSCRIPT_CACHE_DIR", "cache/transcripts"),
+                          max_items=int(os.getenv("TRANSCRIPT_CACHE_ITEMS", "256")),
+                          max_bytes=int(os.getenv("TRANSCRIPT_CACHE_MB", "32")) << 20)
+
+whisper = None  # imported on first use: torch makes it the slowest import in the app
+_model = None  # the loaded backend
+_model_lock = threading.Lock()  # the in-process model is not thread-safe
+_pool = None
+
+
+def _whisper():
+    global whisper
+    if whisper is None:
+        import whisper as module
+        whisper = module
+    return whisper
+
+
+class WhisperBackend:
+    """openai-whisper on PyTorch, fp32 (fp16 on GPU)."""
+    name = "whisper"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model = _whisper().load_model(model_name)
+
+    def transcribe(self, audio_path: str) -> str:
+        return self.model.transcribe(audio_path)["text"]
+
+    def transcribe_batch(self, audio_paths: list) -> list:
+        """
+        Transcribe several memos with one encoder pass over their 30 s
+        windows, then decode the windows together with transcribe()'s
+        options: timestamps, temperature fallback and the no-speech skip.
+        A memo longer than one window, or whose window transcribe() would
+        re-decode from its last timestamp, goes through transcribe() on its
+        own, so every text is what transcribe() returns for that memo.
+        Returns one text, or the exception that memo raised, per path.
+        """
+        import torch
+        whisper = _whisper()
+        n_frames = whisper.audio.N_FRAMES
+        results, mels, owners = [None] * len(audio_paths), [], []
+        for i, path in enumerate(audio_paths):
+            try:
+                # The same window transcribe() decodes first: mel of the memo plus 30 s of padding
+                mel = whisper.log_mel_spectrogram(path, self.model.dims.n_mels, padding=whisper.audio.N_SAMPLES)
+            except Exception as e:
+                results[i] = e
+                continue
+            content_frames = mel.shape[-1] - n_frames
+            if content_frames <= n_frames:
+                mels.append(whisper.pad_or_trim(mel[:, :content_frames], n_frames))
+                owners.append(i)
+        if mels:
+            dtype = torch.float16 if self._fp16() else torch.float32
+            with torch.no_grad():
+                features = self.model.embed_audio(torch.stack(mels).to(self.model.device).to(dtype))
+            for owner, text in zip(owners, self._decode_windows(features)):
+                results[owner] = text
+        for i, path in enumerate(audio_paths):
+            if results[i] is None:
+                try:
+                    results[i] = self.transcribe(path)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+    def _decode_windows(self, features) -> list:
+        """transcribe()'s decode_with_fallback over a batch of encoded windows; None where it would seek on."""
+        whisper = _whisper()
+        decoded = [None] * len(features)
+        pending = list(range(len(features)))
+        for temperature in TEMPERATURES:
+            if not pending:
+                break
+            options = whisper.DecodingOptions(temperature=temperature, fp16=self._fp16(),
+                                              language=None if self.model.is_multilingual else "en")
+            retry = []
+            for i, result in zip(pending, whisper.decode(self.model, features[pending], options)):
+                decoded[i] = result
+                silence = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+                if not silence and (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                                    or result.avg_logprob < LOGPROB_THRESHOLD):
+                    retry.append(i)
+            pending = retry
+        return [self._window_text(result) for result in decoded]
+
+    def _window_text(self, result):
+        if result.no_speech_prob > NO_SPEECH_THRESHOLD and not result.avg_logprob > LOGPROB_THRESHOLD:
+            return ""  # transcribe() skips the window as silence
+        tokenizer = _whisper().tokenizer.get_tokenizer(
+            self.model.is_multilingual, num_languages=self.model.num_languages, language=result.language)
+        timestamps = [t >= tokenizer.timestamp_begin for t in result.tokens]
+        consecutive = any(a and b for a, b in zip(timestamps, timestamps[1:]))
+        if consecutive and timestamps[-2:] != [False, True]:
+            return None  # the last segment is cut off: transcribe() decodes a second window from there
+        return tokenizer.decode([t for t in result.tokens if t < tokenizer.eot])
+
+    def _fp16(self) -> bool:
+        return self.model.device.type == "cuda"
+
+
+class QuantizedWhisperBackend(WhisperBackend):
+    """
+    openai-whisper with every Linear layer dynamically quantized to int8
+    (torch.ao.quantization) — about half the weight memory and faster
+    matmuls on CPU, same decoding code.
+    """
+    name = "whisper-int8"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        import torch
+        whisper = _whisper()
+        model = whisper.load_model(model_name, device="cpu")
+        # whisper's Linear subclass only adds dtype casting; quantize_dynamic needs the base type
+        for module in model.modules():
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def transcribe(self, audio_path: str) -> str:
+        return self.model.transcribe(audio_path, fp16=False)["text"]
+
+    def _fp16(self) -> bool:
+        return False
+
+
+class FasterWhisperBackend:
+    """CTranslate2 runtime via faster-whisper, int8 on CPU. Optional dependency."""
+    name = "faster-whisper"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError("TRANSCRIBE_BACKEND=faster-whisper needs `pip install faster-whisper`") from e
+        self.model = WhisperModel(model_name, device="cpu", compute_type="int8")
+
+    def transcribe(self, audio_path: str) -> str:
+        return "".join(text for _, _, text in self.segments(audio_path))
+
+    def segments(self, audio_path: str) -> list:
+        segments, _ = self.model.transcribe(audio_path)
+        return [(s.start, s.end, s.text) for s in segments]
+
+    def transcribe_batch(self, audio_paths: list) -> list:
+        # CTranslate2 already batches within a memo; across memos, run them in turn
+        results = []
+        for path in audio_paths:
+            try:
+                results.append(self.transcribe(path))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+BACKENDS = {cls.name: cls for cls in (WhisperBackend, QuantizedWhisperBackend, FasterWhisperBackend)}
+
+
+def load_backend(name: str = None, model_name: str = MODEL_NAME):
+    name = name or BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TRANSCRIBE_BACKEND {name!r}; choose from {sorted(BACKENDS)}")
+    return BACKENDS[name](model_name)
+
 
 def _get_model():
     global _model
     if _model is None:
-        _model = whisper.load_model("base")
+        _model = load_backend()
     return _model
 
-def transcribe_audio(audio_path: str) -> str:
-    return _get_model().transcribe(audio_path)["text"]
+
+def _init_worker(threads: int, loader):
+    # Runs in each fresh worker: split the cores between workers, then load the model here
+    global _model
+    import torch
+    torch.set_num_threads(threads)
+    _model = loader()
+
+
+def _worker_transcribe_batch(audio_paths: list) -> list:
+    backend = _get_model()
+    if len(audio_paths) == 1:
+        # A lone memo keeps the full transcribe() path (temperature fallback, context)
+        return [backend.transcribe(audio_paths[0])]
+    return backend.transcribe_batch(audio_paths)
+
+
+class TranscriptionPool:
+    """
+    Process pool of Whisper workers. Workers are started with forkserver
+    (spawn where that is unavailable), never forked from the app, whose
+    event loop and warm-up threads may hold locks at that moment; each
+    worker loads its own copy of the model in its initializer. Jobs wait
+    in a shortest-first queue (by file size) and are only handed to the
+    pool when a worker is free — up to max_batch at a time, waiting at most
+    batch_window seconds for a partial batch of two or more to fill. A
+    memo queued on its own is dispatched at once.
+    """
+
+    def __init__(self, workers: int = WORKERS, executor=None,
+                 max_batch: int = MAX_BATCH, batch_window: float = BATCH_WINDOW, loader=load_backend):
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self._executor = executor
+        self._loader = loader
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._timer = None
+        self._stats = {"batches": 0, "jobs": 0}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._executor is not None:
+            return
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method),
+                                             initializer=_init_worker, initargs=(threads, self._loader))
+        # Start every worker now so the models are loaded before the first memo arrives
+        for f in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+            f.result()
+
+    def submit(self, audio_path: str) -> Future:
+        try:
+            size = os.path.getsize(audio_path)
+        except OSError:
+            size = 0
+        future = Future()
+        with self._lock:
+            heapq.heappush(self._queue, (size, next(self._seq), audio_path, future, time.monotonic()))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        with self._lock:
+            batches = []
+            while self._queue and self._running < self.workers:
+                if 1 < len(self._queue) < self.max_batch:
+                    # Hold a partial batch until its oldest job has waited batch_window;
+                    # a lone memo goes out at once
+                    wait = min(item[4] for item in self._queue) + self.batch_window - time.monotonic()
+                    if wait > 0:
+                        if self._timer is None:
+                            self._timer = threading.Timer(wait, self._window_elapsed)
+                            self._timer.daemon = True
+                            self._timer.start()
+                        break
+                batch = [heapq.heappop(self._queue) for _ in range(min(self.max_batch, len(self._queue)))]
+                self._running += 1
+                self._stats["batches"] += 1
+                self._stats["jobs"] += len(batch)
+                batches.append(([item[2] for item in batch], [item[3] for item in batch]))
+        for paths, futures in batches:
+            try:
+                job = self._executor.submit(_worker_transcribe_batch, paths)
+            except Exception as e:
+                self._finish(futures, None, e)
+                continue
+            job.add_done_callback(lambda job, futures=futures: self._finish(futures, job))
+
+    def _window_elapsed(self):
+        with self._lock:
+            self._timer = None
+        self._dispatch()
+
+    def _finish(self, futures: list, job, error: Exception = None):
+        with self._lock:
+            self._running -= 1
+        if error is None and job.cancelled():
+            for future in futures:
+                future.cancel()
+        elif error is None and job.exception() is None:
+            for future, result in zip(futures, job.result()):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        else:
+            for future in futures:
+                future.set_exception(error or job.exception())
+        self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "running": self._running, "queued": len(self._queue),
+                    **self._stats}
+
+    def shutdown(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def start_pool(workers: int = None) -> TranscriptionPool:
+    """Start the worker processes, each loading the model. A count of 0 keeps transcription in-process."""
+    global _pool
+    workers = WORKERS if workers is None else workers
+    if _pool is None and workers > 0:
+        pool = TranscriptionPool(workers)
+        pool.start()
+        _pool = pool
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+POOL_STATE = Gauge("memomuse_whisper_pool", "Whisper worker pool state.", ("state",),
+                   fn=lambda: _pool.stats() if _pool else {})
+
+
+@track("whisper", "transcribe")
+def _transcribe(audio_path: str) -> str:
+    if _pool is not None:
+        return _pool.submit(audio_path).result()
+    with _model_lock:
+        return _get_model().transcribe(audio_path)
+
+
+def transcribe_audio(audio_path: str, fingerprint: str = None) -> str:
+    """
+    Transcribe a memo, reusing the text from the transcript cache when the
+    same audio was already transcribed by the same backend and model.
+    fingerprint is the memo's pcm_fingerprint() if the caller has it.
+    """
+    if fingerprint is None:
+        try:
+            fingerprint = pcm_fingerprint(load_stem(audio_path, TRIM_RATE, 1))
+        except Exception:
+            return _transcribe(audio_path)  # let Whisper report what's wrong with the file
+    key = content_key(BACKEND, MODEL_NAME, fingerprint)
+    text = TRANSCRIPTS.get(key)
+    if text is None:
+        text = _transcribe(audio_path)
+        TRANSCRIPTS.put(key, text)
+    return text
+
+
+@dataclass
+class SpeechTrim:
+    """A memo with its silences cut: path is the file to transcribe."""
+    path: str
+    duration: float
+    speech_seconds: float
+    offsets: np.ndarray = None  # join_regions() rows; None when nothing was trimmed
+    fingerprint: str = None  # pcm_fingerprint() of the audio at path; None if it couldn't be decoded
+
+
+def trim_speech(audio_path: str, output_path: str) -> SpeechTrim:
+    """
+    Run the energy VAD over the memo and write only its speech regions
+    (joined by short gaps) to output_path as a 16 kHz mono WAV. Falls back
+    to the untouched recording if it can't be decoded or has no speech.
+    """
+    try:
+        samples = load_stem(audio_path, TRIM_RATE, 1)
+    except Exception as e:
+        print(f"      VAD skipped: {e}")
+        return SpeechTrim(audio_path, 0.0, 0.0)
+    duration = len(samples) / TRIM_RATE
+    regions = speech_regions(samples, TRIM_RATE)
+    if not len(regions):
+        return SpeechTrim(audio_path, duration, duration, fingerprint=pcm_fingerprint(samples))
+    trimmed, offsets = join_regions(samples, regions, TRIM_RATE)
+    array_to_segment(trimmed, TRIM_RATE).export(output_path, format="wav")
+    speech = float((regions[:, 1] - regions[:, 0]).sum()) / TRIM_RATE
+    return SpeechTrim(output_path, duration, speech, offsets, pcm_fingerprint(trimmed))
+
@@ -0,0 +1,90 @@
+"""Unit tests for services/admission_module.py — queue bounds, stage slots and Retry-After."""
+
+import asyncio
+import pytest
+
+from services.admission_module import AdmissionController, QueueFull, _Slots, stage_slot, _stage_slots
+
+
+class TestSlots:
+
+    @pytest.mark.asyncio
+    async def test_limit_enforced_in_fifo_order(self):
+        slots = _Slots(1)
+        order = []
+
+        async def worker(name):
+            await slots.acquire()
+            order.append(name)
+            await asyncio.sleep(0.01)
+            slots.release()
+
+        await asyncio.gather(*(worker(n) for n in "abc"))
+
+        assert order == ["a", "b", "c"]
+        assert slots.active == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        slots = _Slots(1)
+        await slots.acquire()
+        waiter = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        assert slots.waiting == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        slots.release()
+
+        assert slots.active == 0 and slots.waiting == 0
+
+    @pytest.mark.asyncio
+    async def test_stage_slot_bounds_concurrency(self, monkeypatch):
+        monkeypatch.setitem(_stage_slots, "whisper", _Slots(2))
+        running, peak = 0, 0
+
+        async def job():
+            nonlocal running, peak
+            async with stage_slot("whisper"):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(job() for _ in range(6)))
+
+        assert peak == 2
+
+
+class TestAdmissionController:
+
+    @pytest.mark.asyncio
+    async def test_rejects_beyond_running_plus_queued(self):
+        admission = AdmissionController(max_running=1, max_queued=1)
+        running = admission.admit()
+        await running.__aenter__()
+        admission.admit()  # queued
+
+        with pytest.raises(QueueFull) as exc:
+            admission.admit()
+        assert exc.value.retry_after > 0
+        assert admission.stats()["queued"] == 1
+
+    @pytest.mark.asyncio
+    async def test_abandoned_ticket_frees_its_place(self):
+        admission = AdmissionController(max_running=1, max_queued=0)
+        admission.admit().abandon()
+
+        async with admission.admit():
+            assert admission.stats()["running"] == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_after_scales_with_recent_durations(self):
+        admission = AdmissionController(max_running=2, max_queued=4)
+        admission.durations.extend([60, 60])
+        for _ in range(4):
+            admission.admit()
+
+        # 2 queued ahead of the caller, 2 running slots, ~60 s per pipeline
+        assert admission.retry_after() == 90
@@ -1,10 +1,14 @@
 """API tests for main.py — /generate endpoint via FastAPI TestClient."""
 
 import os
+import sys
+import json
+import subprocess
 import pytest
 from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
 
+import main
 from main import app
 
 
@@ -13,6 +17,13 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def isolated_workdir(tmp_path, monkeypatch):
+    """Run from tmp_path, so uploads, stems and final mixes land in its temp/ rather than the repo's."""
+    (tmp_path / "static").symlink_to(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"))
+    monkeypatch.chdir(tmp_path)
+
+
 DUMMY_PIPELINE_RESULT = {
     "output_path": "temp/final_test1234.mp3",
     "song_title": "Midnight Walk",
@@ -87,6 +98,198 @@ class TestGenerateEndpoint:
         assert response.status_code == 422
 
 
+class TestAdmission:
+
+    @pytest.fixture
+    def full_queue(self):
+        from services.admission_module import AdmissionController
+        admission = AdmissionController(max_running=1, max_queued=0)
+        admission.admit()
+        with patch("main.get_admission", return_value=admission):
+            yield admission
+
+    @pytest.mark.parametrize("path", ["/generate", "/jobs"])
+    def test_full_queue_returns_429_with_retry_after(self, full_queue, client, path):
+        response = client.post(path, files={"audio": ("test.webm", b"fake_audio", "audio/webm")})
+
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) == response.json()["retry_after"] > 0
+
+    def test_stats_endpoint(self, client):
+        body = client.get("/api/admission/stats").json()
+
+        assert {"running", "queued", "stages"} <= body.keys()
+        assert set(body["stages"]) == {"whisper", "lyria", "vocals", "mix"}
+
+
+class TestMetricsEndpoint:
+
+    def test_exposes_prometheus_text(self, client):
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "# TYPE memomuse_stage_seconds histogram" in response.text
+
+    @patch("main.run_pipeline", new_callable=AsyncMock,
+           return_value={**DUMMY_PIPELINE_RESULT, "timings": {"stages": {"mix": 12.5}}})
+    def test_debug_flag_adds_timings(self, mock_pipeline, client):
+        files = {"audio": ("test.webm", b"fake_audio", "audio/webm")}
+
+        plain = client.post("/generate", files=files, data={"genre": "pop"})
+        debug = client.post("/generate", files=files, data={"genre": "pop", "debug": "true"})
+
+        assert "timings" not in plain.json()
+        assert debug.json()["timings"]["stages"]["mix"] == 12.5
+
+
+def _parse_sse(text):
+    """[(event, data)] from a text/event-stream body, skipping comments."""
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestReadiness:
+
+    @pytest.fixture
+    def warm(self, monkeypatch):
+        state = {name: "pending" for name in main._warm}
+        monkeypatch.setattr(main, "_warm", state)
+        return state
+
+    def test_not_ready_while_whisper_loads(self, client, warm):
+        warm["pipeline"] = "ready"
+        response = client.get("/ready")
+
+        assert response.status_code == 503
+        assert response.json()["components"]["whisper"] == "pending"
+
+    def test_ready_without_optional_components(self, client, warm):
+        warm.update(pipeline="ready", whisper="ready", lyria="skipped", voices="failed: no key")
+        response = client.get("/ready")
+
+        assert response.status_code == 200
+        assert response.json()["ready"] is True
+
+    def test_import_skips_heavy_dependencies(self):
+        code = "import sys, main; print(' '.join(m for m in ('pipeline', 'whisper', 'torch', 'google.genai') if m in sys.modules))"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        assert out.stdout.strip() == ""
+
+
+class TestJobEndpoints:
+
+    @pytest.fixture
+    def live_client(self, monkeypatch):
+        # One event loop for the whole test so background jobs outlive the POST
+        monkeypatch.setattr("main._warm_up", AsyncMock())
+        with TestClient(app) as c:
+            yield c
+
+    @staticmethod
+    async def _fake_pipeline(input_path, genre, studio, progress=None, fresh=False, direct_audio=False):
+        progress("stage_started", {"stage": "transcribe"})
+        progress("encoding", {"output_path": "temp/final_test1234.mp3"})
+        return DUMMY_PIPELINE_RESULT
+
+    def test_submit_returns_job_id_immediately(self, live_client):
+        with patch("main.run_pipeline", side_effect=self._fake_pipeline):
+            response = live_client.post("/jobs", files={"audio": ("test.webm", b"fake_audio", "audio/webm")})
+
+        assert response.status_code == 202
+        body = response.json()
+        assert body["events_url"] == f"/jobs/{body['job_id']}/events"
+
+    def test_events_stream_progress_then_result(self, live_client):
+        with patch("main.run_pipeline", side_effect=self._fake_pipeline):
+            job = live_client.post("/jobs", files={"audio": ("test.webm", b"fake_audio", "audio/webm")}).json()
+            response = live_client.get(job["events_url"])
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(response.text)
+        assert [e for e, _ in events] == ["stage_started", "encoding", "done"]
+        assert events[1][1] == {"audio_url": "/audio/final_test1234.mp3"}
+        assert events[2][1]["song_title"] == "Midnight Walk"
+
+        status = live_client.get(job["status_url"]).json()
+        assert status["status"] == "done"
+        assert status["result"]["audio_url"] == "/audio/final_test1234.mp3"
+
+    def test_reconnect_resumes_after_last_event_id(self, live_client):
+        with patch("main.run_pipeline", side_effect=self._fake_pipeline):
+            job = live_client.post("/jobs", files={"audio": ("test.webm", b"fake_audio", "audio/webm")}).json()
+            live_client.get(job["events_url"])
+            response = live_client.get(job["events_url"], headers={"Last-Event-ID": "1"})
+
+        assert [e for e, _ in _parse_sse(response.text)] == ["done"]
+
+    @patch("main.run_pipeline", new_callable=AsyncMock, side_effect=Exception("Pipeline failed"))
+    def test_failed_job_reports_error(self, mock_pipeline, live_client):
+        job = live_client.post("/jobs", files={"audio": ("test.webm", b"fake_audio", "audio/webm")}).json()
+        events = _parse_sse(live_client.get(job["events_url"]).text)
+
+        assert events[-1] == ("failed", {"error": "Pipeline failed"})
+        assert live_client.get(job["status_url"]).json()["status"] == "failed"
+
+    def test_unknown_job_returns_404(self, client):
+        assert client.get("/jobs/nope").status_code == 404
+        assert client.get("/jobs/nope/events").status_code == 404
+
+
+class TestAudioEndpoint:
+
+    def test_serves_finished_file(self, client, tmp_path):
+        (tmp_path / "temp").mkdir()
+        (tmp_path / "temp" / "final_audiotest.ogg").write_bytes(b"OggS_fake")
+
+        response = client.get("/audio/final_audiotest.ogg")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "audio/ogg"
+        assert response.content == b"OggS_fake"
+
+    def test_missing_file_returns_404(self, client):
+        response = client.get("/audio/final_does_not_exist.mp3")
+        assert response.status_code == 404
+
+    @patch("main.is_encoding", return_value=True)
+    def test_streams_file_while_encoding(self, mock_is_encoding, client):
+        async def fake_follow(path):
+            yield b"part1"
+            yield b"part2"
+
+        with patch("main.follow", side_effect=fake_follow):
+            response = client.get("/audio/final_inprogress.mp3")
+
+        assert response.status_code == 200
+        assert response.content == b"part1part2"
+        assert "content-length" not in response.headers
+
+
+class TestBulkPublishEndpoint:
+
+    def test_rejects_missing_tracks(self, client):
+        response = client.post("/api/publish/bulk", json={"tracks": []})
+        assert response.status_code == 400
+
+    @patch("services.shopify_module.publish_catalog", new_callable=AsyncMock)
+    def test_reports_per_item_status(self, mock_publish, client):
+        mock_publish.return_value = [{"index": 0, "status": "created", "product_id": 1},
+                                     {"index": 1, "status": "failed", "error": "Shopify API error 422: bad"}]
+
+        response = client.post("/api/publish/bulk", json={"tracks": [{"song_title": "A"}, {"song_title": "B"}]})
+
+        assert response.status_code == 200
+        body = response.json()
+        assert (body["created"], body["exists"], body["failed"]) == (1, 0, 1)
+        assert body["results"][1]["error"].startswith("Shopify API error")
+
+
 class TestRootEndpoint:
 
     def test_returns_html(self, client):
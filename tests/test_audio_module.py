@@ -0,0 +1,210 @@
+"""Unit tests for services/audio_module.py — NumPy mix engine vs the pydub reference path."""
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine, WhiteNoise
+
+from services.audio_module import (
+    segment_to_array, array_to_segment, rms_dbfs, mix_stems, mix_blocks, apply_shelf_eq, pitch_shift,
+    speech_regions, join_regions,
+)
+
+
+def _stereo(seg: AudioSegment) -> AudioSegment:
+    return seg.set_frame_rate(48000).set_channels(2).set_sample_width(2)
+
+
+def _pydub_mix(instrumental, vocal, vocal_boost_db=6, inst_cut_db=6):
+    """The original pipeline mix, kept as a reference implementation."""
+    def normalize(seg, target_dbfs=-20.0):
+        return seg.apply_gain(target_dbfs - seg.dBFS)
+
+    instrumental = normalize(instrumental) - inst_cut_db
+    vocal = normalize(vocal) + vocal_boost_db
+    if len(vocal) > len(instrumental):
+        vocal = vocal[: len(instrumental)]
+    return instrumental.overlay(vocal, position=0)
+
+
+class TestConversion:
+
+    def test_round_trip_is_lossless(self):
+        seg = _stereo(Sine(440, sample_rate=48000).to_audio_segment(duration=200))
+        back = array_to_segment(segment_to_array(seg), seg.frame_rate)
+        assert back.raw_data == seg.raw_data
+
+    def test_resamples_and_upmixes_to_mix_format(self):
+        mono = Sine(440, sample_rate=44100).to_audio_segment(duration=500).set_channels(1)
+        samples = segment_to_array(mono, 48000, 2)
+        assert samples.shape[1] == 2
+        assert abs(len(samples) - 24000) <= 1
+
+    def test_dbfs_matches_pydub(self):
+        seg = _stereo(Sine(440, sample_rate=48000).to_audio_segment(duration=300, volume=-12))
+        assert rms_dbfs(segment_to_array(seg)) == pytest.approx(seg.dBFS, abs=0.01)
+
+    def test_silence_is_negative_infinity(self):
+        assert rms_dbfs(np.zeros((100, 2), dtype=np.float32)) == float("-inf")
+
+
+class TestMixStems:
+
+    def test_matches_pydub_mix_within_tolerance(self):
+        inst = _stereo(WhiteNoise(sample_rate=48000).to_audio_segment(duration=1000, volume=-10))
+        vocal = _stereo(Sine(330, sample_rate=48000).to_audio_segment(duration=1500, volume=-30))
+
+        expected = segment_to_array(_pydub_mix(inst, vocal, 8, 4))
+        result = mix_stems(segment_to_array(inst), segment_to_array(vocal),
+                           vocal_boost_db=8, inst_cut_db=4)
+
+        assert result.shape == expected.shape
+        # pydub truncates to int16 after every gain step; allow a few LSB of drift
+        assert np.max(np.abs(result - expected)) < 16 / 32768
+
+    def test_vocal_truncated_to_instrumental_length(self):
+        inst = np.full((100, 2), 0.1, dtype=np.float32)
+        vocal = np.full((250, 2), 0.1, dtype=np.float32)
+        assert len(mix_stems(inst, vocal)) == 100
+
+    def test_instrumental_only_is_untouched(self):
+        inst = np.full((100, 2), 0.25, dtype=np.float32)
+        result = mix_stems(inst.copy(), None)
+        np.testing.assert_array_equal(result, inst)
+
+    def test_silent_stems_do_not_produce_nan(self):
+        inst = np.zeros((100, 2), dtype=np.float32)
+        vocal = np.zeros((100, 2), dtype=np.float32)
+        result = mix_stems(inst, vocal)
+        assert np.all(np.isfinite(result))
+
+    def test_output_is_clipped_to_int16_range(self):
+        inst = np.full((100, 2), 0.9, dtype=np.float32)
+        vocal = np.full((100, 2), 0.9, dtype=np.float32)
+        result = mix_stems(inst, vocal, vocal_boost_db=40, inst_cut_db=-40)
+        assert result.max() <= 32767 / 32768
+
+
+def _tone(freq, seconds=0.5, rate=48000, level=0.1):
+    t = np.arange(int(seconds * rate)) / rate
+    mono = (level * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.stack([mono, mono], axis=1)
+
+
+def _gain_db(before, after):
+    # Skip the filter's settling time before measuring
+    return rms_dbfs(after[4800:]) - rms_dbfs(before[4800:])
+
+
+class TestShelfEq:
+
+    def test_flat_settings_return_input(self):
+        tone = _tone(100)
+        assert apply_shelf_eq(tone, 0, 0) is tone
+
+    def test_bass_boost_lifts_lows_not_mids(self):
+        low, mid = _tone(60), _tone(1000)
+        assert _gain_db(low, apply_shelf_eq(low, bass=10)) == pytest.approx(15, abs=1.0)
+        assert abs(_gain_db(mid, apply_shelf_eq(mid, bass=10))) < 1.0
+
+    def test_treble_cut_lowers_highs_not_mids(self):
+        high, mid = _tone(12000), _tone(500)
+        assert _gain_db(high, apply_shelf_eq(high, treble=-10)) == pytest.approx(-15, abs=1.0)
+        assert abs(_gain_db(mid, apply_shelf_eq(mid, treble=-10))) < 1.0
+
+    def test_preserves_shape_and_dtype(self):
+        tone = _tone(200)
+        out = apply_shelf_eq(tone, bass=4, treble=-3)
+        assert out.shape == tone.shape
+        assert out.dtype == np.float32
+
+
+class TestMixBlocks:
+
+    def test_matches_one_shot_mix_and_eq(self):
+        rng = np.random.default_rng(1)
+        inst = (rng.standard_normal((30000, 2)) * 0.1).astype(np.float32)
+        vocal = (rng.standard_normal((17000, 2)) * 0.05).astype(np.float32)
+
+        expected = apply_shelf_eq(mix_stems(inst.copy(), vocal.copy()), bass=5, treble=-4)
+        blocks = list(mix_blocks(inst.copy(), vocal.copy(), bass=5, treble=-4, block_frames=4096))
+
+        assert len(blocks) == 8
+        np.testing.assert_allclose(np.concatenate(blocks), expected, atol=1e-5)
+
+    def test_first_block_is_ready_before_the_rest_is_mixed(self):
+        inst = _tone(100, seconds=2)
+        blocks = mix_blocks(inst, _tone(300, seconds=2), block_frames=48000)
+        next(blocks)
+
+        # Only the first block has been scaled in place so far
+        np.testing.assert_array_equal(inst[48000:], _tone(100, seconds=2)[48000:])
+
+
+def _peak_hz(samples, rate=48000):
+    spectrum = np.abs(np.fft.rfft(samples[:, 0]))
+    return np.fft.rfftfreq(len(samples), 1 / rate)[np.argmax(spectrum)]
+
+
+class TestPitchShift:
+
+    def test_zero_semitones_returns_input(self):
+        tone = _tone(440)
+        assert pitch_shift(tone, 0) is tone
+
+    @pytest.mark.parametrize("semitones", [12, 3, -5, -12])
+    def test_moves_peak_frequency(self, semitones):
+        shifted = pitch_shift(_tone(440, seconds=1.0), semitones)
+        assert _peak_hz(shifted) == pytest.approx(440 * 2 ** (semitones / 12), abs=3)
+
+    def test_preserves_duration(self):
+        tone = _tone(440, seconds=1.3)
+        assert pitch_shift(tone, 7).shape == tone.shape
+
+    def test_keeps_level_roughly_constant(self):
+        tone = _tone(440, seconds=1.0)
+        shifted = pitch_shift(tone, -4)
+        assert abs(rms_dbfs(shifted[4800:-4800]) - rms_dbfs(tone)) < 1.5
+
+
+def _memo(parts, rate=16000):
+    """Build a mono test memo from (kind, seconds) parts: 'tone' or near-silent 'room' noise."""
+    rng = np.random.default_rng(0)
+    chunks = []
+    for kind, seconds in parts:
+        n = int(seconds * rate)
+        if kind == "tone":
+            chunks.append(0.3 * np.sin(2 * np.pi * 220 * np.arange(n) / rate))
+        else:
+            chunks.append(rng.standard_normal(n) * 1e-4)
+    return np.concatenate(chunks).astype(np.float32)
+
+
+class TestSpeechRegions:
+
+    def test_finds_speech_between_long_silences(self):
+        memo = _memo([("room", 1), ("tone", 1), ("room", 2), ("tone", 0.5), ("room", 1)])
+
+        regions = speech_regions(memo, 16000) / 16000
+
+        assert len(regions) == 2
+        assert regions[0][0] == pytest.approx(1.0, abs=0.2) and regions[0][1] == pytest.approx(2.0, abs=0.2)
+        assert regions[1][0] == pytest.approx(4.0, abs=0.2)
+
+    def test_short_pauses_are_bridged(self):
+        memo = _memo([("room", 1), ("tone", 1), ("room", 0.2), ("tone", 1), ("room", 1)])
+
+        assert len(speech_regions(memo, 16000)) == 1
+
+    def test_silence_has_no_regions(self):
+        assert len(speech_regions(_memo([("room", 3)]), 16000)) == 0
+
+    def test_joined_buffer_keeps_each_region(self):
+        memo = _memo([("room", 1), ("tone", 1), ("room", 2), ("tone", 0.5), ("room", 1)])
+        regions = speech_regions(memo, 16000)
+
+        trimmed, offsets = join_regions(memo, regions, 16000, gap_ms=250)
+
+        assert len(trimmed) < len(memo) * 0.6
+        np.testing.assert_array_equal(trimmed[offsets[1][0]:offsets[1][0] + offsets[1][2]],
+                                      memo[regions[1][0]:regions[1][1]])
@@ -1,103 +1,161 @@
 """Unit tests for services/backboard_module.py"""
+import asyncio
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
-from aiohttp import ClientSession
+
+from services import backboard_module as mod
+
+
+def _response(body: dict) -> MagicMock:
+    resp = MagicMock()
+    resp.json = AsyncMock(return_value=body)
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(return_value=resp)
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    return ctx
+
+
+def _mock_session(*bodies) -> MagicMock:
+    """A pooled session whose successive post() calls return the given JSON bodies."""
+    session = MagicMock()
+    session.post = MagicMock(side_effect=[_response(b) for b in bodies])
+    return session
+
+
+@pytest.fixture(autouse=True)
+def backboard_env(monkeypatch):
+    monkeypatch.setenv("BACKBOARD_API_KEY", "test-key")
+    monkeypatch.setattr(mod, "_writer", None)
+    monkeypatch.setattr(mod, "BACKOFF_SECONDS", 0)
 
 
 class TestStoreSession:
-    """Tests for store_session Backboard.io integration."""
+    """Tests for the write-behind Backboard.io session memory."""
 
     @pytest.mark.asyncio
-    @patch("services.backboard_module.aiohttp.ClientSession")
-    async def test_creates_assistant_and_thread_on_first_call(self, mock_session_cls):
-        """First call creates an assistant, a thread, then posts a message."""
-        # Reset module-level state
-        import services.backboard_module as mod
-        mod._assistant_id = None
-        mod._thread_id = None
-
-        # Mock the context manager and responses
-        mock_session = AsyncMock()
-        mock_session_cls.return_value.__aenter__ = AsyncMock(return_value=mock_session)
-        mock_session_cls.return_value.__aexit__ = AsyncMock(return_value=False)
-
-        # Assistant creation response
-        assistant_resp = AsyncMock()
-        assistant_resp.json = AsyncMock(return_value={"assistant_id": "ast_123"})
-
-        # Thread creation response
-        thread_resp = AsyncMock()
-        thread_resp.json = AsyncMock(return_value={"thread_id": "thr_456"})
-
-        # Message post response
-        msg_resp = AsyncMock()
-        msg_resp.json = AsyncMock(return_value={"message_id": "msg_789"})
-
-        # Chain the three post calls
-        post_contexts = [assistant_resp, thread_resp, msg_resp]
-        mock_posts = []
-        for resp in post_contexts:
-            ctx = AsyncMock()
-            ctx.__aenter__ = AsyncMock(return_value=resp)
-            ctx.__aexit__ = AsyncMock(return_value=False)
-            mock_posts.append(ctx)
-
-        mock_session.post = MagicMock(side_effect=mock_posts)
-
-        result = await mod.store_session("transcript", "lyrics", "prompt", "pop", "upbeat")
-
-        assert mock_session.post.call_count == 3
-        assert result == {"message_id": "msg_789"}
+    @patch("services.backboard_module.get_session")
+    async def test_creates_assistant_and_thread_on_first_write(self, mock_get_session):
+        """First write creates an assistant, a thread, then posts a message."""
+        mock_get_session.return_value = _mock_session(
+            {"assistant_id": "ast_123"}, {"thread_id": "thr_456"}, {"message_id": "msg_789"})
+
+        assert mod.store_session("transcript", "lyrics", "prompt", "pop", "upbeat") is True
+        await mod.get_writer().flush()
+
+        post = mock_get_session.return_value.post
+        assert post.call_count == 3
+        assert post.call_args.args[0].endswith("/threads/thr_456/messages")
+        assert mod.get_writer().assistant_id == "ast_123"
 
     @pytest.mark.asyncio
-    @patch("services.backboard_module.aiohttp.ClientSession")
-    async def test_reuses_assistant_and_thread_on_second_call(self, mock_session_cls):
-        """Second call skips assistant/thread creation, only posts message."""
-        import services.backboard_module as mod
-        mod._assistant_id = "ast_existing"
-        mod._thread_id = "thr_existing"
+    @patch("services.backboard_module.get_session")
+    async def test_returns_before_anything_is_written(self, mock_get_session):
+        """Queuing never waits on the network."""
+        mock_get_session.return_value = _mock_session({"message_id": "m"})
+        writer = mod.get_writer()
+        writer.assistant_id, writer.thread_id = "ast_1", "thr_1"
+
+        mod.store_session("t", "l", "p", "pop", "happy")
 
-        mock_session = AsyncMock()
-        mock_session_cls.return_value.__aenter__ = AsyncMock(return_value=mock_session)
-        mock_session_cls.return_value.__aexit__ = AsyncMock(return_value=False)
+        assert mock_get_session.return_value.post.call_count == 0
+        await writer.flush()
+        mock_get_session.return_value.post.assert_called_once()
 
-        msg_resp = AsyncMock()
-        msg_resp.json = AsyncMock(return_value={"message_id": "msg_999"})
+    @pytest.mark.asyncio
+    @patch("services.backboard_module.get_session")
+    async def test_queued_records_are_batched_and_coalesced(self, mock_get_session):
+        """Records queued together go out as one message; identical ones once."""
+        mock_get_session.return_value = _mock_session({"message_id": "m"})
+        writer = mod.get_writer()
+        writer.assistant_id, writer.thread_id = "ast_1", "thr_1"
+
+        mod.store_session("first", "l", "p", "pop", "happy")
+        mod.store_session("second", "l", "p", "pop", "happy")
+        mod.store_session("second", "l", "p", "pop", "happy")
+        await writer.flush()
+
+        post = mock_get_session.return_value.post
+        post.assert_called_once()
+        content = post.call_args.kwargs["json"]["content"]
+        assert content.count("Transcript: first") == 1 and content.count("Transcript: second") == 1
 
-        ctx = AsyncMock()
-        ctx.__aenter__ = AsyncMock(return_value=msg_resp)
-        ctx.__aexit__ = AsyncMock(return_value=False)
-        mock_session.post = MagicMock(return_value=ctx)
+    @pytest.mark.asyncio
+    @patch("services.backboard_module.get_session")
+    async def test_every_record_counted_once(self, mock_get_session):
+        """Written + coalesced adds up to the records submitted."""
+        mock_get_session.return_value = _mock_session({"message_id": "m"})
+        writer = mod.get_writer()
+        writer.assistant_id, writer.thread_id = "ast_1", "thr_1"
+        before = {r: mod.RECORDS.get(result=r) for r in ("written", "coalesced")}
 
-        result = await mod.store_session("t", "l", "p", "pop", "happy")
+        for transcript in ("first", "second", "second"):
+            mod.store_session(transcript, "l", "p", "pop", "happy")
+        await writer.flush()
 
-        # Only one post call (the message), no assistant/thread creation
-        mock_session.post.assert_called_once()
-        assert result == {"message_id": "msg_999"}
+        assert mod.RECORDS.get(result="written") == before["written"] + 2
+        assert mod.RECORDS.get(result="coalesced") == before["coalesced"] + 1
 
     @pytest.mark.asyncio
-    @patch("services.backboard_module.aiohttp.ClientSession")
-    async def test_truncates_long_context_fields(self, mock_session_cls):
-        """Context fields are truncated to 200 chars each."""
-        import services.backboard_module as mod
-        mod._assistant_id = "ast_1"
-        mod._thread_id = "thr_1"
+    @patch("services.backboard_module.get_session")
+    async def test_missing_assistant_id_is_retried(self, mock_get_session):
+        """An assistant response without an id is not used to create a thread."""
+        mock_get_session.return_value = _mock_session(
+            {}, {"assistant_id": "ast_2"}, {"thread_id": "thr_2"}, {"message_id": "m"})
+        writer = mod.get_writer()
 
-        mock_session = AsyncMock()
-        mock_session_cls.return_value.__aenter__ = AsyncMock(return_value=mock_session)
-        mock_session_cls.return_value.__aexit__ = AsyncMock(return_value=False)
+        mod.store_session("t", "l", "p", "pop", "happy")
+        await writer.flush()
 
-        msg_resp = AsyncMock()
-        msg_resp.json = AsyncMock(return_value={})
-        ctx = AsyncMock()
-        ctx.__aenter__ = AsyncMock(return_value=msg_resp)
-        ctx.__aexit__ = AsyncMock(return_value=False)
-        mock_session.post = MagicMock(return_value=ctx)
+        posts = mock_get_session.return_value.post.call_args_list
+        assert [c.args[0].rsplit("/api/", 1)[1] for c in posts] == [
+            "assistants", "assistants", "threads", "threads/thr_2/messages"]
+        assert posts[2].kwargs["json"] == {"assistant_id": "ast_2"}
+
+    @pytest.mark.asyncio
+    @patch("services.backboard_module.get_session")
+    async def test_truncates_long_context_fields(self, mock_get_session):
+        """Context fields are truncated to 200 chars each."""
+        mock_get_session.return_value = _mock_session({})
+        writer = mod.get_writer()
+        writer.assistant_id, writer.thread_id = "ast_1", "thr_1"
 
         long_text = "x" * 500
-        await mod.store_session(long_text, long_text, long_text, "pop", "happy")
+        mod.store_session(long_text, long_text, long_text, "pop", "happy")
+        await writer.flush()
 
-        call_kwargs = mock_session.post.call_args
-        payload = call_kwargs.kwargs.get("json") or call_kwargs[1].get("json")
-        # Each field is truncated to [:200], so total content is bounded
+        payload = mock_get_session.return_value.post.call_args.kwargs["json"]
         assert len(payload["content"]) < 700
+
+    @pytest.mark.asyncio
+    @patch("services.backboard_module.get_session")
+    async def test_failed_write_is_retried(self, mock_get_session):
+        """A failing post is retried with backoff until it succeeds."""
+        mock_get_session.return_value.post = MagicMock(side_effect=[
+            ConnectionError("down"), ConnectionError("down"), _response({"message_id": "m"})])
+        writer = mod.get_writer()
+        writer.assistant_id, writer.thread_id = "ast_1", "thr_1"
+        before = mod.RECORDS.get(result="written")
+
+        mod.store_session("t", "l", "p", "pop", "happy")
+        await writer.flush()
+
+        assert mock_get_session.return_value.post.call_count == 3
+        assert mod.RECORDS.get(result="written") == before + 1
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_oldest(self):
+        writer = mod.SessionWriter(queue_size=2)
+        writer._task = asyncio.get_running_loop().create_future()  # keep the writer from draining
+        before = mod.RECORDS.get(result="dropped")
+
+        for record in ("a", "b", "c"):
+            writer.submit(record)
+
+        assert [writer._queue.get_nowait() for _ in range(2)] == ["b", "c"]
+        assert mod.RECORDS.get(result="dropped") == before + 1
+        writer._task.cancel()
+
+    def test_skipped_without_api_key(self, monkeypatch):
+        monkeypatch.delenv("BACKBOARD_API_KEY")
+
+        assert mod.store_session("t", "l", "p", "pop", "happy") is False
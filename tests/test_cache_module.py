@@ -0,0 +1,104 @@
+"""Unit tests for services/cache_module.py — LRU and disk tiers, eviction and lookup counters."""
+
+import os
+import time
+
+from services.cache_module import TieredCache, BlobCache, SqliteCache, content_key, LOOKUPS
+
+
+class TestContentKey:
+
+    def test_parts_are_delimited(self):
+        assert content_key("ab", "c") != content_key("a", "bc")
+
+    def test_bytes_and_str_parts(self):
+        assert content_key(b"pcm", "base") == content_key(b"pcm", "base")
+        assert len(content_key(b"pcm")) == 64
+
+
+class TestTieredCache:
+
+    def test_memory_tier_keeps_most_recent(self):
+        cache = TieredCache("test_memory", max_items=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        TieredCache("test_disk", str(tmp_path)).put("k", {"text": "hello"})
+
+        cache = TieredCache("test_disk", str(tmp_path))
+        before = LOOKUPS.get(cache="test_disk", result="disk_hit")
+
+        assert cache.get("k") == {"text": "hello"}
+        assert LOOKUPS.get(cache="test_disk", result="disk_hit") == before + 1
+        assert cache.get("k") == {"text": "hello"}
+        assert LOOKUPS.get(cache="test_disk", result="memory_hit") >= 1
+
+    def test_disk_evicts_least_recently_used(self, tmp_path):
+        cache = TieredCache("test_evict", str(tmp_path), max_items=1, max_bytes=25)
+        cache.put("a", "x" * 8)
+        cache.put("b", "y" * 8)
+        cache.get("a")  # from disk: a is now the most recent
+        cache.put("c", "z" * 8)
+
+        assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+        assert cache.stats()["disk_bytes"] <= 25
+
+    def test_miss_is_counted(self, tmp_path):
+        cache = TieredCache("test_miss", str(tmp_path))
+        cache.get("nothing")
+
+        assert LOOKUPS.get(cache="test_miss", result="miss") == 1
+
+
+class TestBlobCache:
+
+    def test_bytes_round_trip_without_memory_tier(self, tmp_path):
+        cache = BlobCache("test_blob", str(tmp_path))
+        cache.put("k", b"\xff\xfbmp3")
+
+        assert cache.get("k") == b"\xff\xfbmp3"
+        assert os.listdir(tmp_path) == ["k.bin"]
+        assert cache.stats()["memory_items"] == 0
+
+    def test_size_bound(self, tmp_path):
+        cache = BlobCache("test_blob_evict", str(tmp_path), max_bytes=10)
+        cache.put("a", b"123456")
+        cache.put("b", b"123456")
+
+        assert cache.get("a") is None and cache.get("b") == b"123456"
+
+
+class TestSqliteCache:
+
+    def test_survives_restart(self, tmp_path):
+        SqliteCache("test_sqlite", str(tmp_path / "c.sqlite")).put("k", {"bpm": 120})
+
+        assert SqliteCache("test_sqlite", str(tmp_path / "c.sqlite")).get("k") == {"bpm": 120}
+
+    def test_entries_expire_after_ttl(self, tmp_path, monkeypatch):
+        cache = SqliteCache("test_ttl", str(tmp_path / "c.sqlite"), ttl=60)
+        cache.put("k", "v")
+        later = time.time() + 61
+        monkeypatch.setattr(time, "time", lambda: later)
+
+        assert cache.get("k") is None
+        assert SqliteCache("test_ttl", str(tmp_path / "c.sqlite"), ttl=60).get("k") is None
+
+    def test_evicts_least_recently_used_rows(self, tmp_path):
+        cache = SqliteCache("test_sqlite_evict", str(tmp_path / "c.sqlite"), max_items=1, max_bytes=25)
+        cache.put("a", "x" * 8)
+        time.sleep(0.01)
+        cache.put("b", "y" * 8)
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.put("c", "z" * 8)
+
+        assert cache.stats()["disk_items"] == 2
+        assert SqliteCache("test_sqlite_evict", str(tmp_path / "c.sqlite")).get("b") is None
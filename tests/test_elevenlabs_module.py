@@ -1,11 +1,27 @@
 """Unit tests for services/elevenlabs_module.py — TTS vs STS routing."""
 
+import io
 import os
+import threading
+import time
 from unittest.mock import patch, MagicMock
 
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+
 from elevenlabs import VoiceSettings
 
-from services.elevenlabs_module import synthesize_vocals, convert_speech_to_speech
+from services.elevenlabs_module import synthesize_vocals, convert_speech_to_speech, split_sections
+
+
+@pytest.fixture(autouse=True)
+def stem_cache(tmp_path, monkeypatch):
+    """A fresh stem cache per test, so identical lyrics don't hit earlier tests' renders."""
+    from services.cache_module import BlobCache
+    cache = BlobCache("stems_test", str(tmp_path / "stems"))
+    monkeypatch.setattr("services.elevenlabs_module.STEMS", cache)
+    return cache
 
 
 class TestSynthesizeVocals:
@@ -51,6 +67,85 @@ class TestSynthesizeVocals:
         assert os.path.exists(out)
 
 
+LYRICS = """[Verse 1]
+Walking down the road
+[Chorus]
+Oh we sing
+[Verse 2]
+Running back home
+[Chorus]
+Oh  we sing
+"""
+
+
+def _mp3(seconds: float) -> bytes:
+    buf = io.BytesIO()
+    Sine(440).to_audio_segment(duration=int(seconds * 1000)).export(buf, format="mp3")
+    return buf.getvalue()
+
+
+class TestSectionSynthesis:
+    """Tests for section-parallel TTS of structured lyrics."""
+
+    def test_split_sections(self):
+        assert split_sections("intro line\n[Verse 1]\nla la\n\n[Chorus]\n\n[Bridge] \nna na") == [
+            ("", "intro line"), ("Verse 1", "la la"), ("Bridge", "na na")]
+
+    @patch("services.elevenlabs_module._get_client")
+    def test_repeated_chorus_synthesized_once(self, mock_get_client, tmp_path):
+        clips = {"Walking down the road": _mp3(1.0), "Oh we sing": _mp3(0.5), "Running back home": _mp3(1.5)}
+        mock_get_client().text_to_speech.convert.side_effect = lambda text, **kw: [clips[text]]
+        out = str(tmp_path / "vocals.mp3")
+        sections = []
+
+        synthesize_vocals(LYRICS, out, sections=sections)
+
+        texts = sorted(c.kwargs["text"] for c in mock_get_client().text_to_speech.convert.call_args_list)
+        assert texts == sorted(clips)
+        with open(out, "rb") as f:
+            data = f.read()
+        assert data.count(b"Xing") + data.count(b"Info") <= 1  # one encode, not four files glued together
+        assert AudioSegment.from_file(out).duration_seconds == pytest.approx(sections[3]["end"], abs=0.06)
+        assert [s["label"] for s in sections] == ["Verse 1", "Chorus", "Verse 2", "Chorus"]
+        assert sections[1]["start"] == sections[0]["end"] == pytest.approx(1.0, abs=0.06)
+        assert sections[3]["end"] == pytest.approx(3.5, abs=0.2)
+
+    @patch("services.elevenlabs_module._get_client")
+    def test_single_section_spans_the_stem(self, mock_get_client, tmp_path):
+        mock_get_client().text_to_speech.convert.side_effect = lambda text, **kw: [_mp3(1.0)]
+        fresh, cached = [], []
+
+        synthesize_vocals("[Verse]\nWalking down the road", str(tmp_path / "a.mp3"), sections=fresh)
+        synthesize_vocals("[Verse]\nWalking down the road", str(tmp_path / "b.mp3"), sections=cached)
+
+        assert mock_get_client().text_to_speech.convert.call_count == 1
+        assert fresh == cached
+        assert [(s["label"], s["start"]) for s in fresh] == [("Verse", 0.0)]
+        assert fresh[0]["end"] == pytest.approx(1.0, abs=0.06)
+
+    @patch("services.elevenlabs_module.TTS_SECTION_CONCURRENCY", 2)
+    @patch("services.elevenlabs_module._get_client")
+    def test_parallelism_is_bounded(self, mock_get_client, tmp_path):
+        clip, lock, active, peak = _mp3(0.2), threading.Lock(), [0], [0]
+
+        def convert(text, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return [clip]
+
+        mock_get_client().text_to_speech.convert.side_effect = convert
+        lyrics = "".join(f"[Verse {i}]\nline {i}\n" for i in range(5))
+
+        synthesize_vocals(lyrics, str(tmp_path / "vocals.mp3"))
+
+        assert mock_get_client().text_to_speech.convert.call_count == 5
+        assert peak[0] == 2
+
+
 class TestConvertSpeechToSpeech:
     """Tests for the STS path (convert_speech_to_speech)."""
 
@@ -93,3 +188,41 @@ class TestConvertSpeechToSpeech:
 
         assert result == out
         assert os.path.exists(out)
+
+
+class TestStemCache:
+    """Rendered stems are reused for identical text/audio, voice and settings."""
+
+    @patch("services.elevenlabs_module._get_client")
+    def test_tts_hit_skips_elevenlabs(self, mock_get_client, tmp_path):
+        mock_get_client().text_to_speech.convert.return_value = [b"take1"]
+        synthesize_vocals("same lyrics", str(tmp_path / "a.mp3"))
+
+        synthesize_vocals("same lyrics", str(tmp_path / "b.mp3"))
+
+        mock_get_client().text_to_speech.convert.assert_called_once()
+        with open(tmp_path / "b.mp3", "rb") as f:
+            assert f.read() == b"take1"
+
+    @patch("services.elevenlabs_module._get_client")
+    def test_voice_settings_are_part_of_the_key(self, mock_get_client, tmp_path):
+        mock_get_client().text_to_speech.convert.return_value = [b"take"]
+        synthesize_vocals("same lyrics", str(tmp_path / "a.mp3"), stability=0.3)
+        synthesize_vocals("same lyrics", str(tmp_path / "b.mp3"), stability=0.8)
+
+        assert mock_get_client().text_to_speech.convert.call_count == 2
+
+    @patch("services.elevenlabs_module._get_client")
+    def test_sts_keyed_by_input_pcm(self, mock_get_client, tmp_path):
+        mock_get_client().speech_to_speech.convert.return_value = [b"sung"]
+        memo = Sine(220).to_audio_segment(duration=500)
+        memo.export(str(tmp_path / "memo.wav"), format="wav")
+        memo.export(str(tmp_path / "memo.flac"), format="flac")
+
+        convert_speech_to_speech(str(tmp_path / "memo.wav"), str(tmp_path / "a.mp3"))
+        convert_speech_to_speech(str(tmp_path / "memo.flac"), str(tmp_path / "b.mp3"))
+        convert_speech_to_speech(str(tmp_path / "memo.flac"), str(tmp_path / "c.mp3"), voice_id="other")
+
+        assert mock_get_client().speech_to_speech.convert.call_count == 2
+        with open(tmp_path / "b.mp3", "rb") as f:
+            assert f.read() == b"sung"
@@ -0,0 +1,103 @@
+"""Unit tests for services/encoder_module.py — streaming ffmpeg encode and file following."""
+
+import asyncio
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+from services import encoder_module
+from services.encoder_module import (
+    encode_blocks, encode_stream, follow, get_profile, is_encoding, media_type_for, StreamingEncoder,
+)
+
+
+def _noise(seconds=2.5, rate=48000):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal((int(seconds * rate), 2)) * 0.1).astype(np.float32)
+
+
+class TestProfiles:
+
+    def test_unknown_profile_falls_back_to_default(self):
+        assert get_profile("flac_lossless") is get_profile(encoder_module.DEFAULT_PROFILE)
+
+    def test_media_type_follows_extension(self):
+        assert media_type_for("temp/final_x.mp3") == "audio/mpeg"
+        assert media_type_for("temp/final_x.ogg") == "audio/ogg"
+
+
+class TestEncodeStream:
+
+    @pytest.mark.parametrize("profile,fmt", [("mp3_192", "mp3"), ("opus_96", "ogg")])
+    def test_output_decodes_to_same_duration(self, tmp_path, profile, fmt):
+        out = str(tmp_path / f"mix.{fmt}")
+        encode_stream(_noise(), out, profile)
+
+        decoded = AudioSegment.from_file(out, format=fmt)
+        assert abs(len(decoded) - 2500) < 100
+
+    def test_on_start_fires_once_while_encoding(self, tmp_path):
+        out = str(tmp_path / "mix.mp3")
+        seen = []
+        encode_stream(_noise(), out, on_start=lambda p: seen.append((p, is_encoding(p))))
+
+        assert seen == [(out, True)]
+        assert not is_encoding(out)
+
+    def test_encoding_starts_before_the_last_block_is_produced(self, tmp_path):
+        out = str(tmp_path / "mix.mp3")
+        events = []
+
+        def blocks():
+            for i in range(3):
+                events.append(f"block {i}")
+                yield _noise(1.0)
+
+        encode_blocks(blocks(), out, on_start=lambda p: events.append("started"))
+
+        assert events == ["block 0", "started", "block 1", "block 2"]
+
+    def test_failed_encoder_raises_and_unregisters(self, tmp_path):
+        out = str(tmp_path / "missing_dir" / "mix.mp3")
+        with pytest.raises(RuntimeError):
+            with StreamingEncoder(out) as encoder:
+                encoder.write(_noise(0.1))
+        assert not is_encoding(out)
+
+
+class TestFollow:
+
+    def _collect(self, path):
+        async def run():
+            return b"".join([chunk async for chunk in follow(path, chunk_size=7)])
+        return asyncio.run(run())
+
+    def test_reads_finished_file(self, tmp_path):
+        path = tmp_path / "done.mp3"
+        path.write_bytes(b"0123456789abcdef")
+        assert self._collect(str(path)) == b"0123456789abcdef"
+
+    def test_missing_file_not_encoding_yields_nothing(self, tmp_path):
+        assert self._collect(str(tmp_path / "nope.mp3")) == b""
+
+    def test_waits_for_encoder_to_finish(self, tmp_path):
+        path = str(tmp_path / "growing.mp3")
+        key = encoder_module.os.path.abspath(path)
+
+        async def run():
+            encoder_module._active.add(key)
+
+            async def writer():
+                with open(path, "wb") as f:
+                    for part in (b"abc", b"def", b"ghi"):
+                        f.write(part)
+                        f.flush()
+                        await asyncio.sleep(0.02)
+                encoder_module._active.discard(key)
+
+            task = asyncio.create_task(writer())
+            data = b"".join([chunk async for chunk in follow(path, poll_interval=0.01)])
+            await task
+            return data
+
+        assert asyncio.run(run()) == b"abcdefghi"
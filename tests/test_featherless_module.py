@@ -1,106 +1,179 @@
 """Unit tests for services/featherless_module.py"""
+import asyncio
+import json
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
+from services import featherless_module
+from services.featherless_module import refine_lyrics, REFINEMENTS
+from services.metrics_module import PROVIDER_ERRORS
 
-class TestRefineLyrics:
-    """Tests for refine_lyrics HTTP calls and response handling."""
 
-    @patch("services.featherless_module.requests.post")
-    def test_successful_refinement(self, mock_post):
-        """200 response returns refined lyrics string."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = {
-            "choices": [{"message": {"content": "  Refined lyrics here  "}}]
-        }
-        mock_post.return_value = mock_resp
+@pytest.fixture(autouse=True)
+def featherless_env(monkeypatch):
+    monkeypatch.setenv("FEATHERLESS_API_KEY", "test-key")
 
-        from services.featherless_module import refine_lyrics
-        result = refine_lyrics("rough lyrics", "pop", "upbeat")
 
-        assert result == "Refined lyrics here"
-        mock_post.assert_called_once()
+class _Lines:
+    """Async iterator over SSE lines, like aiohttp's response.content."""
 
-    @patch("services.featherless_module.requests.post")
-    def test_returns_none_on_server_error(self, mock_post):
-        """500 response returns None."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 500
-        mock_post.return_value = mock_resp
+    def __init__(self, lines: list):
+        self._lines = iter(lines)
 
-        from services.featherless_module import refine_lyrics
-        result = refine_lyrics("rough lyrics", "pop", "upbeat")
+    def __aiter__(self):
+        return self
 
-        assert result is None
+    async def __anext__(self):
+        try:
+            return next(self._lines)
+        except StopIteration:
+            raise StopAsyncIteration
 
-    @patch("services.featherless_module.requests.post")
-    def test_returns_none_on_rate_limit(self, mock_post):
-        """429 rate limit response returns None."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 429
-        mock_post.return_value = mock_resp
 
-        from services.featherless_module import refine_lyrics
-        result = refine_lyrics("rough lyrics", "pop", "upbeat")
+def _stream(text: str) -> list:
+    """A streamed completion of text, two characters per delta."""
+    lines = [b"data: " + json.dumps({"choices": [{"delta": {"content": text[i:i + 2]}}]}).encode() + b"\n"
+             for i in range(0, len(text), 2)]
+    return lines + [b"\n", b"data: [DONE]\n"]
 
-        assert result is None
 
-    @patch("services.featherless_module.requests.post")
-    def test_returns_none_on_unauthorized(self, mock_post):
-        """401 unauthorized returns None."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 401
-        mock_post.return_value = mock_resp
+def _response(status: int, text: str = "", delay: float = 0) -> MagicMock:
+    resp = MagicMock()
+    resp.status = status
+    resp.content = _Lines(_stream(text))
+
+    async def enter():
+        await asyncio.sleep(delay)
+        return resp
+
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(side_effect=enter)
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    return ctx
+
+
+def _mock_session(*responses) -> MagicMock:
+    """A pooled session whose successive post() calls return the given responses."""
+    session = MagicMock()
+    session.post = MagicMock(side_effect=list(responses))
+    return session
+
+
+class TestRefineLyrics:
+    """Tests for refine_lyrics HTTP calls and response handling."""
+
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_successful_refinement(self, mock_get_session):
+        """A streamed 200 response is joined into the refined lyrics string."""
+        mock_get_session.return_value = _mock_session(_response(200, "  Refined lyrics here  "))
+
+        result = await refine_lyrics("rough lyrics", "pop", "upbeat")
 
-        from services.featherless_module import refine_lyrics
-        result = refine_lyrics("rough lyrics", "pop", "upbeat")
+        assert result == "Refined lyrics here"
+        mock_get_session.assert_called_with("featherless")
+        assert mock_get_session.return_value.post.call_args.kwargs["json"]["stream"] is True
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("status", [500, 429, 401])
+    @patch("services.featherless_module.get_session")
+    async def test_returns_none_on_error_status(self, mock_get_session, status):
+        """Server errors, rate limits and bad credentials return None."""
+        mock_get_session.return_value = _mock_session(_response(status))
+
+        result = await refine_lyrics("rough lyrics", "pop", "upbeat")
 
         assert result is None
 
-    @patch("services.featherless_module.requests.post")
-    def test_sends_correct_payload(self, mock_post):
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_sends_correct_payload(self, mock_get_session):
         """Verifies the request body includes genre, mood, and lyrics."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = {
-            "choices": [{"message": {"content": "refined"}}]
-        }
-        mock_post.return_value = mock_resp
-
-        from services.featherless_module import refine_lyrics
-        refine_lyrics("walking down the street", "hip hop", "melancholic")
-
-        call_kwargs = mock_post.call_args
-        payload = call_kwargs.kwargs.get("json") or call_kwargs[1].get("json")
+        mock_get_session.return_value = _mock_session(_response(200, "refined"))
+
+        await refine_lyrics("walking down the street", "hip hop", "melancholic")
+
+        payload = mock_get_session.return_value.post.call_args.kwargs["json"]
         user_msg = payload["messages"][1]["content"]
         assert "hip hop" in user_msg
         assert "melancholic" in user_msg
         assert "walking down the street" in user_msg
 
-    @patch("services.featherless_module.requests.post")
-    def test_uses_correct_model(self, mock_post):
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_uses_correct_model(self, mock_get_session):
         """Verifies the Qwen model is specified in the request."""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = {
-            "choices": [{"message": {"content": "refined"}}]
-        }
-        mock_post.return_value = mock_resp
-
-        from services.featherless_module import refine_lyrics
-        refine_lyrics("test", "pop", "happy")
-
-        call_kwargs = mock_post.call_args
-        payload = call_kwargs.kwargs.get("json") or call_kwargs[1].get("json")
+        mock_get_session.return_value = _mock_session(_response(200, "refined"))
+
+        await refine_lyrics("test", "pop", "happy")
+
+        payload = mock_get_session.return_value.post.call_args.kwargs["json"]
         assert payload["model"] == "Qwen/Qwen2.5-7B-Instruct"
 
-    @patch("services.featherless_module.requests.post")
-    def test_timeout_raises_exception(self, mock_post):
-        """Network timeout propagates as an exception."""
-        import requests
-        mock_post.side_effect = requests.exceptions.Timeout("Connection timed out")
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_connection_error_returns_none(self, mock_get_session):
+        """A failed request falls back (None) instead of raising."""
+        mock_get_session.return_value.post.side_effect = ConnectionError("refused")
+        before = REFINEMENTS.get(result="failed")
+        errors = PROVIDER_ERRORS.get(provider="featherless", operation="refine_lyrics")
+
+        assert await refine_lyrics("test", "pop", "happy") is None
+        assert REFINEMENTS.get(result="failed") == before + 1
+        assert PROVIDER_ERRORS.get(provider="featherless", operation="refine_lyrics") == errors + 1
 
-        from services.featherless_module import refine_lyrics
-        with pytest.raises(requests.exceptions.Timeout):
-            refine_lyrics("test", "pop", "happy")
+    @pytest.mark.asyncio
+    async def test_skipped_without_api_key(self, monkeypatch):
+        monkeypatch.delenv("FEATHERLESS_API_KEY")
+
+        assert await refine_lyrics("test", "pop", "happy") is None
+
+
+class TestBudgetAndHedging:
+    """Tests for the latency budget and hedged requests across models."""
+
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_gives_up_when_budget_is_spent(self, mock_get_session):
+        mock_get_session.return_value = _mock_session(_response(200, "too late", delay=5))
+        before = REFINEMENTS.get(result="budget_skipped")
+
+        started = asyncio.get_running_loop().time()
+        result = await refine_lyrics("test", "pop", "happy", budget=0.05)
+
+        assert result is None
+        assert asyncio.get_running_loop().time() - started < 1
+        assert REFINEMENTS.get(result="budget_skipped") == before + 1
+
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_hedge_wins_over_slow_model(self, mock_get_session, monkeypatch):
+        monkeypatch.setattr(featherless_module, "MODELS", ["slow/model", "fast/model"])
+        monkeypatch.setattr(featherless_module, "HEDGE_DELAY_SECONDS", 0.01)
+        mock_get_session.return_value = _mock_session(_response(200, "slow", delay=5), _response(200, "fast"))
+
+        result = await refine_lyrics("test", "pop", "happy", budget=1)
+
+        assert result == "fast"
+        models = [c.kwargs["json"]["model"] for c in mock_get_session.return_value.post.call_args_list]
+        assert models == ["slow/model", "fast/model"]
+
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_failure_hedges_immediately(self, mock_get_session, monkeypatch):
+        monkeypatch.setattr(featherless_module, "MODELS", ["down/model", "up/model"])
+        monkeypatch.setattr(featherless_module, "HEDGE_DELAY_SECONDS", 30)
+        mock_get_session.return_value = _mock_session(_response(503), _response(200, "refined"))
+
+        assert await refine_lyrics("test", "pop", "happy", budget=1) == "refined"
+
+    @pytest.mark.asyncio
+    @patch("services.featherless_module.get_session")
+    async def test_raising_model_is_counted_and_hedged(self, mock_get_session, monkeypatch):
+        monkeypatch.setattr(featherless_module, "MODELS", ["broken/model", "up/model"])
+        monkeypatch.setattr(featherless_module, "HEDGE_DELAY_SECONDS", 30)
+        mock_get_session.return_value.post = MagicMock(side_effect=[ConnectionError("reset"), _response(200, "ok")])
+        errors = PROVIDER_ERRORS.get(provider="featherless", operation="refine_lyrics")
+
+        assert await refine_lyrics("test", "pop", "happy", budget=1) == "ok"
+        assert PROVIDER_ERRORS.get(provider="featherless", operation="refine_lyrics") == errors + 1
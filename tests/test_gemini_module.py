@@ -2,16 +2,29 @@
 
 import json
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
-from services.gemini_module import get_gemini_analysis
+from services import gemini_module
+from services.gemini_module import get_gemini_analysis, get_gemini_audio_analysis, FieldParser
 
 
-def _mock_response(text: str) -> MagicMock:
-    """Create a fake Gemini response with the given .text."""
-    resp = MagicMock()
-    resp.text = text
-    return resp
+@pytest.fixture(autouse=True)
+def analysis_cache(tmp_path, monkeypatch):
+    """A fresh analysis cache per test, so repeated transcripts don't hit earlier tests' results."""
+    from services.cache_module import SqliteCache
+    cache = SqliteCache("gemini_analysis_test", str(tmp_path / "gemini.sqlite"), ttl=3600)
+    monkeypatch.setattr("services.gemini_module.ANALYSES", cache)
+    return cache
+
+
+def _mock_stream(text: str, size: int = 7) -> list:
+    """Split a fake Gemini response into streamed chunks with a .text each."""
+    chunks = []
+    for i in range(0, max(len(text), 1), size):
+        chunk = MagicMock()
+        chunk.text = text[i:i + size]
+        chunks.append(chunk)
+    return chunks
 
 
 class TestContainsLyricsDetection:
@@ -28,7 +41,7 @@ class TestContainsLyricsDetection:
             "bpm": 120,
             "key": "A minor",
         }
-        mock_get_client().models.generate_content.return_value = _mock_response(json.dumps(payload))
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(payload))
 
         result = get_gemini_analysis("I walk alone tonight under the stars", "pop")
 
@@ -46,7 +59,7 @@ class TestContainsLyricsDetection:
             "bpm": 90,
             "key": "C major",
         }
-        mock_get_client().models.generate_content.return_value = _mock_response(json.dumps(payload))
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(payload))
 
         result = get_gemini_analysis("hmm hmm la la la", "jazz")
 
@@ -59,7 +72,7 @@ class TestJsonParsing:
 
     @patch("services.gemini_module._get_client")
     def test_parses_clean_json(self, mock_get_client, sample_gemini_response):
-        mock_get_client().models.generate_content.return_value = _mock_response(
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(
             json.dumps(sample_gemini_response)
         )
 
@@ -72,7 +85,7 @@ class TestJsonParsing:
     @patch("services.gemini_module._get_client")
     def test_strips_markdown_json_fences(self, mock_get_client, sample_gemini_response):
         wrapped = f"```json\n{json.dumps(sample_gemini_response)}\n```"
-        mock_get_client().models.generate_content.return_value = _mock_response(wrapped)
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(wrapped)
 
         result = get_gemini_analysis("la la la", "pop")
 
@@ -81,7 +94,7 @@ class TestJsonParsing:
     @patch("services.gemini_module._get_client")
     def test_strips_plain_markdown_fences(self, mock_get_client, sample_gemini_response):
         wrapped = f"```\n{json.dumps(sample_gemini_response)}\n```"
-        mock_get_client().models.generate_content.return_value = _mock_response(wrapped)
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(wrapped)
 
         result = get_gemini_analysis("humming a tune", "jazz")
 
@@ -89,7 +102,7 @@ class TestJsonParsing:
 
     @patch("services.gemini_module._get_client")
     def test_raises_on_invalid_json(self, mock_get_client):
-        mock_get_client().models.generate_content.return_value = _mock_response("This is not JSON")
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream("This is not JSON")
 
         with pytest.raises(json.JSONDecodeError):
             get_gemini_analysis("some lyrics", "pop")
@@ -97,7 +110,7 @@ class TestJsonParsing:
     @patch("services.gemini_module._get_client")
     def test_handles_whitespace_around_json(self, mock_get_client, sample_gemini_response):
         padded = f"  \n{json.dumps(sample_gemini_response)}\n  "
-        mock_get_client().models.generate_content.return_value = _mock_response(padded)
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(padded)
 
         result = get_gemini_analysis("test", "pop")
 
@@ -105,7 +118,7 @@ class TestJsonParsing:
 
     @patch("services.gemini_module._get_client")
     def test_all_expected_fields_present(self, mock_get_client, sample_gemini_response):
-        mock_get_client().models.generate_content.return_value = _mock_response(
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(
             json.dumps(sample_gemini_response)
         )
 
@@ -114,3 +127,120 @@ class TestJsonParsing:
         for key in ("contains_lyrics", "cleaned_lyrics", "style_prompt",
                      "detected_genre", "mood", "bpm", "key"):
             assert key in result
+
+
+class TestAnalysisCache:
+    """Tests for the memoized analysis keyed on transcript, genre, model and prompt version."""
+
+    PAYLOAD = {"contains_lyrics": True, "cleaned_lyrics": "la", "style_prompt": "pop", "bpm": 120}
+
+    @patch("services.gemini_module._get_client")
+    def test_normalized_repeat_is_served_from_cache(self, mock_get_client):
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(self.PAYLOAD))
+
+        first = get_gemini_analysis("I walk  alone tonight", "Pop")
+        second = get_gemini_analysis(" i walk alone\ntonight ", "pop")
+
+        assert first == second == self.PAYLOAD
+        assert mock_get_client().models.generate_content_stream.call_count == 1
+
+    @patch("services.gemini_module._get_client")
+    def test_fresh_bypasses_and_replaces_cached_analysis(self, mock_get_client):
+        generate = mock_get_client().models.generate_content_stream
+        generate.return_value = _mock_stream(json.dumps(self.PAYLOAD))
+        get_gemini_analysis("hello", "pop")
+        generate.return_value = _mock_stream(json.dumps({**self.PAYLOAD, "bpm": 90}))
+
+        assert get_gemini_analysis("hello", "pop", fresh=True)["bpm"] == 90
+        assert get_gemini_analysis("hello", "pop")["bpm"] == 90
+        assert generate.call_count == 2
+
+    @patch("services.gemini_module._get_client")
+    def test_prompt_version_is_part_of_the_key(self, mock_get_client, monkeypatch):
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(self.PAYLOAD))
+        get_gemini_analysis("hello", "pop")
+        monkeypatch.setattr("services.gemini_module.PROMPT_VERSION", gemini_module.PROMPT_VERSION + 1)
+        get_gemini_analysis("hello", "pop")
+
+        assert mock_get_client().models.generate_content_stream.call_count == 2
+
+
+class TestFieldParser:
+    """Tests for the incremental JSON field parser."""
+
+    def test_fields_complete_as_their_text_arrives(self):
+        parser = FieldParser()
+
+        assert parser.feed('```json\n{"style_prompt": "lo-fi, 8') == []
+        assert parser.feed('0 BPM", "bpm": 8') == [("style_prompt", "lo-fi, 80 BPM")]
+        assert parser.feed('0, "contains_lyrics": tr') == [("bpm", 80)]
+        assert parser.feed('ue, "tags": ["a", "}"]') == [("contains_lyrics", True), ("tags", ["a", "}"])]
+        assert not parser.done
+        assert parser.feed('}\n```') == []
+        assert parser.done and parser.fields["bpm"] == 80
+
+    def test_escaped_quotes_inside_strings(self):
+        parser = FieldParser()
+
+        assert parser.feed('{"cleaned_lyrics": "she said \\"hi\\"\\n", "mood": "warm"}') == [
+            ("cleaned_lyrics", 'she said "hi"\n'), ("mood", "warm")]
+
+    @patch("services.gemini_module._get_client")
+    def test_on_field_called_before_stream_ends(self, mock_get_client, sample_gemini_response):
+        seen = []
+
+        def stream(**kwargs):
+            for chunk in _mock_stream(json.dumps(sample_gemini_response)):
+                yield chunk
+            seen.append("end")
+
+        mock_get_client().models.generate_content_stream.side_effect = stream
+
+        get_gemini_analysis("la la", "pop", on_field=lambda key, value: seen.append(key))
+
+        assert seen.index("style_prompt") < seen.index("end")
+        assert set(seen) - {"end"} == set(sample_gemini_response)
+
+
+class TestAudioAnalysis:
+    """Tests for the single-call direct audio analysis."""
+
+    @patch("services.gemini_module._get_client")
+    def test_sends_audio_and_returns_transcript(self, mock_get_client, sample_gemini_response, dummy_wav):
+        payload = {**sample_gemini_response, "transcript": "walking down the road"}
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(payload))
+
+        result = get_gemini_audio_analysis(dummy_wav, "pop")
+
+        prompt, audio = mock_get_client().models.generate_content_stream.call_args.kwargs["contents"]
+        assert '"transcript"' in prompt
+        assert audio.inline_data.mime_type == "audio/wav"
+        assert result["transcript"] == "walking down the road"
+
+    @patch("services.gemini_module._get_client")
+    def test_cached_by_fingerprint(self, mock_get_client, sample_gemini_response, dummy_wav):
+        mock_get_client().models.generate_content_stream.return_value = _mock_stream(json.dumps(sample_gemini_response))
+
+        get_gemini_audio_analysis(dummy_wav, "pop", fingerprint="abc")
+        result = get_gemini_audio_analysis(dummy_wav, "pop", fingerprint="abc")
+
+        assert result["transcript"] == ""
+        assert mock_get_client().models.generate_content_stream.call_count == 1
+
+
+class TestVoicemailAnalysis:
+    """Tests for the async voicemail analysis used by /api/voicemail/analyze."""
+
+    @pytest.mark.asyncio
+    @patch("services.gemini_module._get_client")
+    async def test_uses_shared_client_async_api(self, mock_get_client):
+        payload = {"transcript": "where is my order", "intent": "ORDER_STATUS"}
+        mock_get_client().aio.models.generate_content = AsyncMock(
+            return_value=MagicMock(text=f"```json\n{json.dumps(payload)}\n```"))
+
+        result = await gemini_module.analyze_voicemail(b"audio", "audio/wav")
+
+        assert result == payload
+        prompt, audio = mock_get_client().aio.models.generate_content.call_args.kwargs["contents"]
+        assert prompt == gemini_module.VOICEMAIL_PROMPT
+        assert audio.inline_data.mime_type == "audio/wav"
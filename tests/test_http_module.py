@@ -0,0 +1,26 @@
+"""Unit tests for services/http_module.py — per-provider pooled sessions."""
+import pytest
+
+from services import http_module
+
+
+class TestSessions:
+
+    @pytest.mark.asyncio
+    async def test_one_long_lived_session_per_provider(self):
+        session = http_module.get_session("test_a")
+
+        assert http_module.get_session("test_a") is session
+        assert http_module.get_session("test_b") is not session
+        assert session.connector.limit == http_module.POOL_SIZE
+        await http_module.close()
+
+    @pytest.mark.asyncio
+    async def test_close_then_reopen(self):
+        session = http_module.get_session("test_a")
+        await http_module.close()
+
+        assert session.closed
+        reopened = http_module.get_session("test_a")
+        assert reopened is not session and not reopened.closed
+        await http_module.close()
@@ -0,0 +1,92 @@
+"""Unit tests for services/jobs_module.py — job lifecycle, event replay and thread-safe publishing."""
+
+import asyncio
+import threading
+import pytest
+
+import services.jobs_module as mod
+from services.jobs_module import submit, get_job
+
+
+async def _collect(job, after=-1):
+    return [(i, event) for i, event, _ in [item async for item in job.stream(after) if item is not None]]
+
+
+class TestJobs:
+
+    @pytest.mark.asyncio
+    async def test_result_recorded_and_events_replayed(self):
+        async def run(job):
+            job.publish("stage_started", {"stage": "a"})
+            await asyncio.sleep(0)
+            return {"answer": 42}
+
+        job = submit(run)
+        events = await asyncio.wait_for(_collect(job), timeout=1)
+
+        assert events == [(0, "stage_started"), (1, "done")]
+        assert get_job(job.id).to_dict()["result"] == {"answer": 42}
+        assert job.status == "done"
+
+    @pytest.mark.asyncio
+    async def test_failure_ends_stream_with_error(self):
+        async def run(job):
+            raise RuntimeError("lyria down")
+
+        job = submit(run)
+        events = await asyncio.wait_for(_collect(job), timeout=1)
+
+        assert events[-1][1] == "failed"
+        assert job.to_dict()["error"] == "lyria down"
+
+    @pytest.mark.asyncio
+    async def test_resume_after_event_id(self):
+        async def run(job):
+            for stage in ("a", "b", "c"):
+                job.publish("stage_started", {"stage": stage})
+            return {}
+
+        job = submit(run)
+        await asyncio.wait_for(_collect(job), timeout=1)
+
+        assert [i for i, _ in await _collect(job, after=1)] == [2, 3]
+
+    @pytest.mark.asyncio
+    async def test_publish_from_worker_thread(self):
+        async def run(job):
+            thread = threading.Thread(target=job.publish, args=("encoding", {"audio_url": "/audio/x.mp3"}))
+            thread.start()
+            await asyncio.to_thread(thread.join)
+            return {}
+
+        job = submit(run)
+        events = await asyncio.wait_for(_collect(job), timeout=1)
+
+        assert [e for _, e in events] == ["encoding", "done"]
+
+    @pytest.mark.asyncio
+    async def test_keepalive_yields_none_while_idle(self):
+        release = asyncio.Event()
+
+        async def run(job):
+            await release.wait()
+            return {}
+
+        job = submit(run)
+        stream = job.stream(keepalive=0.01)
+        assert await asyncio.wait_for(stream.__anext__(), timeout=1) is None
+        release.set()
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_expired_jobs_pruned(self, monkeypatch):
+        async def run(job):
+            return {}
+
+        old = submit(run)
+        await asyncio.wait_for(_collect(old), timeout=1)
+        old.finished -= mod.JOB_TTL_SECONDS + 1
+
+        submit(run)
+
+        assert get_job(old.id) is None
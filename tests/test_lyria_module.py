@@ -0,0 +1,319 @@
+"""Unit tests for services/lyria_module.py — incremental WAV spooling and subscribers."""
+
+import os
+import wave
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import services.lyria_module as mod
+from services.lyria_module import InstrumentalSpool, generate_instrumental
+
+
+def _message(*chunks):
+    msg = MagicMock()
+    msg.server_content.audio_chunks = [MagicMock(data=c) for c in chunks]
+    return msg
+
+
+def _fake_client(messages):
+    """genai.Client whose live music session yields the given messages."""
+    session = MagicMock()
+    session.set_weighted_prompts = AsyncMock()
+    session.set_music_generation_config = AsyncMock()
+    session.play = AsyncMock()
+
+    async def receive():
+        for m in messages:
+            yield m
+    session.receive = receive
+
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(return_value=session)
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    client = MagicMock()
+    client.aio.live.music.connect.return_value = ctx
+    return client
+
+
+class TestInstrumentalSpool:
+
+    def test_file_is_readable_while_spooling(self, tmp_path):
+        path = str(tmp_path / "inst.wav")
+        spool = InstrumentalSpool(path)
+        spool.append(b"\x01\x00" * 400)  # 200 stereo frames
+
+        with wave.open(path, "rb") as wav:
+            assert wav.getnframes() == 200
+            assert wav.getframerate() == 48000
+        spool.close()
+
+    def test_subscribers_get_chunks_then_none(self, tmp_path):
+        spool = InstrumentalSpool(str(tmp_path / "inst.wav"))
+        received = []
+        spool.subscribe(received.append)
+
+        spool.append(b"\x00" * 8)
+        spool.append(b"\x01" * 8)
+        spool.close()
+
+        assert received == [b"\x00" * 8, b"\x01" * 8, None]
+
+    def test_unsubscribe_stops_delivery(self, tmp_path):
+        spool = InstrumentalSpool(str(tmp_path / "inst.wav"))
+        received = []
+        unsubscribe = spool.subscribe(received.append)
+        spool.append(b"\x00" * 4)
+        unsubscribe()
+        spool.append(b"\x00" * 4)
+        spool.close()
+
+        assert received == [b"\x00" * 4]
+
+
+class TestGenerateInstrumental:
+
+    @patch.object(mod, "TARGET_SECONDS", 1)
+    @patch("services.lyria_module.genai.Client")
+    def test_stops_at_target_and_writes_wav(self, mock_client_cls, tmp_path):
+        second = b"\x00" * (48000 * 4)
+        mock_client_cls.return_value = _fake_client([_message(second[:96000]), _message(second[96000:]),
+                                                     _message(b"\xff" * 4000)])
+        path = str(tmp_path / "inst.wav")
+        before = mod.get_stats()
+
+        result = generate_instrumental("lofi", 90, path)
+
+        assert result == path
+        with wave.open(path, "rb") as wav:
+            assert wav.getnframes() == 48000
+        after = mod.get_stats()
+        assert after["chunks"] - before["chunks"] == 2
+        assert after["generations"] - before["generations"] == 1
+
+    @patch("services.lyria_module.genai.Client")
+    def test_no_audio_raises_and_removes_file(self, mock_client_cls, tmp_path):
+        mock_client_cls.return_value = _fake_client([])
+        path = str(tmp_path / "inst.wav")
+
+        with pytest.raises(RuntimeError, match="no audio"):
+            generate_instrumental("lofi", 90, path)
+        assert not os.path.exists(path)
+
+    @patch.object(mod, "TARGET_SECONDS", 1)
+    @patch("services.lyria_module.genai.Client")
+    def test_caller_spool_receives_chunks(self, mock_client_cls, tmp_path):
+        mock_client_cls.return_value = _fake_client([_message(b"\x00" * (48000 * 4))])
+        spool = InstrumentalSpool(str(tmp_path / "inst.wav"))
+        received = []
+        spool.subscribe(received.append)
+
+        generate_instrumental("lofi", 90, spool.output_path, spool=spool)
+
+        assert len(received) == 2 and received[-1] is None
+
+
+class _FakeMusic:
+    """client.aio.live.music stand-in that counts connects and closes."""
+
+    def __init__(self, fail_connects=0):
+        self.connects = 0
+        self.closes = 0
+        self.fail_connects = fail_connects
+
+    def connect(self, model):
+        music = self
+
+        class _Ctx:
+            async def __aenter__(self):
+                music.connects += 1
+                if music.fail_connects:
+                    music.fail_connects -= 1
+                    raise ConnectionError("handshake failed")
+                session = MagicMock()
+                for name in ("set_weighted_prompts", "set_music_generation_config",
+                             "play", "stop", "reset_context"):
+                    setattr(session, name, AsyncMock())
+
+                async def receive():
+                    yield _message(b"\x00" * (48000 * 4))
+                session.receive = receive
+                return session
+
+            async def __aexit__(self, *exc):
+                music.closes += 1
+                return False
+        return _Ctx()
+
+
+def _pool(size, music):
+    client = MagicMock()
+    client.aio.live.music = music
+    return mod.LyriaSessionPool(size=size, client=client)
+
+
+class TestLyriaSessionPool:
+
+    @pytest.mark.asyncio
+    async def test_warm_opens_sessions_up_front(self):
+        music = _FakeMusic()
+        pool = _pool(3, music)
+
+        assert await pool.warm() == 3
+        assert music.connects == 3
+        assert pool.stats()["idle"] == 3
+
+    @pytest.mark.asyncio
+    async def test_released_session_is_reused(self):
+        music = _FakeMusic()
+        pool = _pool(1, music)
+
+        first = await pool.acquire()
+        await pool.release(first)
+        second = await pool.acquire()
+
+        assert second is first
+        assert music.connects == 1
+        first.session.reset_context.assert_awaited()
+
+    @pytest.mark.asyncio
+    async def test_waits_when_exhausted(self):
+        pool = _pool(1, _FakeMusic())
+        held = await pool.acquire()
+
+        waiter = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert pool.stats()["waiting"] == 1
+
+        await pool.release(held)
+        assert await waiter is held
+        assert pool.stats()["wait_seconds_max"] >= 0.05
+
+    @pytest.mark.asyncio
+    async def test_unhealthy_session_is_recycled(self):
+        music = _FakeMusic()
+        pool = _pool(1, music)
+
+        broken = await pool.acquire()
+        await pool.release(broken, healthy=False)
+        await asyncio.sleep(0)
+        fresh = await pool.acquire()
+
+        assert fresh is not broken
+        assert music.closes == 1
+        assert pool.stats()["recycled"] == 1
+
+    @pytest.mark.asyncio
+    @patch.object(mod, "TARGET_SECONDS", 1)
+    async def test_async_generation_uses_pool(self, tmp_path):
+        pool = _pool(1, _FakeMusic())
+        path = str(tmp_path / "inst.wav")
+
+        result = await mod.generate_instrumental_async("lofi", 90, path, pool=pool)
+
+        assert result == path
+        with wave.open(path, "rb") as wav:
+            assert wav.getnframes() == 48000
+        reused = await pool.acquire()
+        reused.session.stop.assert_awaited()
+        reused.session.reset_context.assert_awaited()
+        assert pool.stats()["acquired"] == 2 and pool.stats()["open"] == 1
+
+    @pytest.mark.asyncio
+    async def test_leftover_audio_is_drained_before_reuse(self):
+        pool = _pool(1, _FakeMusic())
+        first = await pool.acquire()
+        leftover = []
+
+        async def receive():
+            leftover.append(True)
+            yield _message(b"\x00" * 4)
+        first.session.receive = receive
+
+        await pool.release(first)
+        assert await pool.acquire() is first
+        assert leftover == [True]
+
+    @pytest.mark.asyncio
+    @patch.object(mod, "DRAIN_QUIET_SECONDS", 0.01)
+    @patch.object(mod, "DRAIN_MAX_SECONDS", 0.05)
+    async def test_session_that_keeps_streaming_is_replaced(self):
+        music = _FakeMusic()
+        pool = _pool(1, music)
+        noisy = await pool.acquire()
+
+        async def receive():
+            while True:
+                await asyncio.sleep(0.001)
+                yield _message(b"\x00" * 4)
+        noisy.session.receive = receive
+
+        await pool.release(noisy)
+        fresh = await pool.acquire()
+
+        assert fresh is not noisy
+        assert music.closes == 1 and pool.stats()["recycled"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_idle_session_is_not_handed_out(self, monkeypatch):
+        music = _FakeMusic()
+        pool = _pool(1, music)
+        await pool.warm()
+        monkeypatch.setattr(mod, "SESSION_MAX_IDLE_SECONDS", 0)
+
+        await pool.acquire()
+        await asyncio.sleep(0)
+
+        assert music.connects == 2 and music.closes == 1
+        assert pool.stats()["expired"] == 1 and pool.stats()["open"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_generation_returns_its_slot(self, tmp_path, monkeypatch):
+        music = _FakeMusic()
+        pool = _pool(1, music)
+        streaming = asyncio.Event()
+
+        async def stream_forever(*args):
+            streaming.set()
+            await asyncio.Event().wait()
+        monkeypatch.setattr(mod, "_stream_session", stream_forever)
+
+        generation = asyncio.create_task(mod.generate_instrumental_async("lofi", 90, str(tmp_path / "i.wav"),
+                                                                         pool=pool))
+        await streaming.wait()
+        generation.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await generation
+
+        fresh = await asyncio.wait_for(pool.acquire(), 1)
+        assert music.closes == 1 and pool.stats()["open"] == 1
+        assert fresh.session is not None
+
+    @pytest.mark.asyncio
+    async def test_cancelled_connect_returns_its_slot(self, monkeypatch):
+        pool = _pool(1, _FakeMusic())
+        connecting = asyncio.Event()
+
+        async def hang():
+            connecting.set()
+            await asyncio.Event().wait()
+        monkeypatch.setattr(pool, "_connect", hang)
+
+        waiter = asyncio.create_task(pool.acquire())
+        await connecting.wait()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        assert pool.stats()["open"] == 0
+
+    @pytest.mark.asyncio
+    @patch.object(mod, "TARGET_SECONDS", 1)
+    async def test_failed_connect_releases_slot(self, tmp_path):
+        pool = _pool(1, _FakeMusic(fail_connects=1))
+
+        with pytest.raises(ConnectionError):
+            await pool.acquire()
+        assert pool.stats()["open"] == 0
+        assert await mod.generate_instrumental_async("lofi", 90, str(tmp_path / "i.wav"), pool=pool)
@@ -0,0 +1,100 @@
+"""Unit tests for services/metrics_module.py — exposition format, histograms and provider tracing."""
+
+import asyncio
+import pytest
+
+from services.metrics_module import (
+    Counter, Gauge, Histogram, render, request_trace, track, timed, observe_stage_event,
+    PROVIDER_ERRORS, PROVIDER_SECONDS, STAGE_SECONDS, STAGE_ERRORS,
+)
+
+
+class TestExposition:
+
+    def test_counter_rendered_with_labels(self):
+        counter = Counter("test_requests_total", "Requests.", ("route",))
+        counter.inc(route="/a")
+        counter.inc(2, route="/a")
+
+        text = render()
+
+        assert "# TYPE test_requests_total counter" in text
+        assert 'test_requests_total{route="/a"} 3' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        hist = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1))
+        hist.observe(0.05)
+        hist.observe(0.5)
+        hist.observe(5)
+
+        text = render()
+
+        assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'test_latency_seconds_bucket{le="1.0"} 2' in text
+        assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+        assert "test_latency_seconds_count 3" in text
+
+    def test_callback_gauge_reads_current_value(self):
+        state = {"n": 1}
+        Gauge("test_queue_depth", "Depth.", fn=lambda: state["n"])
+        state["n"] = 7
+
+        assert "test_queue_depth 7" in render()
+
+    def test_label_values_escaped(self):
+        counter = Counter("test_escaped_total", "Escaping.", ("msg",))
+        counter.inc(msg='say "hi"')
+
+        assert 'test_escaped_total{msg="say \\"hi\\""} 1' in render()
+
+
+class TestTracking:
+
+    def test_sync_call_timed_and_traced(self):
+        @track("testprov", "ok")
+        def work():
+            return 42
+
+        with request_trace() as calls:
+            assert work() == 42
+
+        assert calls[0]["provider"] == "testprov" and calls[0]["operation"] == "ok"
+        assert PROVIDER_SECONDS.get(provider="testprov", operation="ok")["count"] >= 1
+
+    def test_exception_counted_and_reraised(self):
+        @track("testprov", "fails")
+        def work():
+            raise ValueError("nope")
+
+        before = PROVIDER_ERRORS.get(provider="testprov", operation="fails")
+        with request_trace() as calls, pytest.raises(ValueError):
+            work()
+
+        assert PROVIDER_ERRORS.get(provider="testprov", operation="fails") == before + 1
+        assert calls[0]["error"] == "ValueError"
+
+    @pytest.mark.asyncio
+    async def test_calls_in_threads_reach_the_trace(self):
+        def blocking():
+            with timed("testprov", "threaded"):
+                pass
+
+        @track("testprov", "async")
+        async def work():
+            await asyncio.to_thread(blocking)
+
+        with request_trace() as calls:
+            await work()
+
+        assert [c["operation"] for c in calls] == ["threaded", "async"]
+
+    def test_no_trace_outside_request(self):
+        with timed("testprov", "untraced"):
+            pass  # must not fail without an active trace
+
+    def test_stage_events_feed_histograms(self):
+        observe_stage_event("stage_finished", {"stage": "test_stage", "seconds": 0.2})
+        observe_stage_event("stage_failed", {"stage": "test_stage", "error": "x", "seconds": None})
+
+        assert STAGE_SECONDS.get(stage="test_stage")["count"] == 1
+        assert STAGE_ERRORS.get(stage="test_stage") == 1
@@ -1,6 +1,8 @@
 """Integration tests for pipeline.py — verifies TTS/STS conditional routing."""
 
 import os
+import asyncio
+import threading
 import pytest
 from unittest.mock import patch, AsyncMock
 from pydub import AudioSegment
@@ -8,23 +10,39 @@ from pydub import AudioSegment
 from pipeline import run_pipeline
 
 
+@pytest.fixture(autouse=True)
+def isolated_workdir(tmp_path, monkeypatch):
+    """Run from tmp_path, so uploads, stems and final mixes land in its temp/ rather than the repo's."""
+    monkeypatch.chdir(tmp_path)
+
+
 def _make_dummy_audio(path):
     """Write a minimal audio file so pydub can load it."""
     fmt = "wav" if path.endswith(".wav") else "mp3"
     AudioSegment.silent(duration=1000).export(path, format=fmt)
 
 
+def _padded_memo(tmp_path) -> str:
+    """A tone with two seconds of silence either side, so the VAD writes a trimmed copy."""
+    from pydub.generators import Sine
+    path = str(tmp_path / "input.wav")
+    silence = AudioSegment.silent(duration=2000)
+    (silence + Sine(220).to_audio_segment(duration=1000, volume=-10) + silence).export(path, format="wav")
+    return path
+
+
 def _side_effect_instrumental(style_prompt, bpm, output_path):
     _make_dummy_audio(output_path)
     return output_path
 
 
-def _side_effect_tts(lyrics, output_path, voice_id=None, voice_stability=0.3, voice_similarity=0.75, voice_style=0.45):
+def _side_effect_tts(lyrics, output_path, voice_id=None, voice_stability=0.3, voice_similarity=0.75, voice_style=0.45,
+                     sections=None):
     _make_dummy_audio(output_path)
     return output_path
 
 
-def _side_effect_sts(audio_path, output_path, voice_id=None):
+def _side_effect_sts(audio_path, output_path, voice_id=None, fingerprint=None):
     _make_dummy_audio(output_path)
     return output_path
 
@@ -54,9 +72,9 @@ class TestHummingRouting:
     """When contains_lyrics is False, pipeline routes to STS."""
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=HUMMING_GEMINI)
@@ -76,9 +94,9 @@ class TestHummingRouting:
         mock_tts.assert_not_called()
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=HUMMING_GEMINI)
@@ -100,13 +118,50 @@ class TestHummingRouting:
         assert result["bpm"] == 90
 
 
+    @pytest.mark.asyncio
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
+    @patch("pipeline.get_gemini_analysis", return_value=HUMMING_GEMINI)
+    @patch("pipeline.transcribe_audio", return_value="hmm hmm")
+    async def test_whisper_gets_trimmed_memo_and_sts_the_original(
+        self, mock_transcribe, mock_gemini, mock_tts, mock_sts,
+        mock_instrumental, mock_store, mock_refine, tmp_path
+    ):
+        input_file = _padded_memo(tmp_path)
+
+        await run_pipeline(input_file, "jazz")
+
+        trimmed = mock_transcribe.call_args[0][0]
+        assert trimmed.startswith("temp/speech_") and mock_sts.call_args[0][0] == input_file
+        assert not os.path.exists(trimmed)  # cleaned up after the run
+
+    @pytest.mark.asyncio
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=RuntimeError("lyria down"))
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.get_gemini_analysis", return_value=HUMMING_GEMINI)
+    @patch("pipeline.transcribe_audio", return_value="hmm hmm")
+    async def test_trimmed_memo_removed_when_run_fails(
+        self, mock_transcribe, mock_gemini, mock_sts, mock_instrumental, mock_store, mock_refine, tmp_path
+    ):
+        with pytest.raises(Exception):
+            await run_pipeline(_padded_memo(tmp_path), "jazz")
+
+        trimmed = mock_transcribe.call_args[0][0]
+        assert trimmed.startswith("temp/speech_") and not os.path.exists(trimmed)
+
+
 class TestLyricsRouting:
     """When contains_lyrics is True, pipeline routes to TTS."""
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
@@ -126,9 +181,9 @@ class TestLyricsRouting:
         mock_sts.assert_not_called()
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value="polished lyrics")
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value="polished lyrics")
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
@@ -151,9 +206,9 @@ class TestPipelineOutput:
     """Verify the pipeline produces the expected output."""
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
@@ -175,9 +230,9 @@ class TestPipelineOutput:
         assert result["genre"] == "pop"
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock, side_effect=Exception("down"))
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session", side_effect=Exception("down"))
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
@@ -195,9 +250,9 @@ class TestPipelineOutput:
         assert "output_path" in result
 
     @pytest.mark.asyncio
-    @patch("pipeline.refine_lyrics", return_value=None)
-    @patch("pipeline.store_session", new_callable=AsyncMock)
-    @patch("pipeline.generate_instrumental", side_effect=_side_effect_instrumental)
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
     @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
     @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
     @patch("pipeline.get_gemini_analysis", return_value={
@@ -219,3 +274,122 @@ class TestPipelineOutput:
 
         assert result["mood"] == "neutral"
         assert result["bpm"] == 120
+
+
+class TestStageScheduling:
+    """The pipeline runs as a stage graph rather than a fixed sequence."""
+
+    @pytest.mark.asyncio
+    @patch("pipeline.store_session")
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
+    @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
+    @patch("pipeline.transcribe_audio", return_value="I walk alone tonight")
+    async def test_lyria_starts_while_lyrics_are_refined(
+        self, mock_transcribe, mock_gemini, mock_tts, mock_sts, mock_store, tmp_path
+    ):
+        lyria_started = asyncio.Event()
+
+        async def slow_refine(lyrics, genre, mood):
+            await asyncio.wait_for(lyria_started.wait(), timeout=2)
+            return "refined"
+
+        async def instrumental(style_prompt, bpm, output_path):
+            lyria_started.set()
+            return _side_effect_instrumental(style_prompt, bpm, output_path)
+
+        input_file = str(tmp_path / "input.webm")
+        with open(input_file, "wb") as f:
+            f.write(b"dummy")
+
+        with patch("pipeline.refine_lyrics", new_callable=AsyncMock, side_effect=slow_refine), \
+                patch("pipeline.generate_instrumental_async", side_effect=instrumental):
+            result = await run_pipeline(input_file, "pop")
+
+        assert result["lyrics"] == "refined"
+        assert mock_tts.call_args[0][0] == "refined"
+
+    @pytest.mark.asyncio
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
+    @patch("pipeline.transcribe_audio", return_value="I walk alone tonight")
+    async def test_lyria_starts_while_lyrics_stream(
+        self, mock_transcribe, mock_tts, mock_sts, mock_store, mock_refine, tmp_path
+    ):
+        lyria_started = threading.Event()
+
+        def streaming_gemini(transcript, genre, fresh, on_field):
+            on_field("style_prompt", LYRICS_GEMINI["style_prompt"])
+            on_field("bpm", "128 BPM")
+            assert lyria_started.wait(timeout=2), "Lyria waited for the full analysis"
+            return {**LYRICS_GEMINI, "bpm": "128 BPM"}
+
+        async def instrumental(style_prompt, bpm, output_path):
+            lyria_started.set()
+            return _side_effect_instrumental(style_prompt, bpm, output_path)
+
+        input_file = str(tmp_path / "input.webm")
+        with open(input_file, "wb") as f:
+            f.write(b"dummy")
+
+        with patch("pipeline.get_gemini_analysis", side_effect=streaming_gemini), \
+                patch("pipeline.generate_instrumental_async", side_effect=instrumental) as mock_instrumental:
+            result = await run_pipeline(input_file, "pop")
+
+        assert mock_instrumental.call_args[0][:2] == (LYRICS_GEMINI["style_prompt"], 128)
+        assert result["bpm"] == 128
+
+    @pytest.mark.asyncio
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
+    @patch("pipeline.get_gemini_analysis", return_value=LYRICS_GEMINI)
+    @patch("pipeline.transcribe_audio", return_value="hello")
+    async def test_reports_critical_path(
+        self, mock_transcribe, mock_gemini, mock_tts, mock_sts,
+        mock_instrumental, mock_refine, tmp_path
+    ):
+        input_file = str(tmp_path / "input.webm")
+        with open(input_file, "wb") as f:
+            f.write(b"dummy")
+
+        with patch("pipeline.store_session"):
+            result = await run_pipeline(input_file, "pop")
+
+        path = result["timings"]["critical_path"]
+        assert path[:2] == ["transcribe", "analyze"]
+        assert path[-1] == "mix"
+        assert "store_session" not in path
+
+
+class TestDirectAudioMode:
+    """direct_audio sends the memo to Gemini and skips local Whisper."""
+
+    @pytest.mark.asyncio
+    @patch("pipeline.refine_lyrics", new_callable=AsyncMock, return_value=None)
+    @patch("pipeline.store_session")
+    @patch("pipeline.generate_instrumental_async", new_callable=AsyncMock, side_effect=_side_effect_instrumental)
+    @patch("pipeline.convert_speech_to_speech", side_effect=_side_effect_sts)
+    @patch("pipeline.synthesize_vocals", side_effect=_side_effect_tts)
+    @patch("pipeline.get_gemini_analysis")
+    @patch("pipeline.get_gemini_audio_analysis", return_value={**LYRICS_GEMINI, "transcript": "I walk alone"})
+    @patch("pipeline.transcribe_audio")
+    async def test_one_gemini_call_replaces_whisper(
+        self, mock_transcribe, mock_audio_analysis, mock_gemini, mock_tts, mock_sts,
+        mock_instrumental, mock_store, mock_refine, tmp_path
+    ):
+        input_file = str(tmp_path / "input.webm")
+        with open(input_file, "wb") as f:
+            f.write(b"dummy")
+
+        result = await run_pipeline(input_file, "pop", direct_audio=True)
+
+        mock_transcribe.assert_not_called()
+        mock_gemini.assert_not_called()
+        assert mock_audio_analysis.call_args[0][:2] == (input_file, "pop")
+        assert mock_store.call_args[0][0] == "I walk alone"
+        assert result["timings"]["analysis_mode"] == "direct_audio"
+        assert result["timings"]["critical_path"][0] == "listen"
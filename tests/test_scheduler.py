@@ -0,0 +1,144 @@
+"""Unit tests for scheduler.py — stage graph ordering, parallelism and critical path."""
+
+import asyncio
+import pytest
+
+from scheduler import Stage, StageGraph
+
+
+def _stage(name, inputs=(), outputs=(), delay=0.0, log=None, **kwargs):
+    async def fn(ctx):
+        if log is not None:
+            log.append(("start", name))
+        await asyncio.sleep(delay)
+        if log is not None:
+            log.append(("end", name))
+        return {key: f"{name}:{key}" for key in outputs}
+    return Stage(name, fn, inputs=inputs, outputs=outputs, **kwargs)
+
+
+class TestStageGraph:
+
+    @pytest.mark.asyncio
+    async def test_independent_stages_run_in_parallel(self):
+        log = []
+        graph = StageGraph([
+            _stage("a", outputs=("x",), log=log),
+            _stage("b", inputs=("x",), outputs=("y",), delay=0.05, log=log),
+            _stage("c", inputs=("x",), outputs=("z",), delay=0.05, log=log),
+        ])
+
+        await graph.run({})
+
+        assert log.index(("start", "c")) < log.index(("end", "b"))
+
+    @pytest.mark.asyncio
+    async def test_values_flow_between_stages(self):
+        async def double(ctx):
+            return {"y": ctx["x"] * 2}
+
+        report = await StageGraph([Stage("double", double, inputs=("x",), outputs=("y",))]).run({"x": 21})
+
+        assert report.values["y"] == 42
+
+    @pytest.mark.asyncio
+    async def test_background_stage_does_not_block(self):
+        graph = StageGraph([
+            _stage("a", outputs=("x",)),
+            _stage("slow", inputs=("x",), delay=1.0, background=True),
+            _stage("b", inputs=("x",), outputs=("y",)),
+        ])
+
+        report = await asyncio.wait_for(graph.run({}), timeout=0.5)
+
+        assert "slow" not in report.critical_path
+        assert report.values["y"] == "b:y"
+
+    @pytest.mark.asyncio
+    async def test_failure_propagates_to_caller(self):
+        async def boom(ctx):
+            raise RuntimeError("boom")
+
+        graph = StageGraph([
+            Stage("a", boom, outputs=("x",)),
+            _stage("b", inputs=("x",), outputs=("y",)),
+        ])
+
+        with pytest.raises(RuntimeError, match="boom"):
+            await graph.run({})
+
+    @pytest.mark.asyncio
+    async def test_emit_unblocks_dependents_early(self):
+        log = []
+
+        async def producer(ctx):
+            ctx.emit("early", 1)
+            await asyncio.sleep(0.05)
+            log.append("producer done")
+            return {"late": 2}
+
+        async def consumer(ctx):
+            log.append("consumer ran")
+            return {"out": ctx["early"]}
+
+        graph = StageGraph([
+            Stage("producer", producer, outputs=("early", "late")),
+            Stage("consumer", consumer, inputs=("early",), outputs=("out",)),
+        ])
+        await graph.run({})
+
+        assert log == ["consumer ran", "producer done"]
+
+    @pytest.mark.asyncio
+    async def test_lazy_input_only_awaited_on_request(self):
+        async def maybe(ctx):
+            if ctx["need"]:
+                return {"out": await ctx.get("slow_value")}
+            return {"out": "skipped"}
+
+        graph = StageGraph([
+            _stage("slow", outputs=("slow_value",), delay=0.2),
+            Stage("maybe", maybe, inputs=("need",), lazy_inputs=("slow_value",), outputs=("out",)),
+        ])
+        report = await graph.run({"need": False})
+
+        assert report.timings["maybe"].end < 0.1
+
+    @pytest.mark.asyncio
+    async def test_critical_path_follows_slowest_chain(self):
+        graph = StageGraph([
+            _stage("a", outputs=("x",), delay=0.01),
+            _stage("fast", inputs=("x",), outputs=("y",), delay=0.01),
+            _stage("slow", inputs=("x",), outputs=("z",), delay=0.08),
+            _stage("join", inputs=("y", "z"), outputs=("out",)),
+        ])
+
+        report = await graph.run({})
+
+        assert report.critical_path == ["a", "slow", "join"]
+        assert set(report.summary()["stages"]) == {"a", "fast", "slow", "join"}
+
+    @pytest.mark.asyncio
+    async def test_events_reported(self):
+        events = []
+        graph = StageGraph([_stage("a", outputs=("x",))])
+
+        await graph.run({}, on_event=lambda event, data: events.append((event, data["stage"])))
+
+        assert events == [("stage_started", "a"), ("stage_finished", "a")]
+
+    def test_duplicate_producer_rejected(self):
+        with pytest.raises(ValueError):
+            StageGraph([_stage("a", outputs=("x",)), _stage("b", outputs=("x",))])
+
+    def test_cycle_rejected(self):
+        with pytest.raises(ValueError, match="cycle"):
+            StageGraph([
+                _stage("a", inputs=("y",), outputs=("x",)),
+                _stage("b", inputs=("x",), outputs=("y",)),
+            ])
+
+    @pytest.mark.asyncio
+    async def test_missing_input_rejected(self):
+        with pytest.raises(ValueError, match="nobody"):
+            await StageGraph([_stage("a", inputs=("nobody",))]).run({})
@@ -0,0 +1,210 @@
+"""Unit tests for services/shopify_module.py — stable SKUs, rate limiting and bulk publishing."""
+import asyncio
+import subprocess
+import sys
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from services import shopify_module
+from services.shopify_module import LeakyBucket, product_sku, create_vinyl_product, publish_catalog
+
+TRACK = {"song_title": "Midnight Walk", "lyrics": "I walk alone", "genre": "Pop", "mood": "dreamy",
+         "bpm": 120, "key": "A minor"}
+
+
+def _response(status: int, body: dict = None, headers: dict = None) -> MagicMock:
+    resp = MagicMock()
+    resp.status = status
+    resp.headers = headers or {}
+    resp.json = AsyncMock(return_value=body or {})
+    resp.text = AsyncMock(return_value="error body")
+    ctx = MagicMock()
+    ctx.__aenter__ = AsyncMock(return_value=resp)
+    ctx.__aexit__ = AsyncMock(return_value=False)
+    return ctx
+
+
+@pytest.fixture(autouse=True)
+def shopify_env(monkeypatch):
+    monkeypatch.setenv("SHOPIFY_ADMIN_TOKEN", "token")
+    monkeypatch.setenv("NEXT_PUBLIC_SHOPIFY_STORE_DOMAIN", "shop.example.com")
+    monkeypatch.setattr(shopify_module, "_bucket", LeakyBucket())
+
+
+class TestSku:
+
+    def test_stable_across_processes(self):
+        code = ("from services.shopify_module import product_sku; "
+                "print(product_sku('Midnight Walk', 'I walk alone', 'Pop', 'dreamy', 120, 'A minor'))")
+        runs = {subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout.strip()
+                for _ in range(2)}
+
+        assert runs == {product_sku(**TRACK)}
+
+    def test_differs_per_track(self):
+        assert product_sku(**TRACK) != product_sku(**{**TRACK, "lyrics": "I walk together"})
+        assert product_sku(**TRACK).startswith("MM-VINYL-")
+
+
+class TestLeakyBucket:
+
+    @pytest.mark.asyncio
+    async def test_waits_once_full(self):
+        bucket = LeakyBucket(size=2, leak_rate=20)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        for _ in range(3):
+            await bucket.acquire()
+
+        assert loop.time() - started >= 0.04
+
+    def test_resyncs_from_call_limit_header(self):
+        bucket = LeakyBucket()
+        bucket.update("32/80")
+
+        assert bucket.size == 80 and bucket.level == pytest.approx(32, abs=0.1)
+        bucket.update(None)
+        assert bucket.size == 80
+
+
+class TestCreateProduct:
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.get_session")
+    async def test_creates_with_stable_sku_and_handle(self, mock_get_session):
+        mock_get_session.return_value.request = MagicMock(side_effect=[
+            _response(200, {"products": []}),
+            _response(201, {"product": {"id": 7, "handle": "midnight-walk-x"}}, {"X-Shopify-Shop-Api-Call-Limit": "2/40"}),
+        ])
+
+        result = await create_vinyl_product(**TRACK)
+
+        assert result["status"] == "created" and result["product_id"] == 7
+        payload = mock_get_session.return_value.request.call_args.kwargs["json"]["product"]
+        assert payload["variants"][0]["sku"] == product_sku(**TRACK)
+        assert payload["handle"].startswith("midnight-walk-")
+        assert shopify_module._bucket.level == pytest.approx(2, abs=0.1)
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.get_session")
+    async def test_retry_finds_existing_product(self, mock_get_session):
+        mock_get_session.return_value.request = MagicMock(return_value=_response(200, {
+            "products": [{"id": 7, "handle": "midnight-walk-x"}]}))
+
+        result = await create_vinyl_product(**TRACK)
+
+        assert result["status"] == "exists" and result["product_id"] == 7
+        assert mock_get_session.return_value.request.call_count == 1
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.get_session")
+    async def test_throttled_call_is_retried_after_retry_after(self, mock_get_session):
+        mock_get_session.return_value.request = MagicMock(side_effect=[
+            _response(429, headers={"Retry-After": "0.1"}),
+            _response(200, {"products": []}),
+            _response(201, {"product": {"id": 8, "handle": "h"}}),
+        ])
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await create_vinyl_product(**TRACK)
+
+        assert result["status"] == "created"
+        assert loop.time() - started >= 0.09
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.get_session")
+    async def test_error_status_is_reported(self, mock_get_session):
+        mock_get_session.return_value.request = MagicMock(return_value=_response(422))
+
+        result = await create_vinyl_product(**TRACK)
+
+        assert result["error"].startswith("Shopify API error 422")
+
+    @pytest.mark.asyncio
+    async def test_not_configured(self, monkeypatch):
+        monkeypatch.delenv("SHOPIFY_ADMIN_TOKEN")
+
+        assert await create_vinyl_product(**TRACK) == {"error": "Shopify Admin API not configured"}
+
+
+class TestPublishCatalog:
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.create_vinyl_product", new_callable=AsyncMock)
+    async def test_reports_status_per_item_in_order(self, mock_create):
+        mock_create.side_effect = [
+            {"product_id": 1, "status": "created"},
+            {"error": "Shopify API error 422: bad"},
+            {"product_id": 3, "status": "exists"},
+        ]
+
+        results = await publish_catalog([TRACK, {**TRACK, "song_title": "B"}, {**TRACK, "song_title": "C"}])
+
+        assert [(r["index"], r["status"]) for r in results] == [(0, "created"), (1, "failed"), (2, "exists")]
+        assert results[1]["error"].endswith("bad")
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.create_vinyl_product", new_callable=AsyncMock)
+    async def test_repeated_track_published_once(self, mock_create):
+        mock_create.side_effect = [{"product_id": 1, "status": "created"}, {"product_id": 2, "status": "created"}]
+        other = {**TRACK, "song_title": "B"}
+
+        results = await publish_catalog([TRACK, other, dict(TRACK)])
+
+        assert mock_create.await_count == 2
+        assert [(r["index"], r["product_id"]) for r in results] == [(0, 1), (1, 2), (2, 1)]
+
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.create_vinyl_product", new_callable=AsyncMock)
+    async def test_malformed_items_fail_alone(self, mock_create):
+        mock_create.side_effect = [{"product_id": 1, "status": "created"}, {"product_id": 2, "status": "created"}]
+        tracks = [TRACK, {**TRACK, "song_title": "B", "genre": None, "bpm": "96"},
+                  {**TRACK, "song_title": "C", "bpm": "fast"}]
+
+        results = await publish_catalog(tracks)
+
+        assert [(r["index"], r["status"]) for r in results] == [(0, "created"), (1, "created"), (2, "failed")]
+        assert results[2]["error"].startswith("ValueError")
+        assert mock_create.await_args_list[1].kwargs["genre"] == ""
+        assert mock_create.await_args_list[1].kwargs["bpm"] == 96
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.create_vinyl_product", new_callable=AsyncMock)
+    async def test_unexpected_error_fails_only_its_item(self, mock_create):
+        mock_create.side_effect = [{"product_id": 1, "status": "created"}, AttributeError("boom")]
+
+        results = await publish_catalog([TRACK, {**TRACK, "song_title": "B"}])
+
+        assert [r["status"] for r in results] == ["created", "failed"]
+        assert results[1]["error"] == "AttributeError: boom"
+
+
+class TestConcurrentPublish:
+
+    @pytest.mark.asyncio
+    @patch("services.shopify_module.get_session")
+    async def test_same_track_created_once(self, mock_get_session):
+        created = []
+
+        def request(method, url, **kwargs):
+            if method == "POST":
+                created.append(kwargs["json"]["product"]["handle"])
+                return _response(201, {"product": {"id": 7, "handle": created[-1]}})
+            lookup = _response(200, {"products": [{"id": 7, "handle": created[0]}] if created else []})
+            response = lookup.__aenter__.return_value
+
+            async def slow_lookup():
+                # Without the lock, both publishes would find nothing before either creates
+                await asyncio.sleep(0.01)
+                return response
+            lookup.__aenter__ = AsyncMock(side_effect=slow_lookup)
+            return lookup
+        mock_get_session.return_value.request = MagicMock(side_effect=request)
+
+        first, second = await asyncio.gather(create_vinyl_product(**TRACK), create_vinyl_product(**TRACK))
+
+        assert len(created) == 1
+        assert sorted((first["status"], second["status"])) == ["created", "exists"]
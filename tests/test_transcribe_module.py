@@ -62,3 +62,312 @@ class TestTranscribeAudio:
 
         mod.transcribe_audio("/path/to/recording.webm")
         mock_model.transcribe.assert_called_with("/path/to/recording.webm")
+
+
+class _RecordingModel:
+    """Stand-in model that records call order and echoes the path."""
+
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+
+    def transcribe(self, audio_path):
+        if self.gate is not None and not self.calls:
+            self.gate.wait(timeout=2)
+        self.calls.append(audio_path)
+        return f"text of {audio_path}"
+
+
+def _load_recording_model():
+    return _RecordingModel()
+
+
+class TestTranscriptionPool:
+    """Tests for the shortest-first Whisper worker pool."""
+
+    def test_workers_load_model_in_initializer(self):
+        import services.transcribe_module as mod
+        pool = mod.TranscriptionPool(workers=2, max_batch=1, loader=_load_recording_model)
+        pool.start()
+        try:
+            futures = [pool.submit(f"clip{i}.webm") for i in range(4)]
+            assert [f.result(timeout=10) for f in futures] == [f"text of clip{i}.webm" for i in range(4)]
+        finally:
+            pool.shutdown()
+
+    def test_queued_jobs_dispatched_smallest_first(self, tmp_path, monkeypatch):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+
+        gate = threading.Event()
+        model = _RecordingModel(gate)
+        monkeypatch.setattr(mod, "_model", model)
+        paths = {}
+        for name, size in [("blocker", 1), ("large", 3000), ("small", 10), ("medium", 500)]:
+            paths[name] = tmp_path / f"{name}.webm"
+            paths[name].write_bytes(b"\0" * size)
+
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1), max_batch=1)
+        futures = [pool.submit(str(paths["blocker"]))]
+        futures += [pool.submit(str(paths[name])) for name in ("large", "small", "medium")]
+        assert pool.stats()["running"] == 1 and pool.stats()["queued"] == 3
+        gate.set()
+        for f in futures:
+            f.result(timeout=5)
+
+        assert [p.rsplit("/", 1)[-1] for p in model.calls] == ["blocker.webm", "small.webm", "medium.webm", "large.webm"]
+
+    def test_worker_error_propagates(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+
+        broken = MagicMock()
+        broken.transcribe.side_effect = RuntimeError("bad audio")
+        monkeypatch.setattr(mod, "_model", broken)
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1))
+
+        with pytest.raises(RuntimeError, match="bad audio"):
+            pool.submit("x.webm").result(timeout=5)
+        assert pool.stats()["running"] == 0
+
+    def test_transcribe_audio_routes_through_pool(self, monkeypatch):
+        import services.transcribe_module as mod
+        pool = MagicMock()
+        pool.submit.return_value.result.return_value = "from pool"
+        monkeypatch.setattr(mod, "_pool", pool)
+
+        assert mod.transcribe_audio("a.webm") == "from pool"
+        pool.submit.assert_called_once_with("a.webm")
+
+
+class _BatchModel:
+    """Stand-in backend whose batch calls are recorded; paths containing 'bad' fail."""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def transcribe(self, audio_path):
+        if self.gate is not None:
+            self.gate.wait(timeout=2)
+        self.batches.append([audio_path])
+        return f"text of {audio_path}"
+
+    def transcribe_batch(self, audio_paths):
+        self.batches.append(list(audio_paths))
+        return [ValueError(p) if "bad" in p else f"text of {p}" for p in audio_paths]
+
+
+class TestBatching:
+    """Tests for micro-batched dispatch."""
+
+    def test_queued_jobs_share_a_batch(self, monkeypatch):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+        gate = threading.Event()
+        model = _BatchModel(gate)
+        monkeypatch.setattr(mod, "_model", model)
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1), max_batch=4, batch_window=0.2)
+
+        futures = [pool.submit(f"memo{i}.wav") for i in range(4)]
+        gate.set()
+
+        assert [f.result(timeout=5) for f in futures] == [f"text of memo{i}.wav" for i in range(4)]
+        assert model.batches == [["memo0.wav"], ["memo1.wav", "memo2.wav", "memo3.wav"]]
+        assert pool.stats()["batches"] == 2 and pool.stats()["jobs"] == 4
+
+    def test_lone_memo_dispatched_without_waiting(self, monkeypatch):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+        monkeypatch.setattr(mod, "_model", _BatchModel())
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1), max_batch=4, batch_window=10)
+
+        start = time.monotonic()
+        assert pool.submit("a.wav").result(timeout=5) == "text of a.wav"
+        assert time.monotonic() - start < 1
+
+    def test_full_batch_dispatched_without_waiting(self, monkeypatch):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+        monkeypatch.setattr(mod, "_model", _BatchModel())
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1), max_batch=2, batch_window=10)
+
+        start = time.monotonic()
+        futures = [pool.submit("a.wav"), pool.submit("b.wav")]
+        [f.result(timeout=5) for f in futures]
+
+        assert time.monotonic() - start < 1
+
+    def test_one_failing_memo_does_not_fail_the_batch(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        import services.transcribe_module as mod
+        import threading
+        gate = threading.Event()
+        monkeypatch.setattr(mod, "_model", _BatchModel(gate))
+        pool = mod.TranscriptionPool(workers=1, executor=ThreadPoolExecutor(1), max_batch=2, batch_window=0.2)
+
+        pool.submit("first.wav")
+        good, bad = pool.submit("good.wav"), pool.submit("bad.wav")
+        gate.set()
+
+        assert good.result(timeout=5) == "text of good.wav"
+        with pytest.raises(ValueError):
+            bad.result(timeout=5)
+
+    def test_whisper_batch_encodes_once_and_decodes_like_transcribe(self, tmp_path, monkeypatch):
+        import torch
+        import services.transcribe_module as mod
+        from pydub import AudioSegment
+        from whisper.tokenizer import get_tokenizer
+
+        for name, ms in [("short", 5000), ("cut", 8000), ("long", 40000)]:
+            AudioSegment.silent(duration=ms, frame_rate=16000).export(str(tmp_path / f"{name}.wav"), format="wav")
+        paths = [str(tmp_path / f"{name}.wav") for name in ("short", "cut", "long", "missing")]
+        tokenizer = get_tokenizer(True, num_languages=99, language="en")
+        ts = tokenizer.timestamp_begin
+        hello = [ts] + tokenizer.encode(" hello") + [ts + 50]
+        cut_off = [ts] + tokenizer.encode(" one") + [ts + 50, ts + 50] + tokenizer.encode(" two")
+
+        backend = mod.WhisperBackend.__new__(mod.WhisperBackend)
+        backend.model = MagicMock(is_multilingual=True, num_languages=99, device=torch.device("cpu"))
+        backend.model.dims.n_mels = 80
+        backend.model.embed_audio.side_effect = lambda mel: torch.zeros(mel.shape[0], 2, 2)
+        backend.transcribe = MagicMock(return_value=" full pass")
+        calls = []
+
+        def fake_decode(model, features, options):
+            calls.append((features.shape[0], options.temperature, options.without_timestamps))
+            if options.temperature == 0.0:
+                # The first memo is too unsure at T=0 and falls back to T=0.2
+                return [MagicMock(tokens=hello, avg_logprob=-2.0, compression_ratio=1.0, no_speech_prob=0.1,
+                                  language="en"),
+                        MagicMock(tokens=cut_off, avg_logprob=-0.2, compression_ratio=1.0, no_speech_prob=0.1,
+                                  language="en")]
+            return [MagicMock(tokens=hello, avg_logprob=-0.3, compression_ratio=1.0, no_speech_prob=0.1,
+                              language="en")]
+        monkeypatch.setattr(mod._whisper(), "decode", fake_decode)
+
+        texts = backend.transcribe_batch(paths)
+
+        assert backend.model.embed_audio.call_count == 1
+        assert backend.model.embed_audio.call_args[0][0].shape == (2, 80, 3000)
+        assert calls == [(2, 0.0, False), (1, 0.2, False)]
+        assert texts[:3] == [" hello", " full pass", " full pass"]
+        assert [c.args[0] for c in backend.transcribe.call_args_list] == paths[1:3]
+        assert isinstance(texts[3], Exception)
+
+
+class TestBackends:
+    """Tests for backend selection."""
+
+    def test_unknown_backend_rejected(self):
+        import services.transcribe_module as mod
+        with pytest.raises(ValueError, match="TRANSCRIBE_BACKEND"):
+            mod.load_backend("nope")
+
+    @patch("services.transcribe_module.whisper")
+    def test_backend_chosen_by_config(self, mock_whisper, monkeypatch):
+        import services.transcribe_module as mod
+        monkeypatch.setattr(mod, "BACKEND", "whisper-int8")
+        monkeypatch.setattr(mod, "_model", None)
+        with patch("torch.ao.quantization.quantize_dynamic", side_effect=lambda m, *a, **k: m):
+            mock_whisper.load_model.return_value.transcribe.return_value = {"text": "quantized"}
+
+            assert mod.transcribe_audio("a.webm") == "quantized"
+
+        assert isinstance(mod._model, mod.QuantizedWhisperBackend)
+        mock_whisper.load_model.return_value.transcribe.assert_called_with("a.webm", fp16=False)
+
+    def test_int8_backend_quantizes_linear_layers(self, monkeypatch):
+        import torch
+        import services.transcribe_module as mod
+        from whisper.model import ModelDimensions, Whisper
+
+        dims = ModelDimensions(n_mels=80, n_audio_ctx=8, n_audio_state=16, n_audio_head=2, n_audio_layer=1,
+                               n_vocab=64, n_text_ctx=8, n_text_state=16, n_text_head=2, n_text_layer=1)
+        monkeypatch.setattr(mod._whisper(), "load_model", lambda name, device=None: Whisper(dims))
+
+        backend = mod.QuantizedWhisperBackend()
+
+        assert isinstance(backend.model.decoder.blocks[0].mlp[0], torch.ao.nn.quantized.dynamic.Linear)
+
+
+class TestTrimSpeech:
+    """Tests for the VAD pre-pass and timestamp mapping."""
+
+    def _memo(self, path):
+        from pydub import AudioSegment
+        from pydub.generators import Sine
+        silence = AudioSegment.silent(duration=1500, frame_rate=16000)
+        tone = Sine(220, sample_rate=16000).to_audio_segment(duration=1000, volume=-10)
+        (silence + tone + silence * 2 + tone + silence).export(path, format="wav")
+
+    def test_writes_only_speech(self, tmp_path):
+        import services.transcribe_module as mod
+        self._memo(str(tmp_path / "memo.wav"))
+
+        trim = mod.trim_speech(str(tmp_path / "memo.wav"), str(tmp_path / "speech.wav"))
+
+        assert trim.path == str(tmp_path / "speech.wav")
+        assert trim.duration == pytest.approx(8.0, abs=0.05)
+        assert 2.0 <= trim.speech_seconds < 3.0
+
+    def test_undecodable_memo_passes_through(self, tmp_path):
+        import services.transcribe_module as mod
+        bad = tmp_path / "bad.webm"
+        bad.write_bytes(b"dummy")
+
+        trim = mod.trim_speech(str(bad), str(tmp_path / "speech.wav"))
+
+        assert trim.path == str(bad) and trim.offsets is None
+
+
+class TestTranscriptCache:
+    """Tests for the content-addressed transcript cache."""
+
+    @pytest.fixture
+    def backend(self, monkeypatch, tmp_path):
+        import services.transcribe_module as mod
+        from services.cache_module import TieredCache
+        monkeypatch.setattr(mod, "TRANSCRIPTS", TieredCache("transcript_test", str(tmp_path / "cache")))
+        monkeypatch.setattr(mod, "_pool", None)
+        backend = MagicMock()
+        backend.transcribe.return_value = "la la la"
+        monkeypatch.setattr(mod, "_model", backend)
+        return backend
+
+    def _export(self, path, fmt):
+        from pydub.generators import Sine
+        Sine(330, sample_rate=16000).to_audio_segment(duration=500, volume=-10).export(path, format=fmt)
+        return path
+
+    def test_same_pcm_in_another_container_hits(self, backend, tmp_path):
+        import services.transcribe_module as mod
+        wav = self._export(str(tmp_path / "memo.wav"), "wav")
+        flac = self._export(str(tmp_path / "memo.flac"), "flac")
+
+        assert mod.transcribe_audio(wav) == "la la la"
+        assert mod.transcribe_audio(flac) == "la la la"
+        backend.transcribe.assert_called_once_with(wav)
+
+    def test_model_name_is_part_of_the_key(self, backend, tmp_path, monkeypatch):
+        import services.transcribe_module as mod
+        wav = self._export(str(tmp_path / "memo.wav"), "wav")
+
+        mod.transcribe_audio(wav)
+        monkeypatch.setattr(mod, "MODEL_NAME", "small")
+        mod.transcribe_audio(wav)
+
+        assert backend.transcribe.call_count == 2
+
+    def test_trim_fingerprint_matches_written_file(self, tmp_path):
+        import services.transcribe_module as mod
+        TestTrimSpeech()._memo(str(tmp_path / "memo.wav"))
+
+        trim = mod.trim_speech(str(tmp_path / "memo.wav"), str(tmp_path / "speech.wav"))
+
+        assert trim.fingerprint == mod.pcm_fingerprint(mod.load_stem(trim.path, mod.TRIM_RATE, 1))